@@ -6,4 +6,63 @@ MONGO_CONFIG = {
     'database': 'traffic_analyzer_db',
 }
 
-SAVE_INTERVAL = 10
+SAVE_INTERVAL = 10   # seconds a pipeline result may stay in the write buffer
+RESULT_BATCH_SIZE = 200
+RESULT_QUEUE_SIZE = 10000
+
+# decode every frame once and share it with the speed and MTLCR pipelines through shared memory
+SHARED_FRAME_DECODING = True
+FRAME_BUS_SLOTS = 16
+FRAME_BUS_CONSUMER_TIMEOUT = 300   # seconds a stalled pipeline may hold the decoder before the video is ended there
+
+# batched detection in the speed pipeline, use bigger batches for recorded files and a short delay for live streams
+SPEED_BATCH_SIZE = 4
+SPEED_MAX_BATCH_DELAY = 0.25
+# batched segmentation in the MTLCR pipeline: recorded files fill whole batches, a live frame waits at most
+# MTLCR_MAX_BATCH_DELAY seconds for the next sampled frames before its batch is segmented
+MTLCR_BATCH_SIZE = 8
+MTLCR_MAX_BATCH_DELAY = 4.0
+# detect only on the rectangle around the configured lanes, grown by this many pixels of the 1080x720 preprocessed
+# frame so vehicles entering a lane are already tracked; None detects on the whole frame
+SPEED_ROI_PADDING = 40
+# skip detection on sampled frames without motion in the lanes, idle night and off-peak footage then costs a
+# downscaled frame difference instead of a model call
+SPEED_MOTION_GATE = True
+
+# adaptive sampling: the distance between analysed frames grows up to the max while a pipeline lags more than
+# SAMPLING_MAX_LAG seconds behind real time or its lanes are empty, and comes back to the min with traffic;
+# a max of None keeps the sampling fixed
+SPEED_FRAMES_INTERVAL = 2       # frames
+SPEED_MAX_FRAMES_INTERVAL = 4   # frames
+MTLCR_INTERVAL = 2              # seconds
+MTLCR_MAX_INTERVAL = 6          # seconds
+SAMPLING_MAX_LAG = 2.0          # seconds
+
+# inference backends: 'auto' picks ONNX Runtime for .onnx models and the native framework otherwise, see
+# inference/export_models.py for the fp16 and int8 exports and inference/compare_backends.py to pick one
+SPEED_MODEL_PATH = 'speed_tracker/models/yolov8x.pt'
+SPEED_BACKEND = 'auto'
+MTLCR_MODEL_PATH = 'mtlcr/models/road_segmentation.h5'
+MTLCR_BACKEND = 'auto'
+INFERENCE_DEVICE = None   # 'cpu', 'cuda:0', 'mps', None detects the best available one
+
+# warm workers keeping the detection and segmentation models loaded between analyses,
+# 0 starts a new process with a cold model for every analysis instead
+SPEED_WORKERS = 1
+MTLCR_WORKERS = 1
+# every worker holds one model and serves this many videos at once, batching their frames under a deadline
+STREAMS_PER_WORKER = 8
+INFERENCE_BATCH_SIZE = 16
+INFERENCE_MAX_BATCH_DELAY = 0.05   # seconds
+WORKER_HEALTH_CHECK_INTERVAL = 10   # seconds between pings
+WORKER_HEALTH_CHECK_TIMEOUT = 60    # seconds without any message before a worker is restarted
+
+# admission control: pipelines of each kind running at once, None derives the limit from the cores and memory of
+# the machine with the per-pipeline estimates below; analyses beyond the limits wait in a queue of MAX_QUEUED_ANALYSES
+MAX_SPEED_PIPELINES = None
+MAX_MTLCR_PIPELINES = None
+SPEED_PIPELINE_CORES = 2
+SPEED_PIPELINE_MEMORY = 2 * 1024 ** 3   # bytes
+MTLCR_PIPELINE_CORES = 1
+MTLCR_PIPELINE_MEMORY = 1024 ** 3       # bytes
+MAX_QUEUED_ANALYSES = 32
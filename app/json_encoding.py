@@ -0,0 +1,41 @@
+import json
+import uuid
+from datetime import datetime, date
+
+from aiohttp import web
+from bson import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (ObjectId, uuid.UUID)):
+        return str(obj)
+    raise TypeError(f"Type {type(obj).__name__} not serializable")
+
+
+# Encodes Mongo documents (datetimes, ObjectIds) in a single pass, with orjson when it is installed.
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+
+    def dumps(obj):
+        return dumps_bytes(obj).decode('utf-8')
+else:
+    def dumps(obj):
+        return json.dumps(obj, default=default)
+
+    def dumps_bytes(obj):
+        return dumps(obj).encode('utf-8')
+
+
+# data is only passed on when given, a status-only response keeps the empty body of web.json_response
+def json_response(*args, **kwargs):
+    return web.json_response(*args, dumps=dumps, **kwargs)
@@ -1,8 +1,12 @@
-from datetime import timedelta, datetime
+from datetime import datetime
 
 import motor.motor_asyncio
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
 
-from app.utils import serialize_date_times
+from app.service.pagination import encode_cursor
+
+DUPLICATE_KEY = 11000
 
 
 class DBService:
@@ -15,6 +19,74 @@ class DBService:
             f"mongodb://{self.mongo_config['username']}:{self.mongo_config['password']}@"
             f"{self.mongo_config['host']}:{self.mongo_config['port']}/admin"
         )
+        await self.ensure_indexes()
+
+    # create_index is a no-op for indexes that already exist
+    async def ensure_indexes(self):
+        db = self.client[self.mongo_config['database']]
+
+        # _id comes last so the keyset sort (created_at desc, _id desc) of the listings is covered by the indexes
+        for results in [db.speed_results, db.mtlcr_results, db.tlir_results]:
+            await results.create_index([('parent_process_id', ASCENDING), ('result.lane_id', ASCENDING),
+                                        ('created_at', DESCENDING), ('_id', DESCENDING)])
+            await results.create_index([('parent_process_id', ASCENDING), ('created_at', DESCENDING),
+                                        ('_id', DESCENDING)])
+
+        await db.composed_results.create_index([('process_id', ASCENDING), ('created_at', DESCENDING),
+                                                ('_id', DESCENDING)])
+        await db.processes.create_index([('created_at', DESCENDING)])
+        await db.processes.create_index([('id', ASCENDING)])
+        await db.videos.create_index([('id', ASCENDING)])
+
+    # keyset pagination over the (created_at desc, _id desc) order used by every result listing
+    @staticmethod
+    def page_filter(res_filter, since=None, until=None, cursor=None):
+        created_at_range = {}
+        if since is not None:
+            created_at_range['$gte'] = since
+        if until is not None:
+            created_at_range['$lt'] = until
+        if created_at_range:
+            res_filter = {**res_filter, 'created_at': created_at_range}
+
+        if cursor is not None:
+            cursor_created_at, cursor_id = cursor
+            res_filter = {'$and': [res_filter, {'$or': [
+                {'created_at': {'$lt': cursor_created_at}},
+                {'created_at': cursor_created_at, '_id': {'$lt': cursor_id}},
+            ]}]}
+
+        return res_filter
+
+    def find_results_page(self, collection_name, res_filter, since=None, until=None, cursor=None, limit=1000):
+        db = self.client[self.mongo_config['database']]
+        page_filter = self.page_filter(res_filter, since, until, cursor)
+        return db[collection_name].find(page_filter).sort([('created_at', -1), ('_id', -1)]).limit(limit)
+
+    def find_speed_results(self, process_id, lane_id=None, **page):
+        res_filter = {'parent_process_id': process_id}
+        if lane_id is not None:
+            res_filter['result.lane_id'] = lane_id
+        return self.find_results_page('speed_results', res_filter, **page)
+
+    def find_mtlcr_results(self, process_id, lane_id=None, **page):
+        res_filter = {'parent_process_id': process_id}
+        if lane_id is not None:
+            res_filter['result.lane_id'] = lane_id
+        return self.find_results_page('mtlcr_results', res_filter, **page)
+
+    def find_composed_results(self, process_id, **page):
+        return self.find_results_page('composed_results', {'process_id': process_id}, **page)
+
+    # insert_many sets the _id of every document, a retried batch is rejected only for the documents written before
+    @staticmethod
+    async def insert_results(collection, documents):
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if e.details.get('writeConcernErrors') or any(error['code'] != DUPLICATE_KEY
+                                                          for error in e.details['writeErrors']):
+                raise
 
     async def close_db(self):
         self.client.close()
@@ -72,18 +144,35 @@ class DBService:
 
     # --------------------- Processing -------------------------- #
 
-    async def insert_active_process(self, parent_process_id, process_id, video_path, process_type):
+    # a queued process is inserted when it is submitted and switched to running when the scheduler starts it
+    async def insert_active_process(self, parent_process_id, process_id, video_path, process_type, status='running',
+                                    priority='normal', mode='live'):
         db = self.client[self.mongo_config['database']]
         processes = db.processes
 
-        await processes.insert_one({
+        now = datetime.utcnow()
+        document = {
             'id': process_id,
             'parent_process_id': parent_process_id,
             'video_source': video_path,
             'type': process_type,
-            'status': 'running',
-            'created_at': datetime.utcnow(),
-        })
+            'priority': priority,
+            'mode': mode,
+            'created_at': now,
+        }
+        update = {'$setOnInsert': document}
+        if status == 'running':
+            update['$set'] = {'status': status, 'started_at': now}
+        else:
+            # never moves a process that already started back to the queue
+            document['status'] = status
+        await processes.update_one({'id': process_id}, update, upsert=True)
+
+    async def cancel_queued_process(self, process_id):
+        db = self.client[self.mongo_config['database']]
+        processes = db.processes
+
+        await processes.update_one({"id": process_id, "status": 'queued'}, {"$set": {'status': 'cancelled'}})
 
     async def finish_active_process(self, process_id):
         db = self.client[self.mongo_config['database']]
@@ -94,86 +183,19 @@ class DBService:
     async def list_processes(self):
         db = self.client[self.mongo_config['database']]
 
-        processes = []
-        for process in await (db.processes.find({}, {"_id": False}).sort("created_at", -1).to_list(length=1000)):
-            process = serialize_date_times(process)
-            processes.append(process)
-
-        return processes
+        return await db.processes.find({}, {"_id": False}).sort("created_at", -1).to_list(length=1000)
 
     # --------------------- Speed Measurements -------------------------- #
 
-    async def insert_speed_result(self, parent_process_id, process_id, timestamp, result):
+    async def insert_speed_results(self, documents):
         db = self.client[self.mongo_config['database']]
-        speed_results = db.speed_results
-        await speed_results.insert_one(
-            {'parent_process_id': parent_process_id, 'process_id': process_id, 'created_at': timestamp,
-             'result': result})
-
-    async def list_speed_results_by_process_id(self, process_id):
-        db = self.client[self.mongo_config['database']]
-
-        speed_results = []
-        for result in await (
-                db.speed_results.find({'parent_process_id': process_id}, {"_id": False}).sort("created_at", -1).to_list(
-                    length=1000)):
-            speed_results.append(result)
-
-        return speed_results
-
-    async def list_speed_results_by_process_and_lane_id(self, process_id, lane_id, newer_than_seconds=None, limit=1000):
-        db = self.client[self.mongo_config['database']]
-
-        if newer_than_seconds is None:
-            res_filter = {'parent_process_id': process_id}
-        else:
-            threshold_time = datetime.utcnow() - timedelta(seconds=newer_than_seconds)
-            res_filter = {'parent_process_id': process_id, "created_at": {"$gt": threshold_time}}
-
-        speed_results = []
-        for result in await (
-                db.speed_results.find(res_filter, {"_id": False}).sort("created_at", -1).to_list(length=limit)):
-            if result['result']['lane_id'] == lane_id:
-                speed_results.append(result)
-
-        return speed_results
+        await self.insert_results(db.speed_results, documents)
 
     # --------------------- MTLCR Measurements -------------------------- #
 
-    async def insert_mtlcr_result(self, parent_process_id, process_id, timestamp, result):
-        db = self.client[self.mongo_config['database']]
-        mtlcr_results = db.mtlcr_results
-        await mtlcr_results.insert_one(
-            {'parent_process_id': parent_process_id, 'process_id': process_id, 'created_at': timestamp,
-             'result': result})
-
-    async def list_mtlcr_results_by_process_id(self, process_id):
+    async def insert_mtlcr_results(self, documents):
         db = self.client[self.mongo_config['database']]
-
-        mtlcr_results = []
-        for result in await (
-                db.mtlcr_results.find({'parent_process_id': process_id}, {"_id": False}).sort("created_at", -1).to_list(
-                    length=1000)):
-            mtlcr_results.append(result)
-
-        return mtlcr_results
-
-    async def list_mtlcr_results_by_process_and_lane_id(self, process_id, lane_id, newer_than_seconds=None, limit=1000):
-        db = self.client[self.mongo_config['database']]
-
-        if newer_than_seconds is None:
-            res_filter = {'parent_process_id': process_id}
-        else:
-            threshold_time = datetime.utcnow() - timedelta(seconds=newer_than_seconds)
-            res_filter = {'parent_process_id': process_id, "created_at": {"$gt": threshold_time}}
-
-        mtlcr_results = []
-        for result in await (
-                db.mtlcr_results.find(res_filter, {"_id": False}).sort("created_at", -1).to_list(length=limit)):
-            if result['result']['lane_id'] == lane_id:
-                mtlcr_results.append(result)
-
-        return mtlcr_results
+        await self.insert_results(db.mtlcr_results, documents)
 
     # --------------------- TLIR Measurements -------------------------- #
 
@@ -183,34 +205,6 @@ class DBService:
         await tlir_results.insert_one(
             {'parent_process_id': parent_process_id, 'created_at': timestamp, 'result': result})
 
-    async def list_tlir_results_by_process_id(self, process_id):
-        db = self.client[self.mongo_config['database']]
-
-        tlir_results = []
-        for result in await (
-                db.tlir_results.find({'parent_process_id': process_id}, {"_id": False}).sort("created_at", -1).to_list(
-                    length=1000)):
-            tlir_results.append(result)
-
-        return tlir_results
-
-    async def list_tlir_results_by_process_and_lane_id(self, process_id, lane_id, newer_than_seconds=None):
-        db = self.client[self.mongo_config['database']]
-
-        if newer_than_seconds is None:
-            res_filter = {'parent_process_id': process_id}
-        else:
-            threshold_time = datetime.utcnow() - timedelta(seconds=newer_than_seconds)
-            res_filter = {'parent_process_id': process_id, "created_at": {"$gt": threshold_time}}
-
-        tlir_results = []
-        for result in await (
-                db.tlir_results.find(res_filter, {"_id": False}).sort("created_at", -1).to_list(length=1000)):
-            if result['result']['lane_id'] == lane_id:
-                tlir_results.append(result)
-
-        return tlir_results
-
     # --------------------- Composed Ratios -------------------------- #
 
     async def insert_composed_result(self, video_id, lane_id, process_id, timestamp, result):
@@ -220,13 +214,10 @@ class DBService:
             {'process_id': process_id, 'video_id': video_id, 'lane_id': lane_id, 'created_at': timestamp,
              'result': result})
 
-    async def list_composed_result_by_process_id(self, process_id):
-        db = self.client[self.mongo_config['database']]
-        res_filter = {'process_id': process_id}
-
-        composed_results = {'process_id': process_id, 'lanes': {}}
-        for result in await (
-                db.composed_results.find(res_filter, {"_id": False}).sort("created_at", -1).to_list(length=1000)):
+    async def list_composed_result_by_process_id(self, process_id, **page):
+        composed_results = {'process_id': process_id, 'lanes': {}, 'next_cursor': None}
+        async for result in self.find_composed_results(process_id, **page):
+            composed_results['next_cursor'] = encode_cursor(result['created_at'], result['_id'])
             res = {'created_at': result['created_at'], 'result': result['result']}
             if composed_results['lanes'].get(result['lane_id']) is None:
                 composed_results['lanes'][result['lane_id']] = [res]
@@ -0,0 +1,59 @@
+from pipeline.metrics import merge_snapshots
+
+PREFIX = 'traffic_analyzer'
+DB_WRITE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # seconds
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items()) + '}'
+
+
+# Prometheus text exposition format, every metric is described once and followed by its samples
+class Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def describe(self, name, kind, help_text):
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+    def sample(self, name, value, **labels):
+        self.lines.append(f"{PREFIX}_{name}{format_labels(labels)} {float(value)!r}")
+
+    # snapshot - pipeline.metrics.Histogram snapshot, its counts are per bucket and exposed cumulatively
+    def histogram(self, name, snapshot, buckets, **labels):
+        cumulative = 0
+        for bound, count in zip(buckets, snapshot['counts']):
+            cumulative += count
+            self.sample(f"{name}_bucket", cumulative, **labels, le=bound)
+        self.sample(f"{name}_bucket", snapshot['count'], **labels, le='+Inf')
+        self.sample(f"{name}_sum", snapshot['sum'], **labels)
+        self.sample(f"{name}_count", snapshot['count'], **labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+# Stage timings of the pipeline processes. Snapshots of finished processes are folded into one per pipeline, so the
+# exposed histograms and counters never go down when a process ends.
+class PipelineMetricsTotals:
+    def __init__(self):
+        self.finished = {}   # pipeline -> merged snapshot
+
+    def finish(self, pipeline, snapshot):
+        if snapshot is not None:
+            self.finished[pipeline] = merge_snapshots(self.finished.get(pipeline), snapshot)
+
+    # running - (pipeline, snapshot) of every running process
+    def totals(self, running):
+        totals = dict(self.finished)
+        for pipeline, snapshot in running:
+            if snapshot is not None:
+                totals[pipeline] = merge_snapshots(totals.get(pipeline), snapshot)
+        return totals
@@ -0,0 +1,100 @@
+import base64
+from datetime import datetime
+
+from aiohttp import web
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.json_encoding import dumps
+
+DEFAULT_PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 100000
+STREAM_CHUNK_SIZE = 64 * 1024
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+# cursor - position of a result in the (created_at desc, _id desc) order, the next page starts right after it
+def encode_cursor(created_at, object_id):
+    raw = f"{created_at.isoformat()}|{object_id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, object_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), ObjectId(object_id)
+    except (ValueError, InvalidId, UnicodeError):
+        raise web.HTTPBadRequest(text=f"Invalid cursor: {cursor}")
+
+
+def parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Invalid {name}, expected an ISO 8601 datetime: {value}")
+
+
+# ?since=<iso datetime>&until=<iso datetime>&cursor=<cursor of the last received result>&limit=<n>
+def parse_page_params(request):
+    query = request.query
+
+    try:
+        limit = int(query.get('limit', DEFAULT_PAGE_LIMIT))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"Invalid limit: {query.get('limit')}")
+    if limit <= 0 or limit > MAX_PAGE_LIMIT:
+        raise web.HTTPBadRequest(text=f"limit must be between 1 and {MAX_PAGE_LIMIT}")
+
+    return {
+        'since': parse_datetime(query['since'], 'since') if 'since' in query else None,
+        'until': parse_datetime(query['until'], 'until') if 'until' in query else None,
+        'cursor': decode_cursor(query['cursor']) if 'cursor' in query else None,
+        'limit': limit,
+    }
+
+
+def wants_ndjson(request):
+    return request.query.get('format') == 'ndjson' or NDJSON_CONTENT_TYPE in request.headers.get('Accept', '')
+
+
+def encode_result(document):
+    object_id = document.pop('_id')
+    document['cursor'] = encode_cursor(document['created_at'], object_id)
+    return dumps(document)
+
+
+# Writes the documents of a Motor cursor as they arrive, either as NDJSON or as one chunked JSON array,
+# so memory does not depend on the number of results.
+async def stream_results(request, cursor):
+    ndjson = wants_ndjson(request)
+    response = web.StreamResponse(headers={
+        'Content-Type': NDJSON_CONTENT_TYPE if ndjson else 'application/json',
+    })
+    await response.prepare(request)
+
+    separator = '\n' if ndjson else ','
+    chunk = [] if ndjson else ['[']
+    chunk_size = 0
+    first = True
+    async for document in cursor:
+        encoded = encode_result(document)
+        if not ndjson and not first:
+            chunk.append(separator)
+        chunk.append(encoded)
+        if ndjson:
+            chunk.append(separator)
+        chunk_size += len(encoded) + 1
+        first = False
+
+        if chunk_size >= STREAM_CHUNK_SIZE:
+            await response.write(''.join(chunk).encode('utf-8'))
+            chunk = []
+            chunk_size = 0
+
+    if not ndjson:
+        chunk.append(']')
+    if chunk:
+        await response.write(''.join(chunk).encode('utf-8'))
+
+    await response.write_eof()
+    return response
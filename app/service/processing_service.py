@@ -4,167 +4,638 @@ import time
 import uuid
 
 from aiohttp import web
-from datetime import datetime
-
-from app.utils import serialize_date_times, log, proc_type_2_short
-from tlir.tlir import calc_tlir
+from datetime import datetime, timedelta
+
+from app.config import (SHARED_FRAME_DECODING, FRAME_BUS_SLOTS, FRAME_BUS_CONSUMER_TIMEOUT, SPEED_BATCH_SIZE,
+                        SPEED_MAX_BATCH_DELAY, SAVE_INTERVAL, SPEED_ROI_PADDING, SPEED_MOTION_GATE,
+                        SPEED_FRAMES_INTERVAL, SPEED_MAX_FRAMES_INTERVAL, MTLCR_INTERVAL, MTLCR_MAX_INTERVAL,
+                        SAMPLING_MAX_LAG, RESULT_BATCH_SIZE, RESULT_QUEUE_SIZE, SPEED_WORKERS, MTLCR_WORKERS,
+                        STREAMS_PER_WORKER, INFERENCE_BATCH_SIZE, INFERENCE_MAX_BATCH_DELAY,
+                        WORKER_HEALTH_CHECK_INTERVAL, WORKER_HEALTH_CHECK_TIMEOUT, MAX_SPEED_PIPELINES,
+                        MAX_MTLCR_PIPELINES, SPEED_PIPELINE_CORES, SPEED_PIPELINE_MEMORY, MTLCR_PIPELINE_CORES,
+                        MTLCR_PIPELINE_MEMORY, MAX_QUEUED_ANALYSES, SPEED_MODEL_PATH, SPEED_BACKEND, MTLCR_MODEL_PATH,
+                        MTLCR_BACKEND, INFERENCE_DEVICE, MTLCR_BATCH_SIZE, MTLCR_MAX_BATCH_DELAY)
+from app.json_encoding import json_response
+from app.service.metrics import Exposition, PipelineMetricsTotals, DB_WRITE_BUCKETS
+from app.service.pagination import parse_page_params, stream_results
+from app.service.result_pipe import ResultPipe
+from app.service.result_writer import ResultWriter
+from app.service.scheduler import (AnalysisScheduler, derive_pipeline_limit, PRIORITIES, RUNNING, QUEUED,
+                                   REJECTED)
+from app.service.worker_pool import WorkerPool, WorkerFailed
+from app.utils import log, proc_type_2_short
+from pipeline.frame_bus import FrameBus
+from pipeline.metrics import Histogram, split_status, summarize_snapshot, STAGE_BUCKETS, LAG_BUCKETS
+from pipeline.result_channel import RESULTS, HEARTBEAT
+from tlir.tlir import LaneTrafficState
 
 
 TLIR_CALCULATION = 'TLIR_CALCULATION'
 SPEED_EVALUATION = 'SPEED_EVALUATION'
 MTLCR_CALCULATION = 'MTLCR_CALCULATION'
 
+# live - videos are analysed in real time like a camera stream, offline - recorded files are analysed as fast as the
+# hardware allows and results are placed on the video timeline
+LIVE = 'live'
+OFFLINE = 'offline'
+PROCESSING_MODES = (LIVE, OFFLINE)
+
 class ProcessingService:
-    def __init__(self, db_service, debug=False, log_levels=None):
+    def __init__(self, db_service, broadcaster, debug=False, log_levels=None):
         if log_levels is None:
             log_levels = {}
         self.active_processes = {}
+        self.frame_buses = {}   # parent_process_id -> shared decoder of the analysis
+        self.lane_states = {}   # parent_process_id -> lane_id -> LaneTrafficState
+        self.video_clocks = {}  # parent_process_id of an offline analysis -> {'started_at', 'video_time', 'tlir_time'}
         self.db_service = db_service
+        self.broadcaster = broadcaster
         self.debug = debug
         self.log_levels = log_levels
+        self.speed_writer = ResultWriter('speed', db_service.insert_speed_results, RESULT_BATCH_SIZE, SAVE_INTERVAL,
+                                         RESULT_QUEUE_SIZE)
+        self.mtlcr_writer = ResultWriter('mtlcr', db_service.insert_mtlcr_results, RESULT_BATCH_SIZE, SAVE_INTERVAL,
+                                         RESULT_QUEUE_SIZE)
+        self.results_ingested = {'speed': 0, 'mtlcr': 0}
+        self.composed_write_seconds = Histogram(DB_WRITE_BUCKETS)
+        self.pipeline_metrics = PipelineMetricsTotals()
+        self.speed_pool = self.create_worker_pool('speed', 'speed_tracker/worker.py', SPEED_WORKERS,
+                                                  self.model_args(SPEED_MODEL_PATH, SPEED_BACKEND))
+        self.mtlcr_pool = self.create_worker_pool('mtlcr', 'mtlcr/worker.py', MTLCR_WORKERS,
+                                                  self.model_args(MTLCR_MODEL_PATH, MTLCR_BACKEND))
+        self.scheduler = AnalysisScheduler({
+            'speed': self.pipeline_limit(MAX_SPEED_PIPELINES, SPEED_PIPELINE_CORES, SPEED_PIPELINE_MEMORY,
+                                         self.speed_pool),
+            'mtlcr': self.pipeline_limit(MAX_MTLCR_PIPELINES, MTLCR_PIPELINE_CORES, MTLCR_PIPELINE_MEMORY,
+                                         self.mtlcr_pool),
+        }, MAX_QUEUED_ANALYSES)
+
+    @staticmethod
+    def model_args(model_path, backend):
+        args = ['--model_path', model_path, '--backend', backend]
+        if INFERENCE_DEVICE is not None:
+            args += ['--device', INFERENCE_DEVICE]
+        return args
+
+    @staticmethod
+    def create_worker_pool(name, script, size, model_args):
+        if size <= 0:
+            return None
+        script_args = [script, '--max_jobs', str(STREAMS_PER_WORKER), '--max_batch_size', str(INFERENCE_BATCH_SIZE),
+                       '--max_batch_delay', str(INFERENCE_MAX_BATCH_DELAY), *model_args]
+        return WorkerPool(name, script_args, size, STREAMS_PER_WORKER, WORKER_HEALTH_CHECK_INTERVAL,
+                          WORKER_HEALTH_CHECK_TIMEOUT)
+
+    @staticmethod
+    def pipeline_limit(configured_limit, cores_per_pipeline, memory_per_pipeline, pool):
+        limit = configured_limit
+        if limit is None:
+            limit = derive_pipeline_limit(cores_per_pipeline, memory_per_pipeline)
+        # jobs beyond the free slots of the pool would only wait there, keep them in the scheduler queue instead
+        if pool is not None:
+            limit = min(limit, pool.size * pool.jobs_per_worker)
+        return limit
+
+    def worker_pools(self):
+        return [pool for pool in (self.speed_pool, self.mtlcr_pool) if pool is not None]
+
+    async def start(self):
+        self.speed_writer.start()
+        self.mtlcr_writer.start()
+        for pool in self.worker_pools():
+            await pool.start()
+
+    async def close(self):
+        for pool in self.worker_pools():
+            await pool.close()
+        await self.speed_writer.close()
+        await self.mtlcr_writer.close()
+
+    # last progress a running pipeline reported (frames, video time, sampling and, for files, percent and throughput)
+    # and the snapshot of its stage timings
+    def process_status(self, process_id):
+        process = self.active_processes.get(process_id, {})
+        if process.get('progress') is not None:
+            return process['progress'], process.get('metrics')
+        for pool in self.worker_pools():
+            pool_job = pool.running_job(process_id)
+            if pool_job is not None:
+                return pool_job.progress, pool_job.metrics
+        return None, None
+
+    def worker_stats(self):
+        return {pool.name: pool.stats() for pool in self.worker_pools()}
 
     async def start_processing(self, request):
         video_id = request.match_info.get('video_id')
         video = await self.db_service.get_video(video_id)
         if video is None:
-            return web.json_response(status=404)
+            return json_response(status=404)
+
+        priority = request.query.get('priority', 'normal')
+        if priority not in PRIORITIES:
+            return json_response({'error': f"priority must be one of {', '.join(PRIORITIES)}"}, status=400)
+
+        mode = request.query.get('mode', LIVE)
+        if mode not in PROCESSING_MODES:
+            return json_response({'error': f"mode must be one of {', '.join(PROCESSING_MODES)}"}, status=400)
 
         parent_process_id = str(uuid.uuid4())
         speed_process_id = str(uuid.uuid4())
         tlir_process_id = str(uuid.uuid4())
-        asyncio.create_task(self.start_speed_calc_process(video, parent_process_id, speed_process_id))
         mtlcr_process_id = str(uuid.uuid4())
-        asyncio.create_task(self.start_mtlcr_calc_process(video, parent_process_id, mtlcr_process_id))
-        asyncio.create_task(self.start_tlir_calc_process(video, parent_process_id, mtlcr_process_id, tlir_process_id))
-        self.active_processes[speed_process_id] = {'process_type': SPEED_EVALUATION, 'video_path': video['link']}
-        self.active_processes[mtlcr_process_id] = {'process_type': MTLCR_CALCULATION, 'video_path': video['link']}
+
+        async def start():
+            await self.launch_analysis(video, parent_process_id, speed_process_id, mtlcr_process_id, tlir_process_id,
+                                       priority, mode)
+
+        state = self.scheduler.submit(parent_process_id, ['speed', 'mtlcr'], start, priority,
+                                      [speed_process_id, mtlcr_process_id])
+        if state == REJECTED:
+            log(f"Processing rejected for {video['link']}, {self.scheduler.queue_length()} analyses are already queued")
+            return json_response({'status': REJECTED, 'reason': 'queue is full', 'scheduler': self.scheduler.stats()},
+                                 status=429)
+
+        if state == QUEUED:
+            await self.db_service.insert_active_process(parent_process_id, speed_process_id, video['link'],
+                                                        SPEED_EVALUATION, QUEUED, priority, mode)
+            await self.db_service.insert_active_process(parent_process_id, mtlcr_process_id, video['link'],
+                                                        MTLCR_CALCULATION, QUEUED, priority, mode)
+            position = self.scheduler.queue_positions().get(parent_process_id)
+            log(f"Processing queued for {video['link']} with ID {parent_process_id} at position {position}")
+            return json_response({'status': QUEUED, 'process_id': parent_process_id,
+                                  'speed_process_id': speed_process_id, 'mtlcr_process_id': mtlcr_process_id,
+                                  'priority': priority, 'mode': mode, 'queue_position': position}, status=202)
 
         message = f"Processing started for {video['link']} with ID {parent_process_id} and subprocess IDs {speed_process_id} (SPEED_EVALUATION) and {mtlcr_process_id} (MTLCR_CALCULATION)"
         log(message)
 
         return web.Response(text=message)
 
-    async def start_speed_calc_process(self, video, parent_process_id, process_id):
-        script_args = ['speed_tracker/tracker.py', '--video_path', video['link'], '--lanes', json.dumps(video['lanes'])]
-        await self.start_external_process(parent_process_id, process_id, SPEED_EVALUATION, video['link'], script_args, self.db_service.insert_speed_result)
-
-    async def start_mtlcr_calc_process(self, video, parent_process_id, process_id):
-        script_args = ['mtlcr/run_mtlcr.py', '--video_path', video['link'], '--lanes', json.dumps(video['lanes'])]
-        await self.start_external_process(parent_process_id, process_id, MTLCR_CALCULATION, video['link'], script_args, self.db_service.insert_mtlcr_result)
-
-    async def start_external_process(self, parent_process_id, process_id, process_type, video_link, script_args, result_saver):  # process_id, timestamp, result
-        await self.db_service.insert_active_process(parent_process_id, process_id, video_link, process_type)
-
-        if self.debug:
-            script_args.append("--debug")
+    # called by the scheduler once there are free speed and MTLCR pipelines for the analysis
+    async def launch_analysis(self, video, parent_process_id, speed_process_id, mtlcr_process_id, tlir_process_id,
+                              priority, mode=LIVE):
+        self.active_processes[speed_process_id] = {'process_type': SPEED_EVALUATION, 'video_path': video['link']}
+        self.active_processes[mtlcr_process_id] = {'process_type': MTLCR_CALCULATION, 'video_path': video['link']}
+        await self.db_service.insert_active_process(parent_process_id, speed_process_id, video['link'],
+                                                    SPEED_EVALUATION, RUNNING, priority, mode)
+        await self.db_service.insert_active_process(parent_process_id, mtlcr_process_id, video['link'],
+                                                    MTLCR_CALCULATION, RUNNING, priority, mode)
+
+        self.lane_states[parent_process_id] = {lane['id']: LaneTrafficState(lane['max_speed']) for lane in video['lanes']}
+        offline = mode == OFFLINE
+        if offline:
+            self.video_clocks[parent_process_id] = {'started_at': datetime.utcnow(), 'video_time': 0.0,
+                                                    'tlir_time': 0.0}
+
+        frame_bus = None
+        if SHARED_FRAME_DECODING:
+            frame_bus = await self.start_frame_decoder(video, parent_process_id, [speed_process_id, mtlcr_process_id])
+
+        asyncio.create_task(self.start_speed_calc_process(video, parent_process_id, speed_process_id, frame_bus,
+                                                          offline))
+        asyncio.create_task(self.start_mtlcr_calc_process(video, parent_process_id, mtlcr_process_id, frame_bus,
+                                                          offline))
+        asyncio.create_task(self.start_tlir_calc_process(video, parent_process_id, mtlcr_process_id, tlir_process_id))
 
+    async def start_frame_decoder(self, video, parent_process_id, consumer_process_ids):
+        bus_name = f"ta_{uuid.uuid4().hex[:16]}"
         process = await asyncio.create_subprocess_exec(
             'python3',
-            *script_args,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            'pipeline/run_decoder.py',
+            '--video_path', video['link'],
+            '--name', bus_name,
+            '--consumers', str(len(consumer_process_ids)),
+            '--slots', str(FRAME_BUS_SLOTS),
+            '--consumer_timeout', str(FRAME_BUS_CONSUMER_TIMEOUT),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
         )
 
-        while True:
-            line = (await process.stdout.readline()).decode('utf-8')
-            if not line:
-                break
-
-            if line == '\n' or line[0] != "{":
-                continue
+        frame_bus = {
+            'name': bus_name,
+            'process': process,
+            'consumers': list(consumer_process_ids),
+            'active_consumers': set(consumer_process_ids),
+        }
+        self.frame_buses[parent_process_id] = frame_bus
+        return frame_bus
+
+    async def release_frame_bus(self, parent_process_id, process_id):
+        frame_bus = self.frame_buses.get(parent_process_id)
+        if frame_bus is None:
+            return
+
+        frame_bus['active_consumers'].discard(process_id)
+        if frame_bus['active_consumers']:
+            # the process may have died before closing its reader, the decoder must not keep waiting for its cursor
+            consumer = frame_bus['consumers'].index(process_id)
+            if not FrameBus.release_consumer(frame_bus['name'], consumer):
+                asyncio.create_task(self.release_consumer_when_created(frame_bus['name'], consumer,
+                                                                       frame_bus['process']))
+            return
+
+        del self.frame_buses[parent_process_id]
+        process = frame_bus['process']
+        if process.returncode is None:
+            process.terminate()
+        await process.wait()
+
+    # a pipeline stopped right after the launch may finish before the decoder created the bus, its cursor is
+    # released as soon as the bus exists
+    @staticmethod
+    async def release_consumer_when_created(bus_name, consumer, decoder_process, poll_interval=0.1):
+        while decoder_process.returncode is None:
+            if FrameBus.release_consumer(bus_name, consumer):
+                return
+            await asyncio.sleep(poll_interval)
+
+    @staticmethod
+    def frame_bus_args(frame_bus, process_id):
+        if frame_bus is None:
+            return []
+        return ['--frame_bus', frame_bus['name'], '--frame_bus_consumer', str(frame_bus['consumers'].index(process_id))]
+
+    @staticmethod
+    def frame_bus_job(frame_bus, process_id):
+        if frame_bus is None:
+            return {'frame_bus': None}
+        return {'frame_bus': frame_bus['name'], 'frame_bus_consumer': frame_bus['consumers'].index(process_id)}
+
+    async def start_speed_calc_process(self, video, parent_process_id, process_id, frame_bus=None, offline=False):
+        # offline analyses have no real-time deadline, the sampling only adapts to the traffic
+        max_lag = None if offline else SAMPLING_MAX_LAG
+        if self.speed_pool is not None:
+            job = {'id': process_id, 'video_path': video['link'], 'lanes': video['lanes'], 'batch_size': SPEED_BATCH_SIZE,
+                   'max_batch_delay': SPEED_MAX_BATCH_DELAY, 'roi_padding': SPEED_ROI_PADDING,
+                   'min_frames_interval': SPEED_FRAMES_INTERVAL, 'max_frames_interval': SPEED_MAX_FRAMES_INTERVAL,
+                   'max_lag': max_lag, 'motion_gate': SPEED_MOTION_GATE, 'debug': self.debug,
+                   **self.frame_bus_job(frame_bus, process_id)}
+            await self.start_pooled_process(parent_process_id, process_id, SPEED_EVALUATION, self.speed_pool, job,
+                                            self.speed_writer)
+            return
+
+        script_args = ['speed_tracker/tracker.py', '--video_path', video['link'], '--lanes', json.dumps(video['lanes']),
+                       '--batch_size', str(SPEED_BATCH_SIZE), '--max_batch_delay', str(SPEED_MAX_BATCH_DELAY),
+                       '--frames_interval', str(SPEED_FRAMES_INTERVAL),
+                       *self.model_args(SPEED_MODEL_PATH, SPEED_BACKEND)]
+        script_args += ['--offline'] if offline else ['--max_lag', str(SAMPLING_MAX_LAG)]
+        if SPEED_MAX_FRAMES_INTERVAL is not None:
+            script_args += ['--max_frames_interval', str(SPEED_MAX_FRAMES_INTERVAL)]
+        if SPEED_MOTION_GATE:
+            script_args.append('--motion_gate')
+        if SPEED_ROI_PADDING is not None:
+            script_args += ['--roi_padding', str(SPEED_ROI_PADDING)]
+        script_args += self.frame_bus_args(frame_bus, process_id)
+        await self.start_external_process(parent_process_id, process_id, SPEED_EVALUATION, script_args, self.speed_writer)
+
+    async def start_mtlcr_calc_process(self, video, parent_process_id, process_id, frame_bus=None, offline=False):
+        if self.mtlcr_pool is not None:
+            job = {'id': process_id, 'video_path': video['link'], 'lanes': video['lanes'], 'interval': MTLCR_INTERVAL,
+                   'max_interval': MTLCR_MAX_INTERVAL, 'max_lag': SAMPLING_MAX_LAG, 'offline': offline,
+                   'batch_size': MTLCR_BATCH_SIZE, 'max_batch_delay': MTLCR_MAX_BATCH_DELAY, 'debug': self.debug,
+                   **self.frame_bus_job(frame_bus, process_id)}
+            await self.start_pooled_process(parent_process_id, process_id, MTLCR_CALCULATION, self.mtlcr_pool, job,
+                                            self.mtlcr_writer)
+            return
+
+        script_args = ['mtlcr/run_mtlcr.py', '--video_path', video['link'], '--lanes', json.dumps(video['lanes']),
+                       '--interval', str(MTLCR_INTERVAL), '--max_lag', str(SAMPLING_MAX_LAG),
+                       '--batch_size', str(MTLCR_BATCH_SIZE), '--max_batch_delay', str(MTLCR_MAX_BATCH_DELAY),
+                       *self.model_args(MTLCR_MODEL_PATH, MTLCR_BACKEND)]
+        if offline:
+            script_args.append('--offline')
+        if MTLCR_MAX_INTERVAL is not None:
+            script_args += ['--max_interval', str(MTLCR_MAX_INTERVAL)]
+        script_args += self.frame_bus_args(frame_bus, process_id)
+        await self.start_external_process(parent_process_id, process_id, MTLCR_CALCULATION, script_args, self.mtlcr_writer)
+
+    # runs the job on a warm worker of the pool, the model is already loaded so the first result comes without a cold start
+    async def start_pooled_process(self, parent_process_id, process_id, process_type, pool, job, result_writer):
+        async def on_results(results):
+            await self.handle_results(parent_process_id, process_id, process_type, result_writer, results)
+            if process_id not in self.active_processes:
+                await pool.cancel_job(process_id)
 
-            if self.log_levels[proc_type_2_short(process_type)]:
-                log(f"New value from process {process_id} ({process_type}): {line}")
+        metrics = None
+        try:
+            metrics = await pool.run_job(job, on_results)
+        except (WorkerFailed, ConnectionError) as e:
+            log(f"Process {process_id} ({process_type}) failed: {e}")
 
-            result = json.loads(line)
-            await result_saver(parent_process_id, process_id, datetime.utcnow(), result)
+        await self.finish_process(parent_process_id, process_id, process_type, result_writer, metrics)
 
-            if process_id not in self.active_processes:
-                process.terminate()
-                await process.communicate()
-                break
+    async def start_external_process(self, parent_process_id, process_id, process_type, script_args, result_writer):
+        if self.debug:
+            script_args.append("--debug")
 
+        # results come over their own pipe, stdout and stderr of the process are only logs
+        result_pipe = ResultPipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'python3',
+                *script_args,
+                *result_pipe.child_args(),
+                '--job_id', process_id,
+                pass_fds=(result_pipe.write_fd,)
+            )
+        except Exception:
+            result_pipe.close()
+            raise
+        finally:
+            result_pipe.close_child_end()
+
+        await result_pipe.open()
+        metrics = None
+        try:
+            while True:
+                messages = await result_pipe.read()
+                if messages is None:
+                    break
+
+                for kind, payload in messages:
+                    if kind == RESULTS:
+                        await self.handle_results(parent_process_id, process_id, process_type, result_writer,
+                                                  [result for _, result in payload])
+                    elif kind == HEARTBEAT and payload['jobs'].get(process_id) is not None:
+                        progress, metrics = split_status(payload['jobs'][process_id])
+                        if process_id in self.active_processes:
+                            self.active_processes[process_id].update(progress=progress, metrics=metrics)
+
+                if process_id not in self.active_processes:
+                    process.terminate()
+                    break
+        finally:
+            result_pipe.close()
+        await process.wait()
+
+        await self.finish_process(parent_process_id, process_id, process_type, result_writer, metrics)
+
+    async def handle_results(self, parent_process_id, process_id, process_type, result_writer, results):
+        self.results_ingested[proc_type_2_short(process_type)] += len(results)
+        for result in results:
+            await self.handle_result(parent_process_id, process_id, process_type, result_writer, result)
+
+    async def handle_result(self, parent_process_id, process_id, process_type, result_writer, result):
+        if self.log_levels[proc_type_2_short(process_type)]:
+            log(f"New value from process {process_id} ({process_type}): {json.dumps(result)}")
+
+        timestamp = self.result_timestamp(parent_process_id, result)
+        await self.calc_offline_tlir(parent_process_id)
+        self.update_lane_state(parent_process_id, process_type, timestamp, result)
+        self.broadcaster.publish(proc_type_2_short(process_type), parent_process_id, result.get('lane_id'),
+                                 {'created_at': timestamp, 'result': result})
+        await result_writer.save(parent_process_id, process_id, timestamp, result)
+
+    # metrics - last snapshot of the stage timings of the process
+    async def finish_process(self, parent_process_id, process_id, process_type, result_writer, metrics=None):
+        # the snapshot moves from the running process to the totals in one step, so it is neither counted twice nor
+        # missing while the results are flushed (a pooled job is gone from its worker already)
+        process = self.active_processes.get(process_id)
+        if process is not None:
+            process['metrics'] = None
+        self.pipeline_metrics.finish(proc_type_2_short(process_type), metrics)
+        # results of the process must be in the database before it is reported as finished
+        if not await result_writer.flush(process_id):
+            log(f"Some results of process {process_id} ({process_type}) could not be written")
         await self.db_service.finish_active_process(process_id)
+        await self.release_frame_bus(parent_process_id, process_id)
         log(f"Process {process_id} ({process_type}) finished")
 
-        del self.active_processes[process_id]
+        self.active_processes.pop(process_id, None)
+        self.scheduler.release(parent_process_id, proc_type_2_short(process_type))
+
+    # offline analyses run faster than real time, their results are placed on the video timeline starting at the
+    # moment the analysis started: speeds at the end of the measurement, MTLCR at the segmented frame
+    def result_timestamp(self, parent_process_id, result):
+        clock = self.video_clocks.get(parent_process_id)
+        video_time = result.get('frame_time', result.get('finish'))
+        if clock is None or video_time is None:
+            return datetime.utcnow()
+
+        clock['video_time'] = max(clock['video_time'], video_time)
+        return clock['started_at'] + timedelta(seconds=video_time)
+
+    def analysis_time(self, parent_process_id):
+        clock = self.video_clocks.get(parent_process_id)
+        if clock is None:
+            return datetime.utcnow()
+        return clock['started_at'] + timedelta(seconds=clock['video_time'])
+
+    # latest values of every lane are kept in memory, so TLIR never has to read back what was just parsed
+    def update_lane_state(self, parent_process_id, process_type, timestamp, result):
+        lane_state = self.lane_states.get(parent_process_id, {}).get(result.get('lane_id'))
+        if lane_state is None:
+            return
+
+        if process_type == SPEED_EVALUATION:
+            lane_state.add_speed(timestamp, result['speed'])
+        elif process_type == MTLCR_CALCULATION:
+            lane_state.add_mtlcr(result['mtlcr'])
 
     async def start_tlir_calc_process(self, video, parent_process_id, mtlcr_process_id, tlir_process_id,
-                                      calc_interval=5, speed_calc_timeout=60):    # calc_interval - seconds, speed_calc_timeout - seconds
-        while True:
-            time.sleep(calc_interval)
-            for lane in video['lanes']:
-                mtlcr_list = await self.db_service.list_mtlcr_results_by_process_and_lane_id(parent_process_id, lane['id'], limit=1)
-                if len(mtlcr_list) == 0:
-                    mtlcr = 0
-                else:
-                    mtlcr = mtlcr_list[0]['result']['mtlcr']
-
-                speed_list = await self.db_service.list_speed_results_by_process_and_lane_id(parent_process_id, lane['id'], newer_than_seconds=speed_calc_timeout, limit=10)
-                max_speed = lane['max_speed']
-
-                speed_list = list(map(lambda obj: obj['result']['speed'], speed_list))
-                tlir = calc_tlir(mtlcr, speed_list, max_speed)
-                result = {'mtlcr': mtlcr, 'tlir': tlir}
-
-                result_log = {'video_id': video['id'], 'lane_id': lane['id'], 'mtlcr': mtlcr, 'tlir': tlir}
-                log(f"New value from process {tlir_process_id} ({TLIR_CALCULATION}): {json.dumps(result_log)}")
+                                      calc_interval=5):    # calc_interval - seconds
+        clock = self.video_clocks.get(parent_process_id)
+        if clock is not None:
+            # offline analyses run faster than real time, TLIR is calculated whenever the results cross the next
+            # calc_interval of the video, see calc_offline_tlir
+            clock['tlir'] = (video, tlir_process_id, calc_interval)
 
-                await self.db_service.insert_composed_result(video['id'], lane['id'], parent_process_id, datetime.utcnow(), result)
+        while True:
+            await asyncio.sleep(calc_interval)
+            if clock is None:
+                await self.calc_tlir(video, parent_process_id, tlir_process_id, datetime.utcnow())
 
             if mtlcr_process_id not in self.active_processes:
+                if clock is not None and clock['video_time'] > clock['tlir_time']:
+                    # the end of the video after the last full interval
+                    await self.calc_tlir(video, parent_process_id, tlir_process_id,
+                                         self.analysis_time(parent_process_id))
+                del self.lane_states[parent_process_id]
+                self.video_clocks.pop(parent_process_id, None)
                 log(f"Process {tlir_process_id} ({TLIR_CALCULATION}) finished")
                 break
 
+    # called before a result of an offline analysis is added to the lane states, so every interval of the video is
+    # calculated with the values known at its end
+    async def calc_offline_tlir(self, parent_process_id):
+        clock = self.video_clocks.get(parent_process_id)
+        if clock is None or 'tlir' not in clock:
+            return
+
+        video, tlir_process_id, calc_interval = clock['tlir']
+        while clock['video_time'] >= clock['tlir_time'] + calc_interval:
+            # moved on before the writes, results of the other pipeline may come in meanwhile
+            clock['tlir_time'] += calc_interval
+            now = clock['started_at'] + timedelta(seconds=clock['tlir_time'])
+            await self.calc_tlir(video, parent_process_id, tlir_process_id, now)
+
+    async def calc_tlir(self, video, parent_process_id, tlir_process_id, now):
+        lane_states = self.lane_states.get(parent_process_id)
+        if lane_states is None:
+            return
+        for lane in video['lanes']:
+            lane_state = lane_states[lane['id']]
+            mtlcr = lane_state.mtlcr
+            tlir = lane_state.calc_tlir(now)
+            result = {'mtlcr': mtlcr, 'tlir': tlir}
+
+            result_log = {'video_id': video['id'], 'lane_id': lane['id'], 'mtlcr': mtlcr, 'tlir': tlir}
+            log(f"New value from process {tlir_process_id} ({TLIR_CALCULATION}): {json.dumps(result_log)}")
+
+            created_at = now
+            self.broadcaster.publish(proc_type_2_short(TLIR_CALCULATION), parent_process_id, lane['id'],
+                                     {'created_at': created_at, 'result': result})
+            started_at = time.monotonic()
+            await self.db_service.insert_composed_result(video['id'], lane['id'], parent_process_id, created_at, result)
+            self.composed_write_seconds.observe(time.monotonic() - started_at)
+
 
     async def stop_processing(self, request):
         process_id = request.match_info.get('process_id')   # id of subprocess
 
         if process_id in self.active_processes:
             del self.active_processes[process_id]
+            for pool in self.worker_pools():
+                await pool.cancel_job(process_id)
+
+        # a queued analysis is dropped as a whole, none of its pipelines has started yet
+        analysis = self.scheduler.cancel(process_id)
+        if analysis is not None:
+            for queued_process_id in analysis.process_ids:
+                await self.db_service.cancel_queued_process(queued_process_id)
 
         return web.Response(text=f"Processing stopped for process ID {process_id}")
 
     async def list_processes(self, _request):
         processes = await self.db_service.list_processes()
-        return web.json_response(processes)
+
+        queue_positions = self.scheduler.queue_positions()
+        for process in processes:
+            if process.get('status') == QUEUED:
+                process['queue_position'] = queue_positions.get(process['parent_process_id'])
+            elif process['id'] in self.active_processes:
+                process['progress'], metrics = self.process_status(process['id'])
+                if metrics is not None:
+                    process['metrics'] = summarize_snapshot(metrics)
+
+        return json_response(processes)
+
+    #  ------------------ Metrics ------------------------------
+
+    async def get_metrics(self, _request):
+        exposition = Exposition()
+        self.expose_orchestrator_metrics(exposition)
+        self.expose_pipeline_metrics(exposition)
+        return web.Response(text=exposition.text(), content_type='text/plain', charset='utf-8')
+
+    def expose_orchestrator_metrics(self, exposition):
+        exposition.describe('results_ingested_total', 'counter', 'Pipeline results received by the orchestrator')
+        for pipeline, count in self.results_ingested.items():
+            exposition.sample('results_ingested_total', count, pipeline=pipeline)
+
+        writers = {'speed': self.speed_writer, 'mtlcr': self.mtlcr_writer}
+        exposition.describe('db_write_seconds', 'histogram', 'Duration of result writes to the database')
+        for name, writer in writers.items():
+            exposition.histogram('db_write_seconds', writer.write_seconds.snapshot(), DB_WRITE_BUCKETS, writer=name)
+        exposition.histogram('db_write_seconds', self.composed_write_seconds.snapshot(), DB_WRITE_BUCKETS,
+                             writer='composed')
+        writer_stats = {name: writer.stats() for name, writer in writers.items()}
+        exposition.describe('db_write_failures_total', 'counter', 'Results that could not be written')
+        for name, stats in writer_stats.items():
+            exposition.sample('db_write_failures_total', stats['failed'], writer=name)
+        exposition.describe('result_queue_depth', 'gauge', 'Results waiting for the database writer')
+        for name, stats in writer_stats.items():
+            exposition.sample('result_queue_depth', stats['queue_depth'], writer=name)
+        exposition.describe('result_backpressure_waits_total', 'counter', 'Times a full writer queue held results back')
+        for name, stats in writer_stats.items():
+            exposition.sample('result_backpressure_waits_total', stats['backpressure_waits'], writer=name)
+
+        exposition.describe('scheduler_queue_depth', 'gauge', 'Analyses waiting for free pipelines')
+        exposition.sample('scheduler_queue_depth', self.scheduler.queue_length())
+        exposition.describe('scheduler_running_pipelines', 'gauge', 'Pipelines running per kind')
+        for kind, running in self.scheduler.running.items():
+            exposition.sample('scheduler_running_pipelines', running, pipeline=kind)
+
+        pools = self.worker_pools()
+        exposition.describe('worker_pool_free_slots', 'gauge', 'Job slots of warm workers waiting for a job')
+        for pool in pools:
+            exposition.sample('worker_pool_free_slots', pool.free_slots.qsize(), pool=pool.name)
+        exposition.describe('worker_restarts_total', 'counter', 'Warm workers replaced after a failure')
+        for pool in pools:
+            exposition.sample('worker_restarts_total', pool.restarts, pool=pool.name)
+        exposition.describe('inference_queue_depth', 'gauge', 'Frames waiting for the shared model of a worker')
+        for pool in pools:
+            for worker in pool.workers:
+                inference = worker.last_stats.get('stats') if worker.last_stats else None
+                if inference is not None:
+                    exposition.sample('inference_queue_depth', inference['pending'], worker=worker.name)
+
+    def expose_pipeline_metrics(self, exposition):
+        running = []
+        lags = []
+        for process_id, process in list(self.active_processes.items()):
+            progress, metrics = self.process_status(process_id)
+            pipeline = proc_type_2_short(process['process_type'])
+            running.append((pipeline, metrics))
+            if progress is not None and progress.get('lag') is not None:
+                lags.append((pipeline, process_id, progress['lag']))
+        totals = self.pipeline_metrics.totals(running)
+
+        exposition.describe('pipeline_stage_seconds', 'histogram',
+                            'Duration of the pipeline stages, inference per batch')
+        for pipeline, snapshot in totals.items():
+            for stage, histogram in snapshot['stages'].items():
+                exposition.histogram('pipeline_stage_seconds', histogram, STAGE_BUCKETS, pipeline=pipeline, stage=stage)
+        exposition.describe('pipeline_lag_seconds', 'histogram', 'Seconds processing was behind real time per frame')
+        for pipeline, snapshot in totals.items():
+            exposition.histogram('pipeline_lag_seconds', snapshot['lag'], LAG_BUCKETS, pipeline=pipeline)
+        exposition.describe('pipeline_frames_total', 'counter', 'Sampled frames processed')
+        for pipeline, snapshot in totals.items():
+            exposition.sample('pipeline_frames_total', snapshot['counters'].get('frames', 0), pipeline=pipeline)
+        exposition.describe('pipeline_frames_dropped_total', 'counter',
+                            'Frames skipped by the sampling or the motion gate')
+        for pipeline, snapshot in totals.items():
+            for counter, count in snapshot['counters'].items():
+                if counter.startswith('dropped_by_'):
+                    exposition.sample('pipeline_frames_dropped_total', count, pipeline=pipeline,
+                                      reason=counter[len('dropped_by_'):])
+
+        exposition.describe('process_lag_seconds', 'gauge', 'Seconds a running pipeline process is behind real time')
+        for pipeline, process_id, lag in lags:
+            exposition.sample('process_lag_seconds', lag, pipeline=pipeline, process_id=process_id)
 
     #  ------------------ Speed ------------------------------
 
     async def list_speed_results_by_process_id(self, request):
         process_id = request.match_info.get('process_id')
-        results = await self.db_service.list_speed_results_by_process_id(process_id)
-        results = serialize_date_times(results)
-        return web.json_response(results)
+        cursor = self.db_service.find_speed_results(process_id, **parse_page_params(request))
+        return await stream_results(request, cursor)
 
     async def list_speed_results_by_process_and_lane_id(self, request):
         process_id = request.match_info.get('process_id')
         lane_id = request.match_info.get('lane_id')
 
-        results = await self.db_service.list_speed_results_by_process_and_lane_id(process_id, lane_id)
-        results = serialize_date_times(results)
-        return web.json_response(results)
+        cursor = self.db_service.find_speed_results(process_id, lane_id, **parse_page_params(request))
+        return await stream_results(request, cursor)
 
     #  ------------------ MTLCR ------------------------------
 
     async def list_mtlcr_results_by_process_id(self, request):
         process_id = request.match_info.get('process_id')
-        results = await self.db_service.list_mtlcr_results_by_process_id(process_id)
-        results = serialize_date_times(results)
-        return web.json_response(results)
+        cursor = self.db_service.find_mtlcr_results(process_id, **parse_page_params(request))
+        return await stream_results(request, cursor)
 
     async def list_mtlcr_results_by_process_and_lane_id(self, request):
         process_id = request.match_info.get('process_id')
         lane_id = request.match_info.get('lane_id')
 
-        results = await self.db_service.list_mtlcr_results_by_process_and_lane_id(process_id, lane_id)
-        results = serialize_date_times(results)
-        return web.json_response(results)
+        cursor = self.db_service.find_mtlcr_results(process_id, lane_id, **parse_page_params(request))
+        return await stream_results(request, cursor)
 
     #  ------------------ MTLCR + TLIR ------------------------------
 
     async def list_composed_results_by_process_id(self, request):
         process_id = request.match_info.get('process_id')
-        results = await self.db_service.list_composed_result_by_process_id(process_id)
-        results = serialize_date_times(results)
-        return web.json_response(results)
+        results = await self.db_service.list_composed_result_by_process_id(process_id, **parse_page_params(request))
+        return json_response(results)
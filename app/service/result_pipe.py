@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+from pipeline.result_channel import FrameDecoder
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class ResultPipe:
+    # pipe from a pipeline process to the orchestrator, the process writes pipeline.result_channel frames to write_fd
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.reader = None
+        self.transport = None
+        self.decoder = FrameDecoder()
+
+    def child_args(self):
+        return ['--result_fd', str(self.write_fd)]
+
+    def close_child_end(self):
+        # once the process has its copy, EOF on the read end means the process is gone
+        if self.write_fd is not None:
+            os.close(self.write_fd)
+            self.write_fd = None
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.reader = asyncio.StreamReader(limit=READ_CHUNK_SIZE)
+        self.transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(self.reader),
+                                                         os.fdopen(self.read_fd, 'rb'))
+
+    # returns the (kind, payload) frames of everything that arrived, decoded together, or None once the pipe is closed
+    async def read(self):
+        while True:
+            data = await self.reader.read(READ_CHUNK_SIZE)
+            if not data:
+                return None
+            messages = self.decoder.feed(data)
+            if messages:
+                return messages
+
+    def close(self):
+        self.close_child_end()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+        elif self.read_fd is not None:
+            os.close(self.read_fd)
+        self.read_fd = None
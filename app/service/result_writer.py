@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+from app.service.metrics import DB_WRITE_BUCKETS
+from app.utils import log
+from pipeline.metrics import Histogram
+
+WRITE_RETRY_DELAYS = (1, 2, 4)   # seconds before each retry of a failed batch
+
+
+class ResultWriter:
+    # insert_many - coroutine writing a list of documents, flush_interval - seconds a document may wait in the buffer
+    def __init__(self, name, insert_many, max_batch_size=200, flush_interval=10, max_queue_size=10000):
+        self.name = name
+        self.insert_many = insert_many
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.task = None
+        self.failed_results = {}   # process id -> results of the process given up on since its last flush
+        self.metrics = {
+            'queued': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'max_queue_depth': 0,
+            'backpressure_waits': 0,
+            'backpressure_seconds': 0.0,
+            'last_write_seconds': 0.0,
+        }
+        self.write_seconds = Histogram(DB_WRITE_BUCKETS)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        await self.flush()
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def save(self, parent_process_id, process_id, timestamp, result):
+        await self.put({'parent_process_id': parent_process_id, 'process_id': process_id, 'created_at': timestamp,
+                        'result': result})
+
+    async def put(self, item):
+        if self.queue.full():
+            # the buffer is full because the database is behind, wait instead of growing without bound
+            self.metrics['backpressure_waits'] += 1
+            started_at = time.monotonic()
+            await self.queue.put(item)
+            self.metrics['backpressure_seconds'] += time.monotonic() - started_at
+        else:
+            self.queue.put_nowait(item)
+
+        if isinstance(item, dict):
+            self.metrics['queued'] += 1
+        self.metrics['max_queue_depth'] = max(self.metrics['max_queue_depth'], self.queue.qsize())
+
+    # resolves once every document queued before the call has been written or given up on, False when results of
+    # process_id could not be written since its previous flush (the writer is shared, other processes do not count)
+    async def flush(self, process_id=None):
+        if self.task is not None and not self.task.done():
+            flushed = asyncio.get_running_loop().create_future()
+            await self.put(flushed)
+            await flushed
+
+        return self.failed_results.pop(process_id, 0) == 0
+
+    def stats(self):
+        return {**self.metrics, 'queue_depth': self.queue.qsize()}
+
+    async def run(self):
+        batch = []
+        flush_markers = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+
+            if isinstance(item, dict):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+            elif item is not None:
+                flush_markers.append(item)
+
+            if item is None or flush_markers or len(batch) >= self.max_batch_size:
+                await self.write(batch)
+                batch = []
+                deadline = None
+                for marker in flush_markers:
+                    if not marker.done():
+                        marker.set_result(None)
+                flush_markers = []
+
+    # a failed batch is retried after each of WRITE_RETRY_DELAYS, new results wait in the queue meanwhile;
+    # returns False when the batch could not be written, its results are then counted against their processes
+    async def write(self, batch):
+        if not batch:
+            return True
+
+        self.metrics['batches'] += 1
+        for retry_delay in (*WRITE_RETRY_DELAYS, None):
+            started_at = time.monotonic()
+            try:
+                await self.insert_many(batch)
+                written = True
+            except Exception as e:
+                written = False
+                retrying = f", retrying in {retry_delay} seconds" if retry_delay is not None else ''
+                log(f"Failed to write {len(batch)} {self.name} results: {e}{retrying}")
+            self.metrics['last_write_seconds'] = time.monotonic() - started_at
+            self.write_seconds.observe(self.metrics['last_write_seconds'])
+
+            if written:
+                self.metrics['written'] += len(batch)
+                return True
+            if retry_delay is not None:
+                await asyncio.sleep(retry_delay)
+
+        self.metrics['failed'] += len(batch)
+        for item in batch:
+            process_id = item.get('process_id')
+            self.failed_results[process_id] = self.failed_results.get(process_id, 0) + 1
+        return False
@@ -0,0 +1,146 @@
+import asyncio
+import heapq
+import itertools
+import os
+
+from app.utils import log
+
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+RUNNING = 'running'
+QUEUED = 'queued'
+REJECTED = 'rejected'
+
+
+def machine_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# pipelines the machine can run side by side: whichever of the cores and the memory runs out first
+def derive_pipeline_limit(cores_per_pipeline, memory_per_pipeline):
+    limit = max(1, available_cores() // max(1, cores_per_pipeline))
+    memory = machine_memory()
+    if memory is not None and memory_per_pipeline:
+        limit = min(limit, max(1, memory // memory_per_pipeline))
+    return limit
+
+
+class Analysis:
+    def __init__(self, analysis_id, kinds, start, priority, process_ids):
+        self.id = analysis_id
+        self.kinds = kinds
+        self.start = start
+        self.priority = priority
+        self.process_ids = process_ids
+        self.held = set()
+        self.cancelled = False
+
+
+class AnalysisScheduler:
+    # limits - kind ('speed', 'mtlcr') -> pipelines of that kind allowed to run at once
+    # max_queued - analyses waiting for free pipelines, submissions beyond it are rejected
+    def __init__(self, limits, max_queued):
+        self.limits = dict(limits)
+        self.max_queued = max_queued
+        self.running = {kind: 0 for kind in self.limits}
+        self.analyses = {}   # analysis_id -> Analysis, running or queued
+        self.queue = []      # (priority rank, submission order, Analysis)
+        self.order = itertools.count()
+        self.metrics = {'started': 0, 'queued': 0, 'rejected': 0, 'cancelled': 0}
+
+    # start - coroutine function launching the pipelines of the analysis once it is admitted
+    def submit(self, analysis_id, kinds, start, priority='normal', process_ids=()):
+        analysis = Analysis(analysis_id, list(kinds), start, priority, list(process_ids))
+
+        # nothing overtakes the queue, a free slot goes to the analyses already waiting
+        if not self.queue_length() and self.fits(analysis):
+            self.launch(analysis)
+            return RUNNING
+
+        if self.queue_length() >= self.max_queued:
+            self.metrics['rejected'] += 1
+            return REJECTED
+
+        self.analyses[analysis_id] = analysis
+        heapq.heappush(self.queue, (PRIORITIES[priority], next(self.order), analysis))
+        self.metrics['queued'] += 1
+        return QUEUED
+
+    def fits(self, analysis):
+        return all(self.running[kind] < self.limits[kind] for kind in analysis.kinds)
+
+    def launch(self, analysis):
+        self.analyses[analysis.id] = analysis
+        for kind in analysis.kinds:
+            self.running[kind] += 1
+            analysis.held.add(kind)
+        self.metrics['started'] += 1
+
+        task = asyncio.create_task(analysis.start())
+        task.add_done_callback(lambda done: self.launch_done(analysis, done))
+
+    def launch_done(self, analysis, task):
+        error = 'cancelled' if task.cancelled() else task.exception()
+        if error is not None:
+            log(f"Analysis {analysis.id} failed to start: {error}")
+            for kind in list(analysis.held):
+                self.release(analysis.id, kind)
+
+    # called when a pipeline of the analysis finished, its slot goes to the next queued analysis
+    def release(self, analysis_id, kind):
+        analysis = self.analyses.get(analysis_id)
+        if analysis is None or kind not in analysis.held:
+            return
+
+        analysis.held.discard(kind)
+        self.running[kind] -= 1
+        if not analysis.held:
+            del self.analyses[analysis_id]
+        self.dispatch()
+
+    def dispatch(self):
+        while self.queue:
+            _, _, analysis = self.queue[0]
+            if analysis.cancelled:
+                heapq.heappop(self.queue)
+                continue
+            if not self.fits(analysis):
+                return
+            heapq.heappop(self.queue)
+            self.launch(analysis)
+
+    def cancel(self, process_id):
+        for _, _, analysis in self.queue:
+            if not analysis.cancelled and (analysis.id == process_id or process_id in analysis.process_ids):
+                analysis.cancelled = True
+                del self.analyses[analysis.id]
+                self.metrics['cancelled'] += 1
+                return analysis
+        return None
+
+    def queue_length(self):
+        return sum(1 for _, _, analysis in self.queue if not analysis.cancelled)
+
+    # 1-based position of every queued analysis, in the order they will start
+    def queue_positions(self):
+        waiting = sorted((rank, order, analysis.id) for rank, order, analysis in self.queue if not analysis.cancelled)
+        return {analysis_id: position for position, (_, _, analysis_id) in enumerate(waiting, start=1)}
+
+    def stats(self):
+        return {
+            'limits': self.limits,
+            'running': self.running,
+            'queue_length': self.queue_length(),
+            'max_queued': self.max_queued,
+            **self.metrics,
+        }
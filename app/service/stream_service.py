@@ -0,0 +1,92 @@
+import asyncio
+
+from aiohttp import web
+
+from app.json_encoding import dumps
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_INTERVAL = 15   # seconds
+
+
+class Subscription:
+    def __init__(self, process_id, lane_id, event_types, queue_size):
+        self.process_id = process_id
+        self.lane_id = lane_id
+        self.event_types = event_types
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, event_type, process_id, lane_id):
+        return (self.process_id is None or self.process_id == process_id) and \
+            (self.lane_id is None or self.lane_id == lane_id) and \
+            (self.event_types is None or event_type in self.event_types)
+
+    def offer(self, event):
+        # a slow client loses its oldest events instead of blocking the producers
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+
+class ResultBroadcaster:
+    def __init__(self, queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+
+    def subscribe(self, process_id=None, lane_id=None, event_types=None):
+        subscription = Subscription(process_id, lane_id, event_types, self.queue_size)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, event_type, process_id, lane_id, data):
+        if not self.subscriptions:
+            return
+
+        event = None
+        for subscription in self.subscriptions:
+            if subscription.matches(event_type, process_id, lane_id):
+                if event is None:
+                    # serialized once, whatever the number of subscribers
+                    payload = {'process_id': process_id, 'lane_id': lane_id, 'data': data}
+                    event = f"event: {event_type}\ndata: {dumps(payload)}\n\n"
+                subscription.offer(event)
+
+
+class StreamService:
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+
+    # Server-Sent Events with speed, mtlcr and tlir results, optionally filtered by
+    # ?process_id=<parent process id>&lane_id=<lane id>&types=speed,mtlcr,tlir
+    async def stream_results(self, request):
+        process_id = request.query.get('process_id')
+        lane_id = request.query.get('lane_id')
+        event_types = request.query.get('types')
+        if event_types is not None:
+            event_types = set(event_types.split(','))
+
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(request)
+
+        subscription = self.broadcaster.subscribe(process_id, lane_id, event_types)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    event = ': heartbeat\n\n'
+                await response.write(event.encode('utf-8'))
+        except ConnectionResetError:
+            pass
+        finally:
+            self.broadcaster.unsubscribe(subscription)
+
+        return response
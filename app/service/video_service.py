@@ -1,8 +1,7 @@
 import json
 import uuid
 
-from aiohttp import web
-
+from app.json_encoding import json_response
 from app.utils import log
 
 
@@ -17,29 +16,29 @@ class VideoService:
         await self.db_service.insert_video(video)
         log('new video source was loaded: ' + video['link'])
 
-        return web.json_response(status=200)
+        return json_response(status=200)
 
     async def get_video(self, request):
         video_id = request.match_info.get('video_id')
         video = await self.db_service.get_video(video_id)
 
-        return web.json_response(video)
+        return json_response(video)
 
     async def list_videos(self, _request):
         videos = await self.db_service.list_videos()
-        return web.json_response(videos)
+        return json_response(videos)
 
     async def delete_video(self, request):
         video_id = request.match_info.get('video_id')
         await self.db_service.delete_video(video_id)
 
-        return web.json_response(status=200)
+        return json_response(status=200)
 
     async def add_lane(self, request):
         video_id = request.match_info.get('video_id')
         video = await self.db_service.get_video(video_id)
         if video is None:
-            return web.json_response(status=404)
+            return json_response(status=404)
 
         lane = await request.json()
         lane['id'] = str(uuid.uuid4())
@@ -48,17 +47,17 @@ class VideoService:
 
         video['lanes'].append(lane)
         await self.db_service.update_video(video_id, video)
-        return web.json_response(status=200)
+        return json_response(status=200)
 
     async def remove_lane(self, request):
         video_id = request.match_info.get('video_id')
         lane_id = request.match_info.get('lane_id')
         video = await self.db_service.get_video(video_id)
         if video is None:
-            return web.json_response(status=404)
+            return json_response(status=404)
 
         lanes = [lane for lane in video['lanes'] if lane['name'] != lane_id]
         video['lanes'] = lanes
 
         await self.db_service.update_video(video_id, video)
-        return web.json_response(status=200)
+        return json_response(status=200)
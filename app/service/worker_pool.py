@@ -0,0 +1,293 @@
+import asyncio
+import json
+import time
+
+from app.service.result_pipe import ResultPipe
+from app.utils import log
+from pipeline.metrics import split_status
+from pipeline.result_channel import READY, RESULTS, JOB_FINISHED, HEARTBEAT
+
+START_RETRY_DELAY = 1        # seconds before a worker that failed to start is started again, doubled on every failure
+MAX_START_RETRY_DELAY = 60   # seconds
+
+
+class WorkerFailed(Exception):
+    pass
+
+
+class PoolJob:
+    def __init__(self, job_id, on_results):
+        self.id = job_id
+        self.on_results = on_results
+        self.done = asyncio.get_running_loop().create_future()
+        self.progress = None   # last progress the job reported
+        self.metrics = None    # last snapshot of its stage timings
+
+
+class PoolWorker:
+    def __init__(self, pool, number):
+        self.pool = pool
+        self.number = number
+        self.generation = 0
+        self.process = None
+        self.reader_task = None
+        self.ready = None
+        self.jobs = {}   # job_id -> PoolJob
+        self.last_seen = None
+        self.delivering = False   # results are being handed to the orchestrator, the pipe is not read meanwhile
+        self.last_stats = None   # last heartbeat: status of the running jobs and inference counters
+        self.jobs_completed = 0
+
+    @property
+    def name(self):
+        return f"{self.pool.name}-{self.number}"
+
+    async def start(self):
+        self.generation += 1
+        self.ready = asyncio.get_running_loop().create_future()
+        result_pipe = ResultPipe()
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                'python3',
+                *self.pool.script_args,
+                *result_pipe.child_args(),
+                stdin=asyncio.subprocess.PIPE,
+                pass_fds=(result_pipe.write_fd,)
+            )
+        except Exception:
+            result_pipe.close()
+            raise
+        finally:
+            result_pipe.close_child_end()
+        self.last_seen = time.monotonic()
+        self.reader_task = asyncio.create_task(self.read_messages(result_pipe))
+
+    def is_alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def send(self, message):
+        self.process.stdin.write((json.dumps(message) + '\n').encode('utf-8'))
+        await self.process.stdin.drain()
+
+    # returns the last stage timings the job reported
+    async def run_job(self, job, on_results):
+        pool_job = PoolJob(job['id'], on_results)
+        self.jobs[pool_job.id] = pool_job
+        try:
+            await self.send({'type': 'job', 'job': job})
+            await pool_job.done
+            self.jobs_completed += 1
+        finally:
+            self.jobs.pop(pool_job.id, None)
+        return pool_job.metrics
+
+    async def read_messages(self, result_pipe):
+        await result_pipe.open()
+        try:
+            while True:
+                messages = await result_pipe.read()
+                if messages is None:
+                    break
+                await self.handle_messages(messages)
+        finally:
+            result_pipe.close()
+
+        await self.process.wait()
+        if not self.ready.done():
+            self.ready.set_exception(WorkerFailed(f"worker {self.name} exited with {self.process.returncode} while starting"))
+        for pool_job in self.jobs.values():
+            if not pool_job.done.done():
+                pool_job.done.set_exception(WorkerFailed(f"worker {self.name} exited with {self.process.returncode}"))
+
+    async def handle_messages(self, messages):
+        for kind, payload in messages:
+            self.last_seen = time.monotonic()
+            if kind == RESULTS:
+                await self.dispatch_results(payload)
+            elif kind == JOB_FINISHED:
+                pool_job = self.jobs.get(payload['job_id'])
+                if pool_job is not None and not pool_job.done.done():
+                    if payload.get('error'):
+                        pool_job.done.set_exception(WorkerFailed(payload['error']))
+                    else:
+                        pool_job.done.set_result(True)
+            elif kind == HEARTBEAT:
+                self.last_stats = payload
+                for job_id, status in payload['jobs'].items():
+                    pool_job = self.jobs.get(job_id)
+                    if pool_job is not None and status is not None:
+                        pool_job.progress, pool_job.metrics = split_status(status)
+            elif kind == READY:
+                if not self.ready.done():
+                    self.ready.set_result(True)
+
+    async def dispatch_results(self, results):
+        # a batch holds [job_id, result] pairs of any running jobs, every job gets its results in one call
+        results_by_job = {}
+        for job_id, result in results:
+            results_by_job.setdefault(job_id, []).append(result)
+
+        # on_results may wait for the result writer longer than the health check timeout, the worker is not silent
+        # meanwhile, only the pipe is not read
+        self.delivering = True
+        try:
+            for job_id, job_results in results_by_job.items():
+                pool_job = self.jobs.get(job_id)
+                if pool_job is None:
+                    continue
+                try:
+                    await pool_job.on_results(job_results)
+                except Exception as e:
+                    log(f"Failed to handle results of job {pool_job.id} on worker {self.name}: {e}")
+        finally:
+            self.delivering = False
+            self.last_seen = time.monotonic()
+
+    async def stop(self, timeout=5):
+        if self.is_alive():
+            try:
+                await self.send({'type': 'shutdown'})
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except (ConnectionError, asyncio.TimeoutError):
+                self.process.kill()
+                await self.process.wait()
+        if self.reader_task is not None:
+            await self.reader_task
+
+
+class WorkerPool:
+    # script_args - worker script and its arguments, the script serves jobs with pipeline.worker.Worker
+    # jobs_per_worker - streams a worker runs at the same time against its single model
+    # health_check_interval - seconds between pings, health_check_timeout - seconds of silence before a restart
+    def __init__(self, name, script_args, size, jobs_per_worker=1, health_check_interval=10, health_check_timeout=60):
+        self.name = name
+        self.script_args = script_args
+        self.size = size
+        self.jobs_per_worker = max(1, jobs_per_worker)
+        self.health_check_interval = health_check_interval
+        self.health_check_timeout = health_check_timeout
+        self.workers = []
+        # one entry per free job slot, (worker, generation) so slots of a replaced process are dropped
+        self.free_slots = asyncio.Queue()
+        self.restarting = set()
+        self.health_check_task = None
+        self.restarts = 0
+        self.closed = False
+
+    async def start(self):
+        for number in range(self.size):
+            worker = PoolWorker(self, number)
+            self.workers.append(worker)
+            asyncio.create_task(self.warm_up(worker))
+        self.health_check_task = asyncio.create_task(self.check_health())
+
+    async def close(self):
+        self.closed = True
+        if self.health_check_task is not None:
+            self.health_check_task.cancel()
+            self.health_check_task = None
+        await asyncio.gather(*(worker.stop() for worker in self.workers), return_exceptions=True)
+
+    async def warm_up(self, worker):
+        # the model is loaded before the worker takes jobs, so a job never waits for a cold start. A worker that fails
+        # to start is retried with a growing delay, the slots of the pool come back as soon as it is up and admitted
+        # analyses wait for them instead of hanging on a pool without workers
+        delay = START_RETRY_DELAY
+        while True:
+            try:
+                await worker.start()
+                await worker.ready
+                break
+            except Exception as e:
+                log(f"Worker {worker.name} failed to start: {e}, retrying in {delay} seconds")
+            if worker.is_alive():
+                worker.process.kill()
+            if worker.reader_task is not None:
+                await worker.reader_task
+            await asyncio.sleep(delay)
+            if self.closed:
+                return
+            delay = min(delay * 2, MAX_START_RETRY_DELAY)
+        log(f"Worker {worker.name} is ready")
+        for _ in range(self.jobs_per_worker):
+            self.free_slots.put_nowait((worker, worker.generation))
+
+    async def restart(self, worker):
+        if worker in self.restarting:
+            return
+        self.restarting.add(worker)
+        try:
+            self.restarts += 1
+            log(f"Restarting worker {worker.name}")
+            if worker.is_alive():
+                worker.process.kill()
+            if worker.reader_task is not None:
+                await worker.reader_task
+            await self.warm_up(worker)
+        finally:
+            self.restarting.discard(worker)
+
+    async def acquire_slot(self):
+        while True:
+            worker, generation = await self.free_slots.get()
+            if generation != worker.generation:
+                continue
+            if worker.is_alive():
+                return worker
+            # a worker that died while idle is replaced and the job waits for the next free slot
+            asyncio.create_task(self.restart(worker))
+
+    # on_results - coroutine called with every batch of results of the job, returns its last stage timings
+    async def run_job(self, job, on_results):
+        worker = await self.acquire_slot()
+        generation = worker.generation
+        try:
+            return await worker.run_job(job, on_results)
+        finally:
+            if worker.is_alive() and generation == worker.generation:
+                self.free_slots.put_nowait((worker, generation))
+            elif generation == worker.generation:
+                asyncio.create_task(self.restart(worker))
+
+    async def cancel_job(self, job_id):
+        for worker in self.workers:
+            if job_id in worker.jobs and worker.is_alive():
+                await worker.send({'type': 'stop', 'job_id': job_id})
+
+    async def check_health(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.ready is None or not worker.ready.done() or worker in self.restarting or worker.delivering:
+                    continue
+                if worker.is_alive() and now - worker.last_seen > self.health_check_timeout:
+                    # a hung worker is killed, its jobs fail and the worker is replaced once they are released
+                    log(f"Worker {worker.name} did not answer for {now - worker.last_seen:.0f} seconds")
+                    worker.process.kill()
+                elif worker.is_alive():
+                    try:
+                        await worker.send({'type': 'ping'})
+                    except ConnectionError:
+                        worker.process.kill()
+
+    def running_job(self, job_id):
+        for worker in self.workers:
+            if job_id in worker.jobs:
+                return worker.jobs[job_id]
+        return None
+
+    def stats(self):
+        return {
+            'size': self.size,
+            'jobs_per_worker': self.jobs_per_worker,
+            'free_slots': self.free_slots.qsize(),
+            'running_jobs': sum(len(worker.jobs) for worker in self.workers),
+            'restarts': self.restarts,
+            'workers': [{'name': worker.name, 'pid': worker.process.pid if worker.process else None,
+                         'alive': worker.is_alive(), 'job_ids': list(worker.jobs),
+                         'jobs_completed': worker.jobs_completed,
+                         'progress': {job_id: pool_job.progress for job_id, pool_job in worker.jobs.items()},
+                         'inference': worker.last_stats['stats'] if worker.last_stats else None}
+                        for worker in self.workers],
+        }
@@ -1,18 +1,6 @@
-import json
 from datetime import datetime
 
 
-def datetime_serializer(obj):
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    raise TypeError("Type not serializable")
-
-
-def serialize_date_times(obj):
-    serialized_results = json.dumps(obj, default=datetime_serializer)
-    return json.loads(serialized_results)
-
-
 def log(message):
     timestamp = datetime.utcnow().isoformat()
     log_entry = f"[{timestamp}]: {message}"
@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app.json_encoding import dumps, orjson
+
+
+# the serialization result handlers used before app.json_encoding, kept here as the comparison baseline
+def datetime_serializer(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError("Type not serializable")
+
+
+def serialize_date_times(obj):
+    serialized_results = json.dumps(obj, default=datetime_serializer)
+    return json.loads(serialized_results)
+
+
+def generate_results(rows):
+    started_at = datetime(2024, 1, 1)
+    process_id = str(uuid.uuid4())
+    lane_ids = [str(uuid.uuid4()) for _ in range(4)]
+    return [{
+        '_id': ObjectId(),
+        'parent_process_id': process_id,
+        'process_id': process_id,
+        'created_at': started_at + timedelta(milliseconds=250 * i),
+        'result': {'lane_id': lane_ids[i % 4], 'speed': 40 + i % 60, 'start': 1.25, 'finish': 3.5, 'is_up': i % 2 == 0},
+    } for i in range(rows)]
+
+
+def legacy_encode(results):
+    # serialize_date_times followed by the encoding done by web.json_response
+    return json.dumps(serialize_date_times(results))
+
+
+def measure(encode, results, repeats):
+    encode(results[:100])   # warm up
+    started_at = time.perf_counter()
+    for _ in range(repeats):
+        encode(results)
+    return round((time.perf_counter() - started_at) / repeats * 1000, 2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='Result set sizes')
+    parser.add_argument('--repeats', type=int, default=5, help='Encodings per measurement')
+
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        results = generate_results(rows)
+        without_ids = [{key: value for key, value in result.items() if key != '_id'} for result in results]
+        print(json.dumps({
+            'rows': rows,
+            'backend': 'orjson' if orjson is not None else 'json',
+            'legacy_ms': measure(legacy_encode, without_ids, args.repeats),
+            'single_pass_ms': measure(dumps, results, args.repeats),
+        }))
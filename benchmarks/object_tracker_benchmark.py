@@ -0,0 +1,55 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'speed_tracker'))
+
+from object_tracker import ObjectTracker, VectorizedObjectTracker
+
+FRAME_WIDTH = 1080
+FRAME_HEIGHT = 720
+BOX_SIZE = 40
+
+
+def generate_frames(objects_count, frames_count, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = rng.uniform([0, 0], [FRAME_WIDTH - BOX_SIZE, FRAME_HEIGHT - BOX_SIZE], size=(objects_count, 2))
+    velocities = rng.uniform(-6, 6, size=(objects_count, 2))
+
+    frames = []
+    for _ in range(frames_count):
+        positions = np.clip(positions + velocities, 0, [FRAME_WIDTH - BOX_SIZE, FRAME_HEIGHT - BOX_SIZE])
+        top_left = positions.astype(np.int32)
+        frames.append(np.hstack([top_left, top_left + BOX_SIZE]))
+
+    return frames
+
+
+def run_tracker(tracker, frames):
+    started_at = time.perf_counter()
+    for rects in frames:
+        tracker.update(rects)
+    elapsed = time.perf_counter() - started_at
+    return {'frames_per_second': round(len(frames) / elapsed, 1), 'ms_per_frame': round(elapsed / len(frames) * 1000, 3)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--objects', type=int, nargs='+', default=[10, 100, 500], help='Objects per frame')
+    parser.add_argument('--frames', type=int, default=200, help='Frames per run')
+
+    args = parser.parse_args()
+
+    for objects_count in args.objects:
+        frames = generate_frames(objects_count, args.frames)
+        result = {
+            'objects': objects_count,
+            'simple': run_tracker(ObjectTracker(), frames),
+            'vectorized': run_tracker(VectorizedObjectTracker(), frames),
+        }
+        print(json.dumps(result))
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'speed_tracker'))
+sys.path.append(os.path.join(ROOT, 'mtlcr'))
+
+import cv2
+import numpy as np
+
+from inference.backends import create_detector, create_segmenter, DETECTION_BACKENDS, SEGMENTATION_BACKENDS
+from lane import Lane as MtlcrLane
+from lane_locator import Lane, LaneLocator
+from object_tracker import ObjectTracker, VectorizedObjectTracker
+from pipeline.frame_sampler import FrameSampler
+from speed_tracker import SpeedTracker, FRAMES_INTERVAL
+from tracker import read_class_list
+import video_processor
+from video_processor import VideoProcessor, build_video_metadata
+
+CLASSES_PATH = os.path.join(ROOT, 'speed_tracker', 'coco.txt')
+ROAD_COLOR = (70, 70, 70)
+MARKING_COLOR = (100, 100, 100)
+VEHICLE_COLORS = [(40, 40, 200), (200, 60, 40), (30, 180, 220), (230, 230, 230), (60, 160, 60)]
+COLOR_THRESHOLD = 50     # largest channel difference to the road colour still counted as road
+MIN_VEHICLE_AREA = 64    # pixels, smaller blobs are compression noise
+LANE_LENGTH = 70         # meters
+CROSSING_TIME = 2.0      # seconds a vehicle needs to drive through its lane
+
+SPEED_STAGES = ['decode', 'resize', 'inference', 'get_bounding_boxes', 'object_tracker.update', 'lane_locator.locate']
+MTLCR_STAGES = ['decode', 'resize', 'inference', 'create_mask', 'calc_mtlcr']
+
+
+# lanes are vertical strips side by side in the middle of the frame
+def lane_rects(width, height, lanes_count):
+    left, right = int(width * 0.1), int(width * 0.9)
+    top, bottom = int(height * 0.2), int(height * 0.9)
+    lane_width = (right - left) // lanes_count
+    return [(left + i * lane_width, top, left + (i + 1) * lane_width, bottom) for i in range(lanes_count)]
+
+
+# lanes in the format of the API, bottom corners first
+def lane_configs(width, height, lanes_count):
+    return [{'id': i, 'name': f"lane_{i}", 'coords': [(x1, y2), (x2, y2), (x1, y1), (x2, y1)], 'length': LANE_LENGTH,
+             'width': 4, 'max_speed': 120}
+            for i, (x1, y1, x2, y2) in enumerate(lane_rects(width, height, lanes_count))]
+
+
+# Road coloured frames with one rectangle per vehicle, vehicles drive down even lanes and up odd ones.
+# density - vehicles on every lane at the same time
+def generate_video(path, width, height, fps, duration, lanes_count, density, seed=0):
+    rng = np.random.default_rng(seed)
+    rects = lane_rects(width, height, lanes_count)
+
+    background = np.full((height, width, 3), ROAD_COLOR, dtype=np.uint8)
+    for x1, y1, x2, y2 in rects:
+        cv2.rectangle(background, (x1, y1), (x2, y2), MARKING_COLOR, 2)
+
+    lane_width, lane_height = rects[0][2] - rects[0][0], rects[0][3] - rects[0][1]
+    vehicle_height = max(8, lane_height // 8)
+    vehicle_width = max(4, min(int(lane_width * 0.6), int(vehicle_height / 1.6)))
+    # vehicles come in above the frame, leave it at the bottom and start over
+    track = height + vehicle_height
+    speed = lane_height / CROSSING_TIME
+    vehicles = [[(track * (i + rng.uniform(0, 0.5)) / density, VEHICLE_COLORS[rng.integers(len(VEHICLE_COLORS))])
+                 for i in range(density)] for _ in rects]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for index in range(round(duration * fps)):
+        frame = background.copy()
+        for lane_index, (x1, _, x2, _) in enumerate(rects):
+            center = (x1 + x2) // 2
+            for offset, color in vehicles[lane_index]:
+                y = int((offset + speed * index / fps) % track) - vehicle_height
+                if lane_index % 2:
+                    y = height - y - vehicle_height
+                cv2.rectangle(frame, (center - vehicle_width // 2, y), (center + vehicle_width // 2, y + vehicle_height),
+                              color, -1)
+        writer.write(frame)
+    writer.release()
+
+
+# Stands in for the detection model: every blob that is not road coloured is a car
+class ColorDetector:
+    name = 'synthetic'
+
+    def __init__(self, class_id):
+        self.class_id = class_id
+
+    def predict(self, frames):
+        return [self.detect(frame) for frame in frames]
+
+    def detect(self, frame):
+        vehicles = cv2.absdiff(frame, np.full_like(frame, ROAD_COLOR)).max(axis=2) > COLOR_THRESHOLD
+        _, _, stats, _ = cv2.connectedComponentsWithStats(vehicles.astype(np.uint8))
+        stats = stats[1:]
+        stats = stats[stats[:, cv2.CC_STAT_AREA] >= MIN_VEHICLE_AREA]
+
+        detections = np.zeros((len(stats), 6), dtype=np.float32)
+        detections[:, :2] = stats[:, :2]
+        detections[:, 2:4] = stats[:, :2] + stats[:, 2:4]
+        detections[:, 4] = 1.0
+        detections[:, 5] = self.class_id
+        return detections
+
+
+# Stands in for the segmentation model: road coloured pixels are road
+class ColorSegmenter:
+    name = 'synthetic'
+
+    def predict(self, frames):
+        road = np.abs(np.stack(frames).astype(np.int16) - ROAD_COLOR).max(axis=-1) <= COLOR_THRESHOLD
+        road = road.astype(np.float32)
+        return list(np.stack([1 - road, road], axis=-1))
+
+
+class StageTimer:
+    def __init__(self, stages):
+        self.stages = {stage: {'calls': 0, 'frames': 0, 'seconds': 0.0} for stage in stages}
+
+    def add(self, stage, seconds, frames=1):
+        timing = self.stages[stage]
+        timing['calls'] += 1
+        timing['frames'] += frames
+        timing['seconds'] += seconds
+
+    # count - frames handled by a call, from its arguments
+    def wrap(self, stage, function, count=None):
+        def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            result = function(*args, **kwargs)
+            self.add(stage, time.perf_counter() - started_at, count(*args) if count is not None else 1)
+            return result
+
+        return timed
+
+    def iterate(self, stage, iterable):
+        iterator = iter(iterable)
+        while True:
+            started_at = time.perf_counter()
+            item = next(iterator, None)
+            if item is None:
+                return
+            self.add(stage, time.perf_counter() - started_at)
+            yield item
+
+    def report(self):
+        return {stage: {
+            'calls': timing['calls'],
+            'frames': timing['frames'],
+            'ms_per_frame': round(1000 * timing['seconds'] / timing['frames'], 3) if timing['frames'] else None,
+            'frames_per_second': round(timing['frames'] / timing['seconds'], 1) if timing['seconds'] else None,
+        } for stage, timing in self.stages.items()}
+
+
+def open_video(video_path):
+    cap = cv2.VideoCapture(video_path)
+    return cap, cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+def run_speed(video_path, lanes, args):
+    timer = StageTimer(SPEED_STAGES)
+    class_list = read_class_list(CLASSES_PATH)
+    if args.detection_model:
+        detector = create_detector(args.detection_model, args.detection_backend, args.device)
+    else:
+        detector = ColorDetector(class_list.index('car'))
+    detector.predict = timer.wrap('inference', detector.predict, len)
+
+    object_tracker = ObjectTracker() if args.tracker == 'simple' else VectorizedObjectTracker()
+    object_tracker.update = timer.wrap('object_tracker.update', object_tracker.update)
+    lane_locator = LaneLocator([Lane(**lane) for lane in lanes])
+    lane_locator.locate = timer.wrap('lane_locator.locate', lane_locator.locate)
+
+    results = []
+    tracker = SpeedTracker(detector, class_list, object_tracker, lane_locator, batch_size=args.batch_size,
+                           result_handler=results.append, roi_padding=args.roi_padding,
+                           min_frames_interval=args.frames_interval, max_lag=None, motion_gate=args.motion_gate)
+    tracker.preprocess_frame = timer.wrap('resize', tracker.preprocess_frame)
+    tracker.get_bounding_boxes = timer.wrap('get_bounding_boxes', tracker.get_bounding_boxes)
+
+    cap, fps, width, height = open_video(video_path)
+    sampler = tracker.create_sampler(fps)
+    frame_sampler = FrameSampler(cap, sampler.min_step - 1, sampler.step)
+    sampler.drive(frame_sampler)
+
+    started_at = time.perf_counter()
+    tracker.process_frames(timer.iterate('decode', frame_sampler), width, height)
+    elapsed = time.perf_counter() - started_at
+    cap.release()
+
+    progress = tracker.progress
+    report = {'pipeline': 'speed', 'model': detector.name, 'frames': progress['frames'],
+              'frames_per_second': round(progress['frames'] / elapsed, 1), 'results': len(results),
+              'stages': timer.report()}
+    if 'skip_rate' in progress:
+        report['skip_rate'] = progress['skip_rate']
+    return report
+
+
+def run_mtlcr(video_path, lanes, args):
+    timer = StageTimer(MTLCR_STAGES)
+    if args.segmentation_model:
+        segmenter = create_segmenter(args.segmentation_model, args.segmentation_backend, args.device)
+    else:
+        segmenter = ColorSegmenter()
+    segmenter.predict = timer.wrap('inference', segmenter.predict, len)
+    processor = VideoProcessor(segmenter, batch_size=args.batch_size)
+
+    cap, fps, width, height = open_video(video_path)
+    video = build_video_metadata(video_path, [MtlcrLane(**lane) for lane in lanes], args.mtlcr_interval, fps, width,
+                                 height, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), offline=True)
+    compiled_lanes = video['compiled_lanes']
+    compiled_lanes.calc_mtlcr_batch = timer.wrap('calc_mtlcr', compiled_lanes.calc_mtlcr_batch, len)
+
+    processor.sampler = processor.create_sampler(video, fps)
+    frame_sampler = FrameSampler(cap, 0, processor.sampler.step)
+    processor.sampler.drive(frame_sampler)
+
+    # resizing and masks are module functions of the video processor
+    preprocess_frame, create_mask = video_processor.preprocess_frame, video_processor.create_mask
+    video_processor.preprocess_frame = timer.wrap('resize', preprocess_frame)
+    video_processor.create_mask = timer.wrap('create_mask', create_mask, len)
+    results = []
+    try:
+        started_at = time.perf_counter()
+        processor.process_frames(timer.iterate('decode', frame_sampler), video, results.append, None)
+        elapsed = time.perf_counter() - started_at
+    finally:
+        video_processor.preprocess_frame, video_processor.create_mask = preprocess_frame, create_mask
+        cap.release()
+
+    frames = processor.progress['frames']
+    return {'pipeline': 'mtlcr', 'model': segmenter.name, 'frames': frames,
+            'frames_per_second': round(frames / elapsed, 1), 'results': len(results), 'stages': timer.report()}
+
+
+# throughputs that dropped by more than tolerance against the baseline run
+def find_regressions(reports, baseline, tolerance):
+    baseline_reports = {report['pipeline']: report for report in baseline['pipelines']}
+    regressions = []
+    for report in reports:
+        previous = baseline_reports.get(report['pipeline'])
+        if previous is None:
+            continue
+
+        pairs = [('total', report['frames_per_second'], previous['frames_per_second'])]
+        pairs += [(stage, timing['frames_per_second'], previous['stages'].get(stage, {}).get('frames_per_second'))
+                  for stage, timing in report['stages'].items()]
+        for stage, current, expected in pairs:
+            if current is not None and expected and current < expected * (1 - tolerance):
+                regressions.append({'pipeline': report['pipeline'], 'stage': stage, 'frames_per_second': current,
+                                    'baseline': expected})
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of the speed and MTLCR pipelines on a synthetic video')
+
+    parser.add_argument('--pipelines', nargs='+', choices=['speed', 'mtlcr'], default=['speed', 'mtlcr'], help='Pipelines to run')
+    parser.add_argument('--width', type=int, default=1920, help='Video width')
+    parser.add_argument('--height', type=int, default=1080, help='Video height')
+    parser.add_argument('--fps', type=int, default=25, help='Video frame rate')
+    parser.add_argument('--duration', type=float, default=20, help='Video length in seconds')
+    parser.add_argument('--lanes', type=int, default=2, help='Number of lanes')
+    parser.add_argument('--density', type=int, default=2, help='Vehicles on every lane at the same time')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the vehicle placement')
+    parser.add_argument('--video_path', type=str, default=None, help='Keep the generated video here, a temporary file is used when omitted')
+    parser.add_argument('--batch_size', type=int, default=1, help='Frames per model call')
+    parser.add_argument('--frames_interval', type=int, default=FRAMES_INTERVAL, help='Distance between detected frames')
+    parser.add_argument('--mtlcr_interval', type=float, default=0, help='Seconds between segmented frames, 0 segments every frame')
+    parser.add_argument('--tracker', choices=['vectorized', 'simple'], default='vectorized', help='Object tracker engine')
+    parser.add_argument('--roi_padding', type=int, default=None, help='Detect only around the lanes with this padding, whole frame when omitted')
+    parser.add_argument('--motion_gate', action='store_true', help='Skip detection on frames without motion in the lanes')
+    parser.add_argument('--detection_model', type=str, default=None, help='Detection model, a colour thresholding stub when omitted')
+    parser.add_argument('--detection_backend', choices=DETECTION_BACKENDS, default='auto', help='Detection inference backend')
+    parser.add_argument('--segmentation_model', type=str, default=None, help='Segmentation model, a colour thresholding stub when omitted')
+    parser.add_argument('--segmentation_backend', choices=SEGMENTATION_BACKENDS, default='auto', help='Segmentation inference backend')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
+    parser.add_argument('--output', type=str, default=None, help='Write the report to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Report of an earlier run, exits with 1 when a throughput regressed')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Accepted throughput drop against the baseline')
+
+    args = parser.parse_args()
+
+    video = {'width': args.width, 'height': args.height, 'fps': args.fps, 'duration': args.duration,
+             'lanes': args.lanes, 'density': args.density}
+    lanes = lane_configs(args.width, args.height, args.lanes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        video_path = args.video_path or os.path.join(directory, 'synthetic.avi')
+        generate_video(video_path, args.width, args.height, args.fps, args.duration, args.lanes, args.density, args.seed)
+
+        reports = []
+        for pipeline in args.pipelines:
+            report = run_speed(video_path, lanes, args) if pipeline == 'speed' else run_mtlcr(video_path, lanes, args)
+            reports.append(report)
+            print(json.dumps({'video': video, **report}))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'video': video, 'pipelines': reports}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = find_regressions(reports, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(json.dumps({'regression': regression}))
+        if regressions:
+            sys.exit(1)
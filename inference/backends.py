@@ -0,0 +1,191 @@
+import cv2
+import numpy as np
+
+DETECTION_INPUT_SIZE = 640
+DETECTION_CONFIDENCE = 0.25
+DETECTION_IOU = 0.7
+LETTERBOX_COLOR = 114
+CLASS_OFFSET = 4096   # shifts boxes of different classes apart so one NMS pass stays per class
+
+DETECTION_BACKENDS = ('auto', 'ultralytics', 'onnx')
+SEGMENTATION_BACKENDS = ('auto', 'keras', 'onnx')
+
+
+def detect_device():
+    try:
+        import torch
+    except ImportError:
+        return 'cpu'
+
+    if torch.cuda.is_available():
+        return 'cuda:0'
+    mps = getattr(torch.backends, 'mps', None)
+    if mps is not None and mps.is_available():
+        return 'mps'
+    return 'cpu'
+
+
+def onnx_session(model_path, device=None, threads=None):
+    import onnxruntime
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        options.intra_op_num_threads = threads
+
+    device = device or detect_device()
+    providers = ['CUDAExecutionProvider'] if device.startswith('cuda') else []
+    providers.append('CPUExecutionProvider')
+    available = onnxruntime.get_available_providers()
+    return onnxruntime.InferenceSession(model_path, options,
+                                        providers=[provider for provider in providers if provider in available])
+
+
+def onnx_input_dtype(model_input):
+    return np.float16 if model_input.type == 'tensor(float16)' else np.float32
+
+
+def has_dynamic_batch(model_input):
+    return not isinstance(model_input.shape[0], int)
+
+
+# Scales the frame into a size x size square keeping its aspect ratio, like Ultralytics does before inference.
+# Returns the square and the scale and padding needed to map boxes back to the frame.
+def letterbox(frame, size=DETECTION_INPUT_SIZE):
+    height, width = frame.shape[:2]
+    scale = min(size / height, size / width)
+    resized_width, resized_height = round(width * scale), round(height * scale)
+    pad_x, pad_y = (size - resized_width) // 2, (size - resized_height) // 2
+
+    square = np.full((size, size, 3), LETTERBOX_COLOR, dtype=np.uint8)
+    square[pad_y:pad_y + resized_height, pad_x:pad_x + resized_width] = cv2.resize(
+        frame, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+    return square, scale, pad_x, pad_y
+
+
+# BGR frames -> RGB NCHW batch in [0, 1]
+def detection_batch(squares, dtype=np.float32):
+    batch = np.stack(squares)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=dtype) / dtype(255)
+
+
+# output - YOLOv8 head of one image, (4 + classes, anchors) rows cx, cy, w, h and the class scores
+# returns (N, 6) rows [x1, y1, x2, y2, confidence, class_id] in frame coordinates, the layout of Ultralytics boxes.data
+def decode_detections(output, scale, pad_x, pad_y, confidence=DETECTION_CONFIDENCE, iou=DETECTION_IOU):
+    predictions = np.asarray(output, dtype=np.float32).T
+    class_ids = predictions[:, 4:].argmax(axis=1)
+    scores = predictions[np.arange(len(predictions)), 4 + class_ids]
+
+    keep = scores >= confidence
+    predictions, class_ids, scores = predictions[keep], class_ids[keep], scores[keep]
+    if not len(predictions):
+        return np.zeros((0, 6), dtype=np.float32)
+
+    cx, cy, w, h = predictions[:, 0], predictions[:, 1], predictions[:, 2], predictions[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    shifted = boxes + (class_ids * CLASS_OFFSET)[:, None]
+    rects = np.stack([shifted[:, 0], shifted[:, 1], w, h], axis=1)
+    indexes = np.asarray(cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(), confidence, iou), dtype=np.int64).reshape(-1)
+    indexes = indexes[np.argsort(-scores[indexes])]
+
+    boxes = (boxes[indexes] - [pad_x, pad_y, pad_x, pad_y]) / scale
+    return np.concatenate([boxes, scores[indexes, None], class_ids[indexes, None]], axis=1).astype(np.float32)
+
+
+class UltralyticsDetector:
+    name = 'ultralytics'
+
+    # half - fp16 inference, only used on GPUs
+    def __init__(self, weights_path, device=None, half=False):
+        from ultralytics import YOLO
+
+        self.model = YOLO(weights_path)
+        self.device = device or detect_device()
+        self.half = half and self.device != 'cpu'
+
+    # frames - BGR images, returns one (N, 6) array [x1, y1, x2, y2, confidence, class_id] per frame
+    def predict(self, frames):
+        results = self.model.predict(list(frames), device=self.device, half=self.half, verbose=False)
+        return [result.boxes.data.cpu().numpy() for result in results]
+
+
+class OnnxDetector:
+    name = 'onnx'
+
+    def __init__(self, model_path, device=None, confidence=DETECTION_CONFIDENCE, iou=DETECTION_IOU, threads=None):
+        self.session = onnx_session(model_path, device, threads)
+        self.input = self.session.get_inputs()[0]
+        self.dtype = onnx_input_dtype(self.input)
+        self.size = self.input.shape[2] if isinstance(self.input.shape[2], int) else DETECTION_INPUT_SIZE
+        self.confidence = confidence
+        self.iou = iou
+
+    def predict(self, frames):
+        letterboxed = [letterbox(frame, self.size) for frame in frames]
+        batch = detection_batch([square for square, _, _, _ in letterboxed], self.dtype)
+
+        if has_dynamic_batch(self.input):
+            outputs = self.session.run(None, {self.input.name: batch})[0]
+        else:
+            outputs = np.concatenate([self.session.run(None, {self.input.name: image[None]})[0] for image in batch])
+
+        return [decode_detections(output, scale, pad_x, pad_y, self.confidence, self.iou)
+                for output, (_, scale, pad_x, pad_y) in zip(outputs, letterboxed)]
+
+
+class KerasSegmenter:
+    name = 'keras'
+
+    def __init__(self, model_path):
+        import tensorflow
+
+        tensorflow.keras.utils.disable_interactive_logging()
+        self.model = tensorflow.keras.models.load_model(model_path)
+        # traced once, calls skip the per-call setup of Model.predict; the batch dimension stays dynamic
+        input_spec = tensorflow.TensorSpec((None,) + tuple(self.model.input_shape[1:]), tensorflow.float32)
+        self.call = tensorflow.function(lambda batch: self.model(batch, training=False), input_signature=[input_spec])
+
+    # frames - preprocessed images, returns one (height, width, classes) score map per frame
+    def predict(self, frames):
+        return list(self.call(np.stack(frames).astype(np.float32)).numpy())
+
+
+class OnnxSegmenter:
+    name = 'onnx'
+
+    def __init__(self, model_path, device=None, threads=None):
+        self.session = onnx_session(model_path, device, threads)
+        self.input = self.session.get_inputs()[0]
+        self.dtype = onnx_input_dtype(self.input)
+
+    def predict(self, frames):
+        # same input as the Keras model gets, the exported graph keeps its own scaling
+        batch = np.stack(frames).astype(self.dtype)
+        if has_dynamic_batch(self.input):
+            return list(self.session.run(None, {self.input.name: batch})[0])
+        return [self.session.run(None, {self.input.name: image[None]})[0][0] for image in batch]
+
+
+def resolve_backend(model_path, backend, default):
+    if backend == 'auto':
+        return 'onnx' if model_path.endswith('.onnx') else default
+    return backend
+
+
+def create_detector(model_path, backend='auto', device=None, half=False):
+    backend = resolve_backend(model_path, backend, 'ultralytics')
+    if backend == 'onnx':
+        return OnnxDetector(model_path, device)
+    if backend == 'ultralytics':
+        return UltralyticsDetector(model_path, device, half)
+    raise ValueError(f"Unknown detection backend {backend}, expected one of {', '.join(DETECTION_BACKENDS)}")
+
+
+def create_segmenter(model_path, backend='auto', device=None):
+    backend = resolve_backend(model_path, backend, 'keras')
+    if backend == 'onnx':
+        return OnnxSegmenter(model_path, device)
+    if backend == 'keras':
+        return KerasSegmenter(model_path)
+    raise ValueError(f"Unknown segmentation backend {backend}, expected one of {', '.join(SEGMENTATION_BACKENDS)}")
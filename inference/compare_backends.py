@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cv2
+import numpy as np
+
+from inference.backends import create_detector, create_segmenter
+from inference.export_models import sample_frames, SEGMENTATION_INPUT_SIZE
+
+MATCH_IOU = 0.5
+ROAD_CLASS = 1
+DETECTION_FRAME_SIZE = (1080, 720)   # the speed pipeline detects on frames resized to this size
+
+
+def box_iou(boxes, other_boxes):
+    top_left = np.maximum(boxes[:, None, :2], other_boxes[None, :, :2])
+    bottom_right = np.minimum(boxes[:, None, 2:4], other_boxes[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    areas = np.prod(boxes[:, 2:4] - boxes[:, :2], axis=1)
+    other_areas = np.prod(other_boxes[:, 2:4] - other_boxes[:, :2], axis=1)
+    return intersection / np.maximum(areas[:, None] + other_areas[None, :] - intersection, 1e-9)
+
+
+# detections of the candidate matched greedily to the reference ones of the same class, best IoU first
+def match_detections(reference, candidate, min_iou=MATCH_IOU):
+    if not len(reference) or not len(candidate):
+        return []
+
+    ious = box_iou(reference, candidate)
+    ious[reference[:, None, 5] != candidate[None, :, 5]] = 0
+    matches = []
+    matched_reference, matched_candidate = set(), set()
+    for flat_index in np.argsort(-ious, axis=None):
+        i, j = np.unravel_index(flat_index, ious.shape)
+        if ious[i, j] < min_iou:
+            break
+        if i in matched_reference or j in matched_candidate:
+            continue
+        matched_reference.add(i)
+        matched_candidate.add(j)
+        matches.append((i, j, float(ious[i, j])))
+    return matches
+
+
+def detection_agreement(reference_outputs, candidate_outputs):
+    matched = reference_count = candidate_count = 0
+    iou_sum = 0.0
+    for reference, candidate in zip(reference_outputs, candidate_outputs):
+        matches = match_detections(reference, candidate)
+        matched += len(matches)
+        iou_sum += sum(iou for _, _, iou in matches)
+        reference_count += len(reference)
+        candidate_count += len(candidate)
+
+    precision = matched / candidate_count if candidate_count else 1.0
+    recall = matched / reference_count if reference_count else 1.0
+    return {
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        'mean_iou': iou_sum / matched if matched else 0.0,
+    }
+
+
+def segmentation_agreement(reference_outputs, candidate_outputs):
+    agreement = []
+    road_ious = []
+    for reference, candidate in zip(reference_outputs, candidate_outputs):
+        reference_classes = np.argmax(reference, axis=-1)
+        candidate_classes = np.argmax(candidate, axis=-1)
+        agreement.append(np.mean(reference_classes == candidate_classes))
+
+        reference_road = reference_classes == ROAD_CLASS
+        candidate_road = candidate_classes == ROAD_CLASS
+        union = np.logical_or(reference_road, candidate_road).sum()
+        road_ious.append(np.logical_and(reference_road, candidate_road).sum() / union if union else 1.0)
+
+    return {'pixel_agreement': float(np.mean(agreement)), 'road_iou': float(np.mean(road_ious))}
+
+
+def run(model, inputs, batch_size, warmup_batches=1):
+    for start in range(0, min(len(inputs), warmup_batches * batch_size), batch_size):
+        model.predict(inputs[start:start + batch_size])
+
+    outputs = []
+    started_at = time.perf_counter()
+    for start in range(0, len(inputs), batch_size):
+        outputs.extend(model.predict(inputs[start:start + batch_size]))
+    elapsed = time.perf_counter() - started_at
+
+    return outputs, {'frames_per_second': len(inputs) / elapsed, 'ms_per_frame': 1000 * elapsed / len(inputs)}
+
+
+# variant - "<backend>:<model path>", the first variant of a kind is the reference the others are compared to
+def parse_variant(variant):
+    backend, _, model_path = variant.partition(':')
+    return backend, model_path
+
+
+def compare(kind, variants, inputs, batch_size, tolerance, device):
+    agreement = detection_agreement if kind == 'detection' else segmentation_agreement
+    accuracy_key = 'f1' if kind == 'detection' else 'road_iou'
+
+    reports = []
+    reference_outputs = None
+    for variant in variants:
+        backend, model_path = parse_variant(variant)
+        if kind == 'detection':
+            model = create_detector(model_path, backend, device)
+        else:
+            model = create_segmenter(model_path, backend, device)
+
+        outputs, speed = run(model, inputs, batch_size)
+        if reference_outputs is None:
+            reference_outputs = outputs
+        accuracy = agreement(reference_outputs, outputs)
+
+        report = {'model': kind, 'backend': model.name, 'path': model_path, **speed, **accuracy,
+                  'within_tolerance': accuracy[accuracy_key] >= 1 - tolerance}
+        print(json.dumps(report))
+        reports.append(report)
+
+    eligible = [report for report in reports if report['within_tolerance']]
+    best = max(eligible, key=lambda report: report['frames_per_second'])
+    print(json.dumps({'model': kind, 'recommended': {'backend': best['backend'], 'path': best['path']},
+                      'frames_per_second': best['frames_per_second'], accuracy_key: best[accuracy_key]}))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare accuracy and throughput of inference backends on a sample clip')
+
+    parser.add_argument('--video_path', type=str, required=True, help='Sample clip')
+    parser.add_argument('--frames', type=int, default=64, help='Frames sampled from the clip')
+    parser.add_argument('--step', type=int, default=10, help='Distance between sampled frames')
+    parser.add_argument('--batch_size', type=int, default=8, help='Frames per model call')
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Accepted drop of F1 (detection) or road IoU (segmentation) against the reference')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
+    parser.add_argument('--detection', nargs='*', default=['ultralytics:speed_tracker/models/yolov8x.pt',
+                                                           'onnx:speed_tracker/models/yolov8x.onnx',
+                                                           'onnx:speed_tracker/models/yolov8x.fp16.onnx',
+                                                           'onnx:speed_tracker/models/yolov8x.int8.onnx'],
+                        help='Detection variants as backend:path, the first one is the reference')
+    parser.add_argument('--segmentation', nargs='*', default=['keras:mtlcr/models/road_segmentation.h5',
+                                                              'onnx:mtlcr/models/road_segmentation.onnx',
+                                                              'onnx:mtlcr/models/road_segmentation.fp16.onnx',
+                                                              'onnx:mtlcr/models/road_segmentation.int8.onnx'],
+                        help='Segmentation variants as backend:path, the first one is the reference')
+
+    args = parser.parse_args()
+
+    frames = sample_frames(args.video_path, args.frames, args.step)
+    if args.detection:
+        resized = [cv2.resize(frame, DETECTION_FRAME_SIZE) for frame in frames]
+        compare('detection', args.detection, resized, args.batch_size, args.tolerance, args.device)
+    if args.segmentation:
+        resized = [cv2.resize(frame, (SEGMENTATION_INPUT_SIZE, SEGMENTATION_INPUT_SIZE)) for frame in frames]
+        compare('segmentation', args.segmentation, resized, args.batch_size, args.tolerance, args.device)
@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cv2
+import numpy as np
+
+from inference.backends import DETECTION_INPUT_SIZE, letterbox, detection_batch
+from pipeline.frame_sampler import FrameSampler
+
+SEGMENTATION_INPUT_SIZE = 256
+CALIBRATION_FRAMES = 32
+
+
+def variant_path(model_path, variant):
+    return f"{os.path.splitext(model_path)[0]}.{variant}.onnx"
+
+
+def export_detector(weights_path, imgsz=DETECTION_INPUT_SIZE):
+    from ultralytics import YOLO
+
+    # dynamic batch, so the inference server can send whole batches
+    return YOLO(weights_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+
+
+def export_segmenter(model_path, opset=13):
+    import tensorflow
+    import tf2onnx
+
+    model = tensorflow.keras.models.load_model(model_path)
+    input_signature = (tensorflow.TensorSpec((None,) + tuple(model.input_shape[1:]), tensorflow.float32, name='input'),)
+    output_path = os.path.splitext(model_path)[0] + '.onnx'
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=output_path)
+    return output_path
+
+
+def convert_fp16(onnx_path):
+    import onnx
+    from onnxconverter_common import float16
+
+    output_path = variant_path(onnx_path, 'fp16')
+    # inputs and outputs stay float32, so callers do not change
+    onnx.save(float16.convert_float_to_float16(onnx.load(onnx_path), keep_io_types=True), output_path)
+    return output_path
+
+
+def sample_frames(video_path, count, step):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    for _, _, frame in FrameSampler(cap, 0, step):
+        frames.append(frame)
+        if len(frames) >= count:
+            break
+    cap.release()
+    return frames
+
+
+def detection_calibration(frames):
+    return [detection_batch([letterbox(frame)[0]]) for frame in frames]
+
+
+def segmentation_calibration(frames):
+    return [cv2.resize(frame, (SEGMENTATION_INPUT_SIZE, SEGMENTATION_INPUT_SIZE))[np.newaxis].astype(np.float32)
+            for frame in frames]
+
+
+# static int8 with activation ranges calibrated on frames of a sample clip, dynamic int8 without one
+def quantize_int8(onnx_path, calibration_batches=None):
+    from onnxruntime.quantization import CalibrationDataReader, QuantType, quantize_dynamic, quantize_static
+    import onnxruntime
+
+    output_path = variant_path(onnx_path, 'int8')
+    if calibration_batches is None:
+        quantize_dynamic(onnx_path, output_path, weight_type=QuantType.QUInt8)
+        return output_path
+
+    input_name = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class FramesReader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter(calibration_batches)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {input_name: batch}
+
+    quantize_static(onnx_path, output_path, FramesReader(), activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8)
+    return output_path
+
+
+def export(model_path, kind, variants, calibration_frames):
+    onnx_path = model_path
+    if not model_path.endswith('.onnx'):
+        onnx_path = export_detector(model_path) if kind == 'detection' else export_segmenter(model_path)
+    exported = {'fp32': onnx_path}
+
+    if 'fp16' in variants:
+        exported['fp16'] = convert_fp16(onnx_path)
+    if 'int8' in variants:
+        calibration = None
+        if calibration_frames:
+            calibration = detection_calibration(calibration_frames) if kind == 'detection' \
+                else segmentation_calibration(calibration_frames)
+        exported['int8'] = quantize_int8(onnx_path, calibration)
+
+    return exported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the detection and segmentation models to ONNX')
+
+    parser.add_argument('--detection_model', type=str, default='speed_tracker/models/yolov8x.pt', help='YOLO weights, empty to skip')
+    parser.add_argument('--segmentation_model', type=str, default='mtlcr/models/road_segmentation.h5', help='Keras model, empty to skip')
+    parser.add_argument('--variants', nargs='*', choices=['fp16', 'int8'], default=['fp16', 'int8'], help='Reduced precision variants to build')
+    parser.add_argument('--calibration_video', type=str, default=None, help='Sample clip for static int8 calibration')
+    parser.add_argument('--calibration_frames', type=int, default=CALIBRATION_FRAMES, help='Frames taken from the calibration clip')
+
+    args = parser.parse_args()
+
+    frames = None
+    if args.calibration_video:
+        frames = sample_frames(args.calibration_video, args.calibration_frames, step=25)
+
+    if args.detection_model:
+        print(json.dumps({'model': 'detection', **export(args.detection_model, 'detection', args.variants, frames)}))
+    if args.segmentation_model:
+        print(json.dumps({'model': 'segmentation', **export(args.segmentation_model, 'segmentation', args.variants, frames)}))
@@ -6,10 +6,7 @@ from app.config import MONGO_CONFIG
 from app.service.video_service import VideoService
 from app.service.db_service import DBService
 from app.service.processing_service import ProcessingService
-
-
-async def health_check(_request):
-    return web.json_response({"ok": True})
+from app.service.stream_service import ResultBroadcaster, StreamService
 
 
 async def init_app(debug=False, log_levels=None):
@@ -19,10 +16,18 @@ async def init_app(debug=False, log_levels=None):
     app = web.Application()
     db_service = DBService(MONGO_CONFIG)
     await db_service.init_db()
-    processing_service = ProcessingService(db_service, debug, log_levels=log_levels)
+    broadcaster = ResultBroadcaster()
+    processing_service = ProcessingService(db_service, broadcaster, debug, log_levels=log_levels)
+    await processing_service.start()
     video_service = VideoService(db_service)
+    stream_service = StreamService(broadcaster)
+
+    async def health_check(_request):
+        return web.json_response({"ok": True, "workers": processing_service.worker_stats(),
+                                  "scheduler": processing_service.scheduler.stats()})
 
     app.router.add_get('/health', health_check)
+    app.router.add_get('/metrics', processing_service.get_metrics)
 
     app.router.add_get('/videos', video_service.list_videos)
     app.router.add_post('/videos', video_service.add_video)
@@ -45,6 +50,14 @@ async def init_app(debug=False, log_levels=None):
     app.router.add_get('/processes/{process_id}/composed_results', processing_service.list_composed_results_by_process_id)
     # app.router.add_get('/processes/{process_id}/lanes/{lane_id}/tlir_results', processing_service.list_speed_results_by_process_and_lane_id)
 
+    app.router.add_get('/results/stream', stream_service.stream_results)
+
+    async def close_services(_app):
+        await processing_service.close()
+        await db_service.close_db()
+
+    app.on_cleanup.append(close_services)
+
     return app
 
 
@@ -72,6 +72,103 @@ def calc_mtlcr_by_reduced_mask(reduced_mask):
     return mtlcr
 
 
+# Lane geometry never changes during a run, so the perspective transform of every lane is computed once. Every frame
+# is then warped lane by lane with the same cv2.warpPerspective as calc_mtlcr, and the rows of all lanes are reduced
+# together.
+class CompiledLanes:
+    def __init__(self, lanes_corner_coords, init_width, init_height, threshold=25):
+        self.threshold = threshold
+        self.lanes_count = len(lanes_corner_coords)
+
+        self.transforms = []   # (matrix, (width, height)) of every lane, None for a lane without rows
+        row_widths = [np.empty(0, dtype=np.int64)]
+        lane_rows = []
+        lane_pixels = []
+        for corner_coords in lanes_corner_coords:
+            reduced_corner_coords = reduce_corner_coords(corner_coords, init_width, init_height)
+            transform = self.compile_lane(reduced_corner_coords)
+            self.transforms.append(transform)
+            width, height = transform[1] if transform is not None else (0, 0)
+            row_widths.append(np.full(height, width, dtype=np.int64))
+            lane_rows.append(height)
+            lane_pixels.append(width * height)
+
+        self.row_widths = np.concatenate(row_widths)
+        self.row_ends = np.cumsum(self.row_widths)
+        self.row_starts = self.row_ends - self.row_widths
+        self.lane_rows = np.array(lane_rows, dtype=np.int64)
+        self.lane_row_ends = np.cumsum(self.lane_rows)
+        self.lane_row_starts = self.lane_row_ends - self.lane_rows
+        # warped pixels of every lane in the flattened rows of all lanes
+        self.pixel_ends = np.cumsum(np.array(lane_pixels, dtype=np.int64))
+        self.pixel_starts = self.pixel_ends - lane_pixels
+        self.pixels_count = int(self.row_widths.sum())
+
+    # same transform as transform_perspective. A lane without width or height, or whose corners do not form a convex
+    # quadrilateral (duplicate, collinear or crossed corners), has no rows and its MTLCR is 0.0
+    @staticmethod
+    def compile_lane(corner_coords):
+        target_width = corner_coords[1][0] - corner_coords[0][0]
+        target_height = corner_coords[0][1] - corner_coords[2][1]
+        if target_width <= 0 or target_height <= 0 or not is_convex_quad(corner_coords):
+            return None
+
+        src_points = np.array(corner_coords, dtype=np.float32)
+        dst_points = np.array([
+            [0, target_height], [target_width, target_height],
+            [0, 0], [target_width, 0]
+        ], dtype=np.float32)
+
+        return cv2.getPerspectiveTransform(src_points, dst_points), (target_width, target_height)
+
+    def calc_mtlcr(self, mask):
+        return self.calc_mtlcr_batch(mask[np.newaxis])[0]
+
+    # masks - (frames, height, width[, 1]), returns the MTLCR of every lane for every frame
+    def calc_mtlcr_batch(self, masks):
+        if self.lanes_count == 0:
+            return [[] for _ in range(len(masks))]
+
+        masks = masks.reshape(len(masks), SEGMENTATION_HEIGHT, SEGMENTATION_WIDTH).astype(np.uint8)
+        transformed = np.empty((len(masks), self.pixels_count), dtype=bool)
+        for frame, mask in enumerate(masks):
+            for transform, start, end in zip(self.transforms, self.pixel_starts, self.pixel_ends):
+                if transform is not None:
+                    matrix, size = transform
+                    transformed[frame, start:end] = cv2.warpPerspective(mask, matrix, size).ravel() == 1
+
+        car_pixels_count = segment_sums(transformed, self.row_starts, self.row_ends)
+        car_pixel_percentage = safe_ratio(car_pixels_count, self.row_widths) * 100
+        reduced_rows = car_pixel_percentage > self.threshold
+
+        car_rows = segment_sums(reduced_rows, self.lane_row_starts, self.lane_row_ends)
+        return np.round(safe_ratio(car_rows, self.lane_rows), 4).tolist()
+
+
+# corner_coords - dl, dr, hl, hr
+def is_convex_quad(corner_coords):
+    dl, dr, hl, hr = corner_coords
+    polygon = [dl, dr, hr, hl]
+    turns = []
+    for i in range(4):
+        (x1, y1), (x2, y2), (x3, y3) = polygon[i], polygon[(i + 1) % 4], polygon[(i + 2) % 4]
+        turns.append((x2 - x1) * (y3 - y2) - (y2 - y1) * (x3 - x2))
+    return all(turn > 0 for turn in turns) or all(turn < 0 for turn in turns)
+
+
+# sums of values[:, start:end] for every segment, an empty segment (a lane without width or height, e.g. with
+# duplicate corner rows) sums to 0 where np.add.reduceat would take a single element or fail at the end
+def segment_sums(values, starts, ends):
+    sums = np.zeros((len(values), values.shape[1] + 1), dtype=np.int64)
+    np.cumsum(values, axis=1, dtype=np.int64, out=sums[:, 1:])
+    return sums[:, ends] - sums[:, starts]
+
+
+# 0.0 for empty segments
+def safe_ratio(counts, totals):
+    return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+
 def get_mtlcr_plot_img(imgs, title):
     num_imgs = len(imgs)
     fig, axes = plt.subplots(1, num_imgs, figsize=(15, 5))  # 1 row, num_imgs columns
@@ -1,9 +1,17 @@
 import argparse
 import json
+import os
+import signal
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
+from inference.backends import create_segmenter, SEGMENTATION_BACKENDS
 from lane import Lane
+from pipeline.adaptive_sampler import DEFAULT_MAX_LAG
+from pipeline.frame_bus import FrameBusReader
+from pipeline.result_channel import ResultChannel, JOB_FINISHED
 from video_processor import VideoProcessor
-import sys
 
 DEFAULT_LANE_1 = Lane(0, 'left', [(1250, 1525), (1950, 1525), (2150, 743), (2400, 743)], 70, 7, 120)
 DEFAULT_LANE_2 = Lane(1, 'right', [(2800, 1525), (3400, 1525), (2800, 743), (3050, 743)], 70, 7, 120)
@@ -14,6 +22,19 @@ if __name__ == "__main__":
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     parser.add_argument('--video_path', type=str, default='videos/2_poland.mp4', help='Path to the video ')
     parser.add_argument('--lanes', type=str, default=None, help='Lanes config')
+    parser.add_argument('--frame_bus', type=str, default=None, help='Name of the shared frame bus to read frames from')
+    parser.add_argument('--offline', action='store_true', help='Process the file as fast as possible instead of replaying it in real time')
+    parser.add_argument('--interval', type=float, default=2, help='Seconds between segmented frames')
+    parser.add_argument('--max_interval', type=float, default=None, help='Seconds the adaptive sampling may grow the interval to, fixed sampling when omitted')
+    parser.add_argument('--max_lag', type=float, default=DEFAULT_MAX_LAG, help='Seconds behind real time before the sampling is reduced')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of sampled frames per segmentation model call')
+    parser.add_argument('--max_batch_delay', type=float, default=None, help='Max seconds a frame waits for its batch to fill')
+    parser.add_argument('--frame_bus_consumer', type=int, default=0, help='Consumer slot on the shared frame bus')
+    parser.add_argument('--result_fd', type=int, default=None, help='File descriptor of the result channel, results are printed without it')
+    parser.add_argument('--job_id', type=str, default=None, help='Id the results are reported under on the result channel')
+    parser.add_argument('--model_path', type=str, default='mtlcr/models/road_segmentation.h5', help='Path to the segmentation model or its ONNX export')
+    parser.add_argument('--backend', choices=SEGMENTATION_BACKENDS, default='auto', help='Segmentation inference backend')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
 
     args = parser.parse_args()
 
@@ -26,12 +47,40 @@ if __name__ == "__main__":
     else:
         lanes = [Lane(**lane) for lane in json.loads(lanes)]
 
-    model_path = "mtlcr/models/road_segmentation.h5"
+    model_path = args.model_path
 
     # local debug
     # video_path = "../videos/2_poland.mp4"
     # model_path = "models/road_segmentation.h5"
 
-    video_processor = VideoProcessor(model_path, debug=is_debug)
-    print(video_path)
-    video_processor.process_video(video_path, lanes, 2)
+    video_processor = VideoProcessor(create_segmenter(model_path, args.backend, args.device), debug=is_debug,
+                                     batch_size=args.batch_size, max_batch_delay=args.max_batch_delay)
+
+    channel = None
+    result_handler = None
+    if args.result_fd is not None:
+        channel = ResultChannel(args.result_fd)
+        result_handler = lambda result: channel.send_result(args.job_id, result)
+        channel.track_progress(args.job_id, video_processor.status)
+
+    # release the bus cursor and send the buffered results on stop
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if args.frame_bus is None:
+            video_processor.process_video(video_path, lanes, args.interval, offline=args.offline,
+                                          result_handler=result_handler, max_interval=args.max_interval,
+                                          max_lag=args.max_lag)
+        else:
+            frame_bus = FrameBusReader(args.frame_bus, args.frame_bus_consumer)
+            try:
+                video_processor.process_frame_bus(frame_bus, video_path, lanes, args.interval, offline=args.offline,
+                                                  result_handler=result_handler, max_interval=args.max_interval,
+                                                  max_lag=args.max_lag)
+            finally:
+                frame_bus.close()
+    finally:
+        if channel is not None:
+            # the last progress carries the final stage timings
+            channel.heartbeat()
+            channel.send(JOB_FINISHED, {'job_id': args.job_id, 'error': None})
+            channel.close()
@@ -4,109 +4,233 @@ import time
 from uuid import uuid4
 
 import cv2
-import tensorflow
+import numpy as np
 
-from mtlcr import calc_mtlcr, save_imgs
+from inference.backends import create_segmenter
+from mtlcr import calc_mtlcr, save_imgs, CompiledLanes
+from pipeline.adaptive_sampler import AdaptiveSampler, DEFAULT_MAX_LAG
+from pipeline.frame_sampler import FrameSampler
+from pipeline.metrics import PipelineMetrics
 
-tensorflow.keras.utils.disable_interactive_logging()
+ACTIVITY_MTLCR = 0.05   # a lane with more of its area covered by vehicles counts as traffic for adaptive sampling
+STAGES = ['decode', 'preprocess', 'inference', 'postprocess']
 
 
 def create_mask(mask):
-    pred_mask = tensorflow.argmax(mask, axis=-1)
-    pred_mask = pred_mask[..., tensorflow.newaxis]
-    return pred_mask[0]
+    pred_mask = np.argmax(mask, axis=-1)
+    return pred_mask[..., np.newaxis]
 
 
 def preprocess_frame(frame):
     return cv2.resize(frame, (256, 256))
 
 
+def print_result(result):
+    print(json.dumps(result))
+
+
+# first - vertical
+# second - horizontal
+# 0 - left high corner
+# frames_count - 0 when unknown, offline - results are stamped with video time only
+def build_video_metadata(video_path, lanes, interval, frame_rate, width, height, frames_count=0, offline=False):
+    frames_interval = round(interval * frame_rate)
+    video = {
+        'id': uuid4(),
+        'path': video_path,
+        'frames_interval': frames_interval,
+        'interval': interval,
+        'width': width,
+        'height': height,
+        'frames_count': frames_count,
+        'offline': offline,
+        'lanes': [],
+    }
+
+    for i, lane in enumerate(lanes):
+        lane_obj = {
+            'id': lane.id,
+            'n': i,
+            'coords': {
+                'dl': lane.coords[0],
+                'dr': lane.coords[1],
+                'hl': lane.coords[2],
+                'hr': lane.coords[3],
+            }
+        }
+
+        video['lanes'].append(lane_obj)
+
+    video['compiled_lanes'] = CompiledLanes([lane['coords'] for lane in video['lanes']], width, height)
+
+    return video
+
+
 class VideoProcessor:
 
-    def __init__(self, model_path, debug=False):
-        self.model = tensorflow.keras.models.load_model(model_path)
+    # model - path to the saved model or a segmenter with predict(frames) -> one score map per frame:
+    # an inference.backends segmenter or a stream of a shared inference server
+    # batch_size - sampled frames per model call, max_batch_delay - seconds a frame may wait for the batch to fill,
+    # bounds the latency of live results
+    def __init__(self, model, debug=False, batch_size=1, max_batch_delay=None):
+        self.model = create_segmenter(model) if isinstance(model, str) else model
         self.debug = debug
+        self.batch_size = max(1, batch_size)
+        self.max_batch_delay = max_batch_delay
+        self.sampler = None
+        self.started_at = None
+        self.progress = {'frames': 0, 'frame_time': None}
+        self.metrics = PipelineMetrics(STAGES)
+
+    # progress with the stage timings, reported to the orchestrator with every heartbeat
+    def status(self):
+        return {**self.progress, 'metrics': self.metrics.snapshot()}
+
+    # interval - seconds between segmented frames, max_interval - the interval may grow up to it while processing
+    # lags more than max_lag seconds behind real time or the lanes are empty, None keeps it fixed
+    @staticmethod
+    def create_sampler(video, frame_rate, max_interval=None, max_lag=DEFAULT_MAX_LAG):
+        # one processed frame followed by frames_interval skipped ones
+        min_step = video['frames_interval'] + 1
+        max_step = round(max_interval * frame_rate) + 1 if max_interval is not None else None
+        # offline processing has no real-time deadline to keep up with
+        return AdaptiveSampler(frame_rate, min_step, max_step, None if video['offline'] else max_lag)
 
     # first - vertical
     # second - horizontal
     # 0 - left high corner
-    def process_video(self, video_path, lanes, interval=10, simulation=True):
+    # result_handler - called with every MTLCR result, stop_event - ends processing once it is set
+    # offline - process a recorded file as fast as possible, otherwise it is replayed in real time like a live stream
+    def process_video(self, video_path, lanes, interval=10, offline=False, result_handler=None, stop_event=None,
+                      max_interval=None, max_lag=DEFAULT_MAX_LAG):
         cap = cv2.VideoCapture(video_path)
 
         frame_rate = cap.get(cv2.CAP_PROP_FPS)
         width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
         height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        frames_count = max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
 
-        frames_interval = round(interval * frame_rate)
-        video = {
-            'id': uuid4(),
-            'path': video_path,
-            'frames_interval': frames_interval,
-            'interval': interval,
-            'width': width,
-            'height': height,
-            'lanes': [],
-        }
-
-        for i, lane in enumerate(lanes):
-            lane_obj = {
-                'id': lane.id,
-                'n': i,
-                'coords': {
-                    'dl': lane.coords[0],
-                    'dr': lane.coords[1],
-                    'hl': lane.coords[2],
-                    'hr': lane.coords[3],
-                }
-            }
+        video = build_video_metadata(video_path, lanes, interval, frame_rate, width, height, frames_count, offline)
 
-            video['lanes'].append(lane_obj)
+        # skipped frames are never converted, the sampler moves the step of the capture
+        self.sampler = self.create_sampler(video, frame_rate, max_interval, max_lag)
+        frame_sampler = FrameSampler(cap, 0, self.sampler.step)
+        self.sampler.drive(frame_sampler)
+        self.process_frames(frame_sampler, video, result_handler, stop_event)
 
-        skip_counter = 0
-        while cap.isOpened():
-            # to debug on videos
-            if simulation:
-                time.sleep(1 / frame_rate)
+        cap.release()
 
-            ret, frame = cap.read()
-            if not ret:
+    def process_frame_bus(self, frame_bus, video_path, lanes, interval=10, offline=False, result_handler=None,
+                          stop_event=None, max_interval=None, max_lag=DEFAULT_MAX_LAG):
+        video = build_video_metadata(video_path, lanes, interval, frame_rate=frame_bus.fps,
+                                     width=frame_bus.width, height=frame_bus.height,
+                                     frames_count=frame_bus.frames_count, offline=offline)
+
+        # the decoder reads ahead of the registered sampling, so the bus keeps delivering every min_step-th frame
+        # and frames beyond the current step are dropped here
+        self.sampler = self.create_sampler(video, frame_bus.fps, max_interval, max_lag)
+        frames = frame_bus.frames(0, self.sampler.min_step)
+        self.process_frames(frames, video, result_handler, stop_event)
+
+    # frames - iterable of (index, frame_time, frame)
+    def process_frames(self, frames, video, result_handler, stop_event):
+        if result_handler is None:
+            result_handler = print_result
+        self.started_at = time.monotonic()
+
+        batch = []
+        batch_started_at = None
+        metrics = self.metrics
+        for index, frame_time, frame in metrics.timed('decode', frames):
+            if stop_event is not None and stop_event.is_set():
                 break
-
-            if skip_counter > 0:
-                skip_counter -= 1
+            metrics.count_skipped(index)
+            if not self.sampler.should_process(index):
+                metrics.count('dropped_by_sampling')
                 continue
 
-            skip_counter = frames_interval
-
-            self.process_frame(frame, video)
-
-        cap.release()
-
-    def process_frame(self, frame, video_metadata):
-        preprocessed_frame = preprocess_frame(frame)
-        mask = self.model.predict(preprocessed_frame[tensorflow.newaxis, ...])
-
+            # live simulation only: recorded files are replayed in real time
+            if not video['offline']:
+                # a started batch does not wait for the next frame longer than max_batch_delay
+                if batch and self.batch_is_late(batch_started_at, self.sampler.due_in(frame_time)):
+                    self.process_batch(batch, video, result_handler)
+                    batch = []
+                self.sampler.wait_until_due(frame_time)
+
+            self.update_progress(index, frame_time, video)
+
+            if not batch:
+                batch_started_at = time.monotonic()
+            # frames are reduced to the model input right away, a batch never holds full size frames
+            started_at = time.perf_counter()
+            batch.append((frame_time, preprocess_frame(frame)))
+            metrics.observe('preprocess', time.perf_counter() - started_at)
+
+            if len(batch) >= self.batch_size or self.batch_is_late(batch_started_at):
+                self.process_batch(batch, video, result_handler)
+                batch = []
+        else:
+            if batch:
+                self.process_batch(batch, video, result_handler)
+
+    def batch_is_late(self, batch_started_at, wait=0):
+        return self.max_batch_delay is not None and time.monotonic() + wait - batch_started_at >= self.max_batch_delay
+
+    # percent - share of the file processed, frames_per_second - segmented frames per second of processing,
+    # realtime_factor - seconds of video processed per second of processing
+    def update_progress(self, index, frame_time, video):
+        elapsed = time.monotonic() - self.started_at
+        progress = {'frames': self.progress['frames'] + 1, 'frame_time': frame_time, **self.sampler.stats()}
+        self.metrics.record_frame(self.sampler.lag)
+        if video['frames_count']:
+            progress['percent'] = round(min(100.0, 100 * (index + 1) / video['frames_count']), 1)
+        if elapsed > 0:
+            progress['frames_per_second'] = round(progress['frames'] / elapsed, 2)
+            progress['realtime_factor'] = round(frame_time / elapsed, 2)
+        self.progress = progress
+
+    # batch - list of (frame_time, preprocessed frame): one model call and one mask computation for all frames
+    def process_batch(self, batch, video_metadata, result_handler):
+        started_at = time.perf_counter()
+        scores = self.model.predict([frame for _, frame in batch])
+        self.metrics.observe('inference', time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
         # Invert to make everything that is NOT road to be 1
-        mask = 1 - create_mask(mask).numpy()
+        masks = 1 - create_mask(np.stack(scores))
+        batch_mtlcr = video_metadata['compiled_lanes'].calc_mtlcr_batch(masks)
+
+        for (frame_time, _), mask, lanes_mtlcr in zip(batch, masks, batch_mtlcr):
+            results = self.report_results(mask, lanes_mtlcr, video_metadata, frame_time, result_handler)
+            self.sampler.update(frame_time, any(result['mtlcr'] >= ACTIVITY_MTLCR for result in results))
+        self.metrics.observe('postprocess', time.perf_counter() - started_at)
 
+    # frame_time - seconds from the start of the video
+    def report_results(self, mask, lanes_mtlcr, video_metadata, frame_time, result_handler):
         results = []
-        time = datetime.utcnow().isoformat()
-        for area in video_metadata['lanes']:
-            mtlcr, masks = calc_mtlcr(mask, video_metadata['width'], video_metadata['height'], area['coords'])
+        created_at = datetime.utcnow().isoformat()
+        for area, mtlcr in zip(video_metadata['lanes'], lanes_mtlcr):
             res = {
                 'video': video_metadata['path'],
                 'lane_id': area['id'],
                 'mtlcr': mtlcr,
-                'created_at': time,
             }
+            # offline results live on the video timeline, the wall clock says nothing about when they happened
+            if not video_metadata.get('offline'):
+                res['created_at'] = created_at
+            if frame_time is not None:
+                res['frame_time'] = round(frame_time, 2)
+            if self.sampler is not None:
+                res['sampling_rate'] = self.sampler.rate
 
             if self.debug:
+                _, masks = calc_mtlcr(mask, video_metadata['width'], video_metadata['height'], area['coords'])
                 folder_name = f"video_{video_metadata['id']}"
                 timestamp = datetime.utcnow().isoformat()
                 image_name = f"lane_{area['id']}_{timestamp}.png"
                 save_imgs(masks, f"MTLCR: {mtlcr}", folder_name, image_name)
 
-            print(json.dumps(res))
+            result_handler(res)
 
             results.append(res)
 
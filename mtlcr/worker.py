@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inference.backends import create_segmenter, SEGMENTATION_BACKENDS
+from lane import Lane
+from pipeline.adaptive_sampler import DEFAULT_MAX_LAG
+from pipeline.frame_bus import FrameBusReader
+from pipeline.inference_server import InferenceServer
+from pipeline.result_channel import ResultChannel
+from pipeline.worker import Worker
+from video_processor import VideoProcessor
+
+
+# Long-lived MTLCR worker: the segmentation model is loaded once and shared by every job the orchestrator sends.
+# Jobs run on their own threads and their frames are batched together by the inference server.
+# job - {'id', 'video_path', 'lanes', 'interval', 'max_interval', 'max_lag', 'offline', 'batch_size', 'max_batch_delay',
+#        'frame_bus', 'frame_bus_consumer', 'debug'}
+def run_job(job, channel, stop_event, inference_server):
+    lanes = [Lane(**lane) for lane in job['lanes']]
+    stream = inference_server.open_stream(job['id'])
+    video_processor = VideoProcessor(stream, debug=job.get('debug', False), batch_size=job.get('batch_size', 1),
+                                     max_batch_delay=job.get('max_batch_delay'))
+
+    def handle_result(result):
+        channel.send_result(job['id'], result)
+
+    channel.track_progress(job['id'], video_processor.status)
+    sampling = {'offline': job.get('offline', False), 'max_interval': job.get('max_interval'),
+                'max_lag': job.get('max_lag', DEFAULT_MAX_LAG)}
+
+    try:
+        if job.get('frame_bus') is None:
+            video_processor.process_video(job['video_path'], lanes, job.get('interval', 2),
+                                          result_handler=handle_result, stop_event=stop_event, **sampling)
+        else:
+            frame_bus = FrameBusReader(job['frame_bus'], job['frame_bus_consumer'])
+            try:
+                video_processor.process_frame_bus(frame_bus, job['video_path'], lanes, job.get('interval', 2),
+                                                  result_handler=handle_result, stop_event=stop_event, **sampling)
+            finally:
+                frame_bus.close()
+    finally:
+        stream.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model_path', type=str, default='mtlcr/models/road_segmentation.h5', help='Path to the segmentation model or its ONNX export')
+    parser.add_argument('--backend', choices=SEGMENTATION_BACKENDS, default='auto', help='Segmentation inference backend')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
+    parser.add_argument('--result_fd', type=int, required=True, help='File descriptor of the result channel')
+    parser.add_argument('--max_jobs', type=int, default=1, help='Number of videos processed at the same time')
+    parser.add_argument('--max_batch_size', type=int, default=16, help='Frames per segmentation model call, across videos')
+    parser.add_argument('--max_batch_delay', type=float, default=0.05, help='Max seconds a frame waits for its batch to fill')
+
+    args = parser.parse_args()
+
+    segmenter = create_segmenter(args.model_path, args.backend, args.device)
+    inference_server = InferenceServer(segmenter.predict, args.max_batch_size, args.max_batch_delay)
+
+    channel = ResultChannel(args.result_fd, stats=inference_server.stats)
+
+    Worker(lambda job, channel, stop_event: run_job(job, channel, stop_event, inference_server), channel,
+           max_jobs=args.max_jobs).serve()
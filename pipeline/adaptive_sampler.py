@@ -0,0 +1,105 @@
+import time
+
+DEFAULT_MAX_LAG = 2.0          # seconds
+DEFAULT_QUIET_PERIOD = 5.0     # seconds of video
+DEFAULT_ADJUST_INTERVAL = 1.0  # seconds
+
+
+# Chooses the distance between processed frames within [min_step, max_step]:
+# - the step grows while processing lags more than max_lag behind real time or the lanes stayed empty for quiet_period
+#   (offline processing has no real-time deadline and passes max_lag=None),
+# - it shrinks again once the lag is below half of max_lag, and drops to min_step as soon as traffic comes back.
+# Sources that can skip frames themselves (FrameSampler) follow the step through drive(), frames of other sources
+# (a shared frame bus delivering every min_step-th frame) are filtered with should_process().
+class AdaptiveSampler:
+    def __init__(self, fps, min_step, max_step=None, max_lag=DEFAULT_MAX_LAG, quiet_period=DEFAULT_QUIET_PERIOD,
+                 adjust_interval=DEFAULT_ADJUST_INTERVAL):
+        self.fps = fps
+        self.min_step = max(1, min_step)
+        self.max_step = max(self.min_step, max_step or self.min_step)
+        self.max_lag = max_lag
+        self.quiet_period = quiet_period
+        self.adjust_interval = adjust_interval
+        self.step = self.min_step
+        self.sources = []
+        self.last_index = None
+        self.started_at = None
+        self.first_frame_time = None
+        self.last_activity_time = None
+        self.adjusted_at = None
+        self.lag = 0.0
+
+    @property
+    def adaptive(self):
+        return self.max_step > self.min_step
+
+    # frames of the video processed per second at the current step
+    @property
+    def rate(self):
+        return round(self.fps / self.step, 2) if self.fps else None
+
+    def drive(self, source):
+        source.step = self.step
+        self.sources.append(source)
+
+    def set_step(self, step):
+        self.step = min(self.max_step, max(self.min_step, step))
+        for source in self.sources:
+            source.step = self.step
+
+    def should_process(self, index):
+        if self.last_index is not None and index - self.last_index < self.step:
+            return False
+        self.last_index = index
+        return True
+
+    # seconds processing is behind (positive) or ahead (negative) of real time after the frame at frame_time
+    def lag_at(self, frame_time, now=None):
+        now = time.monotonic() if now is None else now
+        if self.started_at is None:
+            self.started_at, self.first_frame_time = now, frame_time
+        return (now - self.started_at) - (frame_time - self.first_frame_time)
+
+    # seconds until the frame at frame_time is due in real time, 0 when it is already late
+    def due_in(self, frame_time):
+        return max(0.0, -self.lag_at(frame_time))
+
+    # replays a recorded video in real time: waits until the frame is due
+    def wait_until_due(self, frame_time):
+        wait = self.due_in(frame_time)
+        if wait > 0:
+            time.sleep(wait)
+
+    # frame_time - seconds from the start of the video, active - traffic was seen in the lanes of the frame
+    def update(self, frame_time, active):
+        now = time.monotonic()
+        self.lag = self.lag_at(frame_time, now)
+        if self.last_activity_time is None:
+            self.last_activity_time = frame_time
+            self.adjusted_at = now
+        if not self.adaptive:
+            return
+
+        was_quiet = frame_time - self.last_activity_time >= self.quiet_period
+        if active:
+            self.last_activity_time = frame_time
+            # vehicles on an empty road get the full rate right away, a late sample may miss a lane crossing
+            if was_quiet and not self.lagging():
+                self.adjusted_at = now
+                self.set_step(self.min_step)
+                return
+
+        if now - self.adjusted_at < self.adjust_interval:
+            return
+        self.adjusted_at = now
+
+        if self.lagging() or (was_quiet and not active):
+            self.set_step(self.step + 1)
+        elif self.max_lag is None or self.lag < self.max_lag / 2:
+            self.set_step(self.step - 1)
+
+    def lagging(self):
+        return self.max_lag is not None and self.lag > self.max_lag
+
+    def stats(self):
+        return {'step': self.step, 'rate': self.rate, 'lag': round(self.lag, 2)}
@@ -0,0 +1,271 @@
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Layout of the shared block:
+# meta (int64[META_SIZE]) | fps (float64) | slot frame indexes (int64[slots]) |
+# slot timestamps (float64[slots]) | consumer cursors (int64[consumers]) |
+# consumer sampling starts (int64[consumers]) | consumer sampling steps (int64[consumers]) | frame slots
+META_READY = 0
+META_WIDTH = 1
+META_HEIGHT = 2
+META_CHANNELS = 3
+META_SLOTS = 4
+META_CONSUMERS = 5
+META_EOF = 6
+META_FRAMES = 7   # frame count reported by the container, 0 when unknown (live streams)
+META_SIZE = 8
+
+FRAME_ALIGNMENT = 64
+POLL_INTERVAL = 0.002
+ATTACH_TIMEOUT = 120
+RELEASED_CURSOR = np.iinfo(np.int64).max
+
+DEFAULT_SLOTS = 16
+
+
+def header_size(slots, consumers):
+    size = (META_SIZE + 1 + 2 * slots + 3 * consumers) * 8
+    return (size + FRAME_ALIGNMENT - 1) // FRAME_ALIGNMENT * FRAME_ALIGNMENT
+
+
+class FrameBus:
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+
+        buf = shm.buf
+        self.meta = np.ndarray((META_SIZE,), dtype=np.int64, buffer=buf)
+        slots = int(self.meta[META_SLOTS])
+        consumers = int(self.meta[META_CONSUMERS])
+
+        offset = META_SIZE * 8
+        self.fps_ref = np.ndarray((1,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += 8
+        self.slot_frames = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += slots * 8
+        self.slot_timestamps = np.ndarray((slots,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += slots * 8
+        self.cursors = np.ndarray((consumers,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += consumers * 8
+        self.sampling_starts = np.ndarray((consumers,), dtype=np.int64, buffer=buf, offset=offset)
+        offset += consumers * 8
+        # 0 until the consumer registers its sampling, such a consumer needs every frame
+        self.sampling_steps = np.ndarray((consumers,), dtype=np.int64, buffer=buf, offset=offset)
+
+        shape = (slots, int(self.meta[META_HEIGHT]), int(self.meta[META_WIDTH]), int(self.meta[META_CHANNELS]))
+        self.frames = np.ndarray(shape, dtype=np.uint8, buffer=buf, offset=header_size(slots, consumers))
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def width(self):
+        return int(self.meta[META_WIDTH])
+
+    @property
+    def height(self):
+        return int(self.meta[META_HEIGHT])
+
+    @property
+    def fps(self):
+        return float(self.fps_ref[0])
+
+    @property
+    def slots(self):
+        return int(self.meta[META_SLOTS])
+
+    @property
+    def frames_count(self):
+        return int(self.meta[META_FRAMES])
+
+    @classmethod
+    def create(cls, name, width, height, channels, fps, consumers, slots=DEFAULT_SLOTS, frames_count=0):
+        size = header_size(slots, consumers) + slots * width * height * channels
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        meta = np.ndarray((META_SIZE,), dtype=np.int64, buffer=shm.buf)
+        meta[:] = 0
+        meta[META_WIDTH] = width
+        meta[META_HEIGHT] = height
+        meta[META_CHANNELS] = channels
+        meta[META_SLOTS] = slots
+        meta[META_CONSUMERS] = consumers
+        meta[META_EOF] = -1
+        meta[META_FRAMES] = max(0, frames_count)
+
+        bus = cls(shm, owner=True)
+        bus.fps_ref[0] = fps
+        bus.slot_frames[:] = -1
+        bus.slot_timestamps[:] = 0
+        bus.cursors[:] = 0
+        bus.sampling_starts[:] = 0
+        bus.sampling_steps[:] = 0
+        # ready is published last, readers do not look at anything else before it
+        bus.meta[META_READY] = 1
+        return bus
+
+    @classmethod
+    def attach(cls, name, timeout=ATTACH_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = open_shared_memory(name)
+                break
+            except FileNotFoundError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        meta = np.ndarray((META_SIZE,), dtype=np.int64, buffer=shm.buf)
+        while meta[META_READY] != 1:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Frame bus {name} was not initialized in time")
+            time.sleep(POLL_INTERVAL)
+        del meta
+
+        return cls(shm, owner=False)
+
+    # ------------------ Producer ------------------------------
+
+    # returns None when some consumer still holds the slot after timeout seconds
+    def acquire(self, index, timeout=None):
+        # the slot may be reused only when every consumer has moved past the frame stored in it
+        oldest_allowed = index - self.slots
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.cursors.min() <= oldest_allowed:
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+        return self.frames[index % self.slots]
+
+    # index of the first frame at or after index that some consumer samples, None when every consumer is gone
+    def next_needed(self, index):
+        needed = None
+        for cursor, start, step in zip(self.cursors.tolist(), self.sampling_starts.tolist(), self.sampling_steps.tolist()):
+            if cursor == RELEASED_CURSOR:
+                continue
+            if step <= 0:
+                return index
+
+            candidate = start if index <= start else start + -(-(index - start) // step) * step
+            if needed is None or candidate < needed:
+                needed = candidate
+
+        return needed
+
+    def publish(self, index, timestamp):
+        slot = index % self.slots
+        self.slot_timestamps[slot] = timestamp
+        self.slot_frames[slot] = index
+
+    def finish(self, frames_count):
+        self.meta[META_EOF] = frames_count
+
+    def wait_for_consumers(self, frames_count, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.cursors.min() < frames_count:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+        return True
+
+    # ------------------ Consumer ------------------------------
+
+    # idle_timeout - None is yielded whenever the next frame does not arrive within this many seconds (a stalled
+    # live source), so the consumer can act on what it holds
+    def frames_for(self, consumer, start, step, idle_timeout=None):
+        self.sampling_starts[consumer] = start
+        self.sampling_steps[consumer] = step
+
+        index = start
+        while True:
+            self.cursors[consumer] = index
+            slot = index % self.slots
+            idle_deadline = None if idle_timeout is None else time.monotonic() + idle_timeout
+            while self.slot_frames[slot] != index:
+                eof = self.meta[META_EOF]
+                if 0 <= eof <= index:
+                    return
+                if idle_deadline is not None and time.monotonic() > idle_deadline:
+                    yield None
+                    idle_deadline = time.monotonic() + idle_timeout
+                time.sleep(POLL_INTERVAL)
+
+            # the view stays valid until the cursor moves on with the next iteration
+            yield index, self.slot_timestamps[slot], self.frames[slot]
+            index += step
+
+    def release(self, consumer):
+        self.cursors[consumer] = RELEASED_CURSOR
+
+    # releases the cursor of a consumer that died without closing its reader, e.g. on a failed model load or a
+    # killed worker; False when the frame bus is not initialized or already gone
+    @classmethod
+    def release_consumer(cls, name, consumer):
+        try:
+            shm = open_shared_memory(name)
+        except FileNotFoundError:
+            return False
+
+        meta = np.ndarray((META_SIZE,), dtype=np.int64, buffer=shm.buf)
+        ready = meta[META_READY] == 1
+        del meta
+        if not ready:
+            shm.close()
+            return False
+
+        bus = cls(shm, owner=False)
+        bus.release(consumer)
+        bus.close()
+        return True
+
+    def close(self):
+        # numpy views keep the exported buffer alive, drop them before closing the mapping
+        self.meta = self.fps_ref = self.slot_frames = self.slot_timestamps = self.cursors = None
+        self.sampling_starts = self.sampling_steps = self.frames = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a frame view is still referenced (e.g. on an error path), the mapping goes away with the process
+            pass
+        if self.owner:
+            self.shm.unlink()
+
+
+def open_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # the decoder owns the block, the attaching process must not unlink it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class FrameBusReader:
+    def __init__(self, name, consumer):
+        self.bus = FrameBus.attach(name)
+        self.consumer = consumer
+
+    @property
+    def width(self):
+        return self.bus.width
+
+    @property
+    def height(self):
+        return self.bus.height
+
+    @property
+    def fps(self):
+        return self.bus.fps
+
+    @property
+    def frames_count(self):
+        return self.bus.frames_count
+
+    def frames(self, start, step, idle_timeout=None):
+        return self.bus.frames_for(self.consumer, start, step, idle_timeout)
+
+    def close(self):
+        self.bus.release(self.consumer)
+        self.bus.close()
@@ -0,0 +1,59 @@
+import cv2
+
+# gaps longer than this are skipped by seeking instead of grabbing frame by frame
+SEEK_THRESHOLD = 48
+
+
+def is_seekable(cap):
+    # live streams report no frame count and cannot be positioned
+    return cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+
+
+def frame_timestamp(cap, index, fps):
+    timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if timestamp > 0 or index == 0:
+        return timestamp / 1000
+    # some backends do not report positions, fall back to the nominal frame rate
+    return index / fps if fps else 0.0
+
+
+# Moves the capture from position (index of the next frame to decode) to target without converting the
+# skipped frames: short gaps are grabbed, long gaps are seeked. Returns the new position.
+def advance(cap, position, target, seekable, seek_threshold=SEEK_THRESHOLD):
+    if target - position > seek_threshold and seekable:
+        if cap.set(cv2.CAP_PROP_POS_FRAMES, target) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+            return target
+
+    while position < target:
+        if not cap.grab():
+            return position
+        position += 1
+
+    return position
+
+
+class FrameSampler:
+    # start - index of the first sampled frame, step - distance between sampled frames
+    def __init__(self, cap, start, step, seek_threshold=SEEK_THRESHOLD):
+        self.cap = cap
+        self.start = start
+        self.step = max(1, step)
+        self.seek_threshold = seek_threshold
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.seekable = is_seekable(cap)
+
+    def __iter__(self):
+        position = 0
+        target = self.start
+        while True:
+            position = advance(self.cap, position, target, self.seekable, self.seek_threshold)
+            if position != target:
+                return
+
+            ret, frame = self.cap.read()
+            if not ret:
+                return
+            position += 1
+
+            yield target, frame_timestamp(self.cap, target, self.fps), frame
+            target += self.step
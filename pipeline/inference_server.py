@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+class StreamCounters:
+    def __init__(self):
+        self.opened_at = time.monotonic()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+        self.wait_seconds = 0.0
+        self.inference_seconds = 0.0
+
+    def as_dict(self):
+        elapsed = time.monotonic() - self.opened_at
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'pending': self.submitted - self.completed - self.failed,
+            'batches': self.batches,
+            'frames_per_second': self.completed / elapsed if elapsed > 0 else 0.0,
+            'avg_wait_seconds': self.wait_seconds / self.completed if self.completed else 0.0,
+            'inference_seconds': self.inference_seconds,
+        }
+
+
+class InferenceStream:
+    def __init__(self, server, stream_id):
+        self.server = server
+        self.id = stream_id
+        self.pending = deque()   # (submitted_at, item, future)
+        self.counters = StreamCounters()
+
+    def submit(self, item):
+        return self.server.submit(self, item)
+
+    # Stands in for the model of a single pipeline: every input is batched with the inputs of other streams and the
+    # call returns once all of them are processed.
+    def predict(self, inputs):
+        futures = [self.submit(item) for item in inputs]
+        return [future.result() for future in futures]
+
+    def close(self):
+        self.server.close_stream(self)
+
+
+class InferenceServer:
+    # predict - called with a list of inputs from any streams, returns the outputs in the same order
+    # max_batch_size - inputs per model call, max_batch_delay - seconds the oldest input may wait for the batch to fill
+    def __init__(self, predict, max_batch_size=16, max_batch_delay=0.05):
+        self.predict = predict
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_delay = max_batch_delay
+        self.streams = []
+        self.next_stream = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.batched_inputs = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def open_stream(self, stream_id):
+        stream = InferenceStream(self, stream_id)
+        with self.condition:
+            self.streams.append(stream)
+        return stream
+
+    def close_stream(self, stream):
+        with self.condition:
+            if stream in self.streams:
+                self.streams.remove(stream)
+            pending = list(stream.pending)
+            stream.pending.clear()
+        for _, _, future in pending:
+            future.cancel()
+
+    def submit(self, stream, item):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Inference server is closed")
+            stream.pending.append((time.monotonic(), item, future))
+            stream.counters.submitted += 1
+            self.condition.notify()
+        return future
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def pending_count(self):
+        return sum(len(stream.pending) for stream in self.streams)
+
+    def run(self):
+        while True:
+            with self.condition:
+                batch = self.wait_for_batch()
+            if batch is None:
+                return
+            self.process(batch)
+
+    def wait_for_batch(self):
+        while not self.closed and not self.pending_count():
+            self.condition.wait()
+        if self.closed:
+            for stream in self.streams:
+                for _, _, future in stream.pending:
+                    future.cancel()
+                stream.pending.clear()
+            return None
+
+        # the batch leaves when it is full or when its oldest input reached the deadline
+        oldest = min(stream.pending[0][0] for stream in self.streams if stream.pending)
+        deadline = oldest + self.max_batch_delay
+        while not self.closed and self.pending_count() < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.condition.wait(remaining)
+
+        return self.take_batch()
+
+    def take_batch(self):
+        # round robin over the streams, one input each per pass, starting after the stream served first last time,
+        # so a camera with a deep backlog cannot push the others out of the batch
+        batch = []
+        streams = self.streams[self.next_stream:] + self.streams[:self.next_stream]
+        while len(batch) < self.max_batch_size:
+            took = False
+            for stream in streams:
+                if stream.pending and len(batch) < self.max_batch_size:
+                    batch.append((stream, *stream.pending.popleft()))
+                    took = True
+            if not took:
+                break
+
+        if self.streams:
+            self.next_stream = (self.next_stream + 1) % len(self.streams)
+        return batch
+
+    def process(self, batch):
+        started_at = time.monotonic()
+        batch = [(stream, submitted_at, item, future) for stream, submitted_at, item, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            outputs = self.predict([item for _, _, item, _ in batch])
+            error = None
+        except Exception as e:
+            outputs = [None] * len(batch)
+            error = e
+        inference_seconds = time.monotonic() - started_at
+
+        with self.condition:
+            self.batches += 1
+            self.batched_inputs += len(batch)
+            for stream in {stream for stream, _, _, _ in batch}:
+                stream.counters.batches += 1
+                stream.counters.inference_seconds += inference_seconds
+            for stream, submitted_at, _, _ in batch:
+                if error is None:
+                    stream.counters.completed += 1
+                    stream.counters.wait_seconds += started_at - submitted_at
+                else:
+                    stream.counters.failed += 1
+
+        for (_, _, _, future), output in zip(batch, outputs):
+            if error is None:
+                future.set_result(output)
+            else:
+                future.set_exception(error)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'streams': {stream.id: stream.counters.as_dict() for stream in self.streams},
+                'batches': self.batches,
+                'avg_batch_size': self.batched_inputs / self.batches if self.batches else 0.0,
+                'pending': self.pending_count(),
+            }
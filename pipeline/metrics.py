@@ -0,0 +1,112 @@
+import time
+from bisect import bisect_left
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)   # seconds
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)                      # seconds
+END = object()
+
+
+# Cumulative histogram with fixed upper bounds, observing a value is one bisect and three additions.
+# counts has one entry per bucket and a last one for values above the largest bound.
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+def merge_histograms(first, second):
+    if first is None:
+        return second
+    return {'counts': [a + b for a, b in zip(first['counts'], second['counts'])], 'sum': first['sum'] + second['sum'],
+            'count': first['count'] + second['count']}
+
+
+# Timings of the stages of one pipeline run. The pipeline thread records, the result channel sends snapshots with
+# the progress of the job, so the orchestrator can expose them.
+class PipelineMetrics:
+    # stages - names of the timed stages, counters - counted events besides processed and sampled out frames
+    def __init__(self, stages, counters=()):
+        self.stages = {stage: Histogram(STAGE_BUCKETS) for stage in stages}
+        self.lag = Histogram(LAG_BUCKETS)
+        self.counters = dict.fromkeys(['frames', 'dropped_by_sampling', *counters], 0)
+        self.next_index = 0
+
+    def observe(self, stage, seconds):
+        self.stages[stage].observe(seconds)
+
+    def count(self, counter, value=1):
+        self.counters[counter] += value
+
+    # yields the items of iterable, timing how long each one took to arrive; None items (a source signalling that
+    # nothing arrived yet) are passed through untimed
+    def timed(self, stage, iterable):
+        histogram = self.stages[stage]
+        iterator = iter(iterable)
+        while True:
+            started_at = time.perf_counter()
+            item = next(iterator, END)
+            if item is END:
+                return
+            if item is not None:
+                histogram.observe(time.perf_counter() - started_at)
+            yield item
+
+    # index - position of a frame the source delivered, frames a frame sampler skipped before it were sampled out
+    def count_skipped(self, index):
+        if index > self.next_index:
+            self.counters['dropped_by_sampling'] += index - self.next_index
+        self.next_index = index + 1
+
+    # a sampled frame is processed, lag - seconds processing is behind real time
+    def record_frame(self, lag):
+        self.counters['frames'] += 1
+        self.lag.observe(max(0.0, lag))
+
+    def snapshot(self):
+        return {
+            'stages': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+            'lag': self.lag.snapshot(),
+            'counters': dict(self.counters),
+        }
+
+
+def merge_snapshots(first, second):
+    if first is None:
+        return second
+    stages = dict(first['stages'])
+    for stage, histogram in second['stages'].items():
+        stages[stage] = merge_histograms(stages.get(stage), histogram)
+    counters = dict(first['counters'])
+    for counter, value in second['counters'].items():
+        counters[counter] = counters.get(counter, 0) + value
+    return {'stages': stages, 'lag': merge_histograms(first['lag'], second['lag']), 'counters': counters}
+
+
+# status - progress a pipeline reports with its metrics snapshot under 'metrics', returns (progress, snapshot)
+def split_status(status):
+    progress = dict(status)
+    return progress, progress.pop('metrics', None)
+
+
+# mean milliseconds and count of every stage, for GET /processes
+def summarize_snapshot(snapshot):
+    return {
+        'stages': {stage: {'count': histogram['count'], 'mean_ms': mean(histogram, 1000)}
+                   for stage, histogram in snapshot['stages'].items()},
+        'mean_lag': mean(snapshot['lag']),
+        **snapshot['counters'],
+    }
+
+
+def mean(histogram, scale=1):
+    return round(scale * histogram['sum'] / histogram['count'], 3) if histogram['count'] else None
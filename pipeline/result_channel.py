@@ -0,0 +1,145 @@
+import json
+import os
+import struct
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Every message is a frame: little-endian uint32 payload length, uint8 message kind, then the payload.
+# Payloads are JSON documents (orjson when it is installed), results travel in batches of [job_id, result] pairs.
+# The framing removed the per-line parsing; the payload stays JSON because results carry strings and optional fields
+# that differ per pipeline, and the orchestrator needs them as dicts anyway (a fixed struct layout decoded back into
+# dicts saves well under a microsecond per result).
+HEADER = struct.Struct('<IB')
+
+READY = 1
+RESULTS = 2
+JOB_FINISHED = 3
+HEARTBEAT = 4
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FLUSH_INTERVAL = 0.05   # seconds a result may wait for its batch
+DEFAULT_HEARTBEAT_INTERVAL = 2  # seconds
+
+
+if orjson is not None:
+    def encode_payload(payload):
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    decode_payload = orjson.loads
+else:
+    def encode_payload(payload):
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+    decode_payload = json.loads
+
+
+def encode_frame(kind, payload):
+    body = encode_payload(payload)
+    return HEADER.pack(len(body), kind) + body
+
+
+class FrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    # returns (kind, payload) of every frame completed by data, a partial frame is kept for the next call
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        offset = 0
+        end = len(self.buffer)
+        view = memoryview(self.buffer)
+        try:
+            while end - offset >= HEADER.size:
+                length, kind = HEADER.unpack_from(view, offset)
+                if end - offset - HEADER.size < length:
+                    break
+                start = offset + HEADER.size
+                messages.append((kind, decode_payload(view[start:start + length].tobytes())))
+                offset = start + length
+        finally:
+            view.release()
+
+        del self.buffer[:offset]
+        return messages
+
+
+class ResultChannel:
+    # fd - write end of the pipe the orchestrator reads, separate from stdout and stderr
+    # stats - returns counters sent with every heartbeat
+    def __init__(self, fd, max_batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL, stats=None):
+        self.output = os.fdopen(fd, 'wb')
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stats = stats
+        self.results = []
+        self.progress = {}   # job_id -> callable returning the progress of the job
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send_result(self, job_id, result):
+        with self.lock:
+            self.results.append((job_id, result))
+            if len(self.results) >= self.max_batch_size:
+                self.write_results()
+
+    def send(self, kind, payload):
+        # pending results go first, so a job is never reported finished before its last results
+        with self.lock:
+            self.write_results()
+            self.write(encode_frame(kind, payload))
+
+    def flush(self):
+        with self.lock:
+            self.write_results()
+
+    def track_progress(self, job_id, source):
+        with self.lock:
+            self.progress[job_id] = source
+
+    def untrack_progress(self, job_id):
+        with self.lock:
+            self.progress.pop(job_id, None)
+
+    def heartbeat(self):
+        with self.lock:
+            sources = list(self.progress.items())
+        jobs = {job_id: source() for job_id, source in sources}
+        self.send(HEARTBEAT, {'jobs': jobs, 'stats': self.stats() if self.stats is not None else None})
+
+    def close(self):
+        self.closed.set()
+        self.thread.join()
+        with self.lock:
+            self.write_results()
+            self.output.close()
+
+    def write_results(self):
+        if self.results:
+            results, self.results = self.results, []
+            self.write(encode_frame(RESULTS, results))
+
+    def write(self, frame):
+        try:
+            self.output.write(frame)
+            self.output.flush()
+        except (BrokenPipeError, ValueError):
+            # the orchestrator is gone, nothing left to report to
+            self.closed.set()
+
+    def run(self):
+        next_heartbeat = time.monotonic() + self.heartbeat_interval
+        while not self.closed.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() >= next_heartbeat:
+                self.heartbeat()
+                next_heartbeat = time.monotonic() + self.heartbeat_interval
@@ -0,0 +1,78 @@
+import argparse
+import signal
+import sys
+
+import cv2
+import numpy as np
+
+from frame_bus import FrameBus, DEFAULT_SLOTS
+from frame_sampler import advance, frame_timestamp, is_seekable
+
+CONSUMERS_TIMEOUT = 60
+CONSUMER_TIMEOUT = 300   # seconds a consumer may hold a slot before decoding stops
+
+
+def read_into(cap, buffer):
+    # decode straight into the shared slot; fall back to a copy if OpenCV allocated a new image
+    ret, frame = cap.read(buffer)
+    if ret and frame is not buffer and not np.shares_memory(frame, buffer):
+        np.copyto(buffer, frame)
+    return ret
+
+
+def decode_video(video_path, bus_name, consumers, slots, consumer_timeout=CONSUMER_TIMEOUT):
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    seekable = is_seekable(cap)
+
+    ret, frame = cap.read()
+    if not ret:
+        cap.release()
+        return
+
+    height, width, channels = frame.shape
+    bus = FrameBus.create(bus_name, width, height, channels, fps, consumers, slots,
+                          frames_count=int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+
+    try:
+        np.copyto(bus.acquire(0), frame)
+        bus.publish(0, frame_timestamp(cap, 0, fps))
+        position = 1
+
+        # only frames some consumer samples are converted, the rest is grabbed or seeked over
+        index = bus.next_needed(position)
+        while index is not None:
+            position = advance(cap, position, index, seekable)
+            # a consumer that stopped moving died without releasing its cursor, end the video here so the others
+            # finish instead of waiting for it forever
+            buffer = bus.acquire(index, timeout=consumer_timeout)
+            if position != index or buffer is None or not read_into(cap, buffer):
+                break
+
+            position += 1
+            bus.publish(index, frame_timestamp(cap, index, fps))
+            index = bus.next_needed(position)
+
+        bus.finish(position)
+        bus.wait_for_consumers(position, timeout=CONSUMERS_TIMEOUT)
+    finally:
+        cap.release()
+        bus.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--video_path', type=str, required=True, help='Path to the video')
+    parser.add_argument('--name', type=str, required=True, help='Name of the shared frame bus')
+    parser.add_argument('--consumers', type=int, default=2, help='Number of pipelines reading the frame bus')
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS, help='Number of frame slots in the ring')
+    parser.add_argument('--consumer_timeout', type=float, default=CONSUMER_TIMEOUT,
+                        help='Seconds a consumer may hold a frame slot before decoding stops')
+
+    args = parser.parse_args()
+
+    # the orchestrator stops the decoder with SIGTERM, exit normally so the shared block is unlinked
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    decode_video(args.video_path, args.name, args.consumers, args.slots, args.consumer_timeout)
@@ -0,0 +1,94 @@
+import json
+import queue
+import sys
+import threading
+import traceback
+
+from pipeline.result_channel import READY, JOB_FINISHED
+
+# Commands are JSON lines on stdin:
+#   {"type": "job", "job": {...}}, {"type": "stop", "job_id": ...}, {"type": "ping"}, {"type": "shutdown"}
+# the worker answers on its result channel (pipeline.result_channel) with READY, RESULTS, JOB_FINISHED
+# ({"job_id": ..., "error": null}) and HEARTBEAT frames, stdout and stderr are left to logs.
+
+
+class Worker:
+    # run_job(job, channel, stop_event) - processes one job with the resident model, results go to the channel
+    # max_jobs - jobs processed at the same time, each on its own thread
+    def __init__(self, run_job, channel, commands=None, max_jobs=1):
+        self.run_job = run_job
+        self.channel = channel
+        self.commands = commands if commands is not None else sys.stdin
+        self.jobs = queue.Queue()
+        self.job_slots = threading.Semaphore(max(1, max_jobs))
+        self.job_threads = []
+        self.stop_events = {}
+        self.lock = threading.Lock()
+
+    def serve(self):
+        # commands are read on their own thread, so pings and stops are handled while a job is running
+        reader = threading.Thread(target=self.read_commands, daemon=True)
+        reader.start()
+        self.channel.send(READY, {})
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            self.job_slots.acquire()
+            thread = threading.Thread(target=self.process, args=(job,), daemon=True)
+            self.job_threads = [job_thread for job_thread in self.job_threads if job_thread.is_alive()] + [thread]
+            thread.start()
+
+        for thread in self.job_threads:
+            thread.join()
+        self.channel.close()
+
+    def process(self, job):
+        job_id = job['id']
+        with self.lock:
+            stop_event = self.stop_events.setdefault(job_id, threading.Event())
+
+        error = None
+        try:
+            if not stop_event.is_set():
+                self.run_job(job, self.channel, stop_event)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            error = str(e)
+        finally:
+            with self.lock:
+                self.stop_events.pop(job_id, None)
+            # the last progress of the job carries its final stage timings
+            self.channel.heartbeat()
+            self.channel.untrack_progress(job_id)
+
+        self.channel.send(JOB_FINISHED, {'job_id': job_id, 'error': error})
+        self.job_slots.release()
+
+    def read_commands(self):
+        for line in self.commands:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+
+            message_type = message.get('type')
+            if message_type == 'job':
+                with self.lock:
+                    self.stop_events.setdefault(message['job']['id'], threading.Event())
+                self.jobs.put(message['job'])
+            elif message_type == 'stop':
+                with self.lock:
+                    self.stop_events.setdefault(message['job_id'], threading.Event()).set()
+            elif message_type == 'ping':
+                self.channel.heartbeat()
+            elif message_type == 'shutdown':
+                break
+
+        # the orchestrator is gone or asked to shut down, stop the running job and exit after it
+        with self.lock:
+            for stop_event in self.stop_events.values():
+                stop_event.set()
+        self.jobs.put(None)
@@ -1,5 +1,11 @@
+import numpy as np
+
 from utils import conv_point, calc_distance
 
+NO_LANE = -1
+NEAR_UPPER_BOUNDARY = 1
+NEAR_LOWER_BOUNDARY = 2
+
 
 class Lane:
 
@@ -48,17 +54,92 @@ class Lane:
 
         return distance <= offset
 
+    # same even-odd test as point_inside_polygon, evaluated for every pixel of a width x height grid
+    def polygon_mask(self, width, height):
+        cy = np.arange(height, dtype=np.float64)[:, np.newaxis]
+        cx = np.arange(width, dtype=np.float64)[np.newaxis, :]
+        odd_nodes = np.zeros((height, width), dtype=bool)
+
+        n = len(self.coords)
+        j = n - 1
+        for i in range(n):
+            xi, yi = self.coords[i]
+            xj, yj = self.coords[j]
+            crosses = ((yi < cy) & (cy <= yj)) | ((yj < cy) & (cy <= yi))
+            if yi != yj:
+                odd_nodes ^= crosses & (xi + (cy - yi) / (yj - yi) * (xj - xi) < cx)
+            j = i
+
+        return odd_nodes
+
+    def boundary_mask(self, first, second, offset, width, height):
+        x1, y1 = self.coords[first]
+        x2, y2 = self.coords[second]
+        yt = np.arange(height, dtype=np.float64)[:, np.newaxis]
+        xt = np.arange(width, dtype=np.float64)[np.newaxis, :]
+
+        return calc_distance(x1, y1, x2, y2, xt, yt) <= offset
+
 
 class LaneLocator:
     def __init__(self, lanes):
         self.lanes = lanes
+        self.lane_labels = None
+        self.boundary_flags = None
+
+    # lane geometry is fixed after conv_lanes_coordinates, so lookups become indexing into two rasters:
+    # lane_labels holds the index of the first lane containing the pixel,
+    # boundary_flags marks pixels near the upper/lower boundary of that lane
+    def compile(self, width, height, boundary_offset):
+        lane_labels = np.full((height, width), NO_LANE, dtype=np.int16)
+        boundary_flags = np.zeros((height, width), dtype=np.uint8)
+
+        for index, lane in enumerate(self.lanes):
+            inside = lane.polygon_mask(width, height) & (lane_labels == NO_LANE)
+            lane_labels[inside] = index
+            boundary_flags[inside & lane.boundary_mask(0, 1, boundary_offset, width, height)] |= NEAR_UPPER_BOUNDARY
+            boundary_flags[inside & lane.boundary_mask(2, 3, boundary_offset, width, height)] |= NEAR_LOWER_BOUNDARY
+
+        self.lane_labels = lane_labels
+        self.boundary_flags = boundary_flags
+
+    # union bounding rectangle of all lanes grown by the padding and clipped to the frame, (x1, y1, x2, y2)
+    def bounding_rect(self, padding_x, padding_y, width, height):
+        if not self.lanes:
+            return None
+
+        coords = np.array([point for lane in self.lanes for point in lane.coords], dtype=np.float64)
+        x1, y1 = np.floor(coords.min(axis=0) - [padding_x, padding_y])
+        x2, y2 = np.ceil(coords.max(axis=0) + [padding_x, padding_y])
+        return max(0, int(x1)), max(0, int(y1)), min(width, int(x2)), min(height, int(y2))
 
     def get_lane(self, cx, cy):
+        if self.lane_labels is not None:
+            lane_indexes, _ = self.locate(np.array([[cx, cy]]))
+            return None if lane_indexes[0] == NO_LANE else self.lanes[lane_indexes[0]]
+
         for lane in self.lanes:
             if lane.point_inside_polygon(cx, cy):
                 return lane
         return None
 
+    # centers - int array of shape (n, 2); returns lane indexes (NO_LANE outside of lanes) and boundary flags
+    def locate(self, centers):
+        height, width = self.lane_labels.shape
+        cx = centers[:, 0]
+        cy = centers[:, 1]
+        in_frame = (cx >= 0) & (cx < width) & (cy >= 0) & (cy < height)
+
+        lane_indexes = np.full(len(centers), NO_LANE, dtype=np.int16)
+        flags = np.zeros(len(centers), dtype=np.uint8)
+        lane_indexes[in_frame] = self.lane_labels[cy[in_frame], cx[in_frame]]
+        flags[in_frame] = self.boundary_flags[cy[in_frame], cx[in_frame]]
+
+        return lane_indexes, flags
+
     def conv_lanes_coordinates(self, init_width, init_height, new_width, new_height):
         for lane in self.lanes:
             lane.conv_coordinates(init_width, init_height, new_width, new_height)
+        # previously compiled rasters describe the old coordinates
+        self.lane_labels = None
+        self.boundary_flags = None
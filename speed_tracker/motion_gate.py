@@ -0,0 +1,81 @@
+import time
+
+import cv2
+import numpy as np
+
+GATE_SCALE = 4            # the gate looks at the preprocessed frame downscaled by this factor
+PIXEL_THRESHOLD = 25      # gray level change of a pixel counted as motion
+MIN_CHANGED_PIXELS = 6    # changed lane pixels that open the gate
+MASK_PADDING = 10         # gate pixels the lane mask is grown by, so vehicles about to enter a lane open the gate
+HOLD_FRAMES = 10          # sampled frames detection keeps running after the last motion
+MAX_SKIPPED_FRAMES = 25   # detection still runs this often, which also refreshes the reference frame
+
+
+# Cheap pre-filter in front of the detection model. A sampled frame is only sent to detection when the lanes
+# changed against the last frame detection saw without vehicles, while vehicles are tracked near the lanes and for
+# HOLD_FRAMES after motion stops, so the tracker gets consecutive frames from the moment a vehicle shows up.
+class MotionGate:
+    # lane_mask - bool raster of the preprocessed frame, True inside the lanes
+    def __init__(self, lane_mask, hold_frames=HOLD_FRAMES, max_skipped_frames=MAX_SKIPPED_FRAMES):
+        height, width = lane_mask.shape
+        self.size = (max(1, width // GATE_SCALE), max(1, height // GATE_SCALE))
+        mask = cv2.resize(lane_mask.astype(np.uint8), self.size, interpolation=cv2.INTER_NEAREST)
+        kernel = np.ones((2 * MASK_PADDING + 1, 2 * MASK_PADDING + 1), dtype=np.uint8)
+        self.mask = cv2.dilate(mask, kernel).astype(bool)
+        self.hold_frames = hold_frames
+        self.max_skipped_frames = max_skipped_frames
+
+        self.reference = None
+        self.vehicles_present = False
+        self.hold = 0
+        self.skipped_in_row = 0
+        self.stats = {'frames': 0, 'skipped': 0, 'gate_seconds': 0.0}
+
+    def gate_frame(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+    # returns whether the frame needs detection and the gate frame to hand back to observe()
+    def check(self, frame):
+        started_at = time.perf_counter()
+        gate_frame = self.gate_frame(frame)
+
+        motion = False
+        if self.reference is not None:
+            changed = cv2.absdiff(gate_frame, self.reference) > PIXEL_THRESHOLD
+            motion = np.count_nonzero(changed & self.mask) >= MIN_CHANGED_PIXELS
+        if motion:
+            self.hold = self.hold_frames
+        elif self.hold > 0:
+            self.hold -= 1
+
+        # without a reference nothing is known about the lanes yet
+        needs_detection = motion or self.hold > 0 or self.vehicles_present or self.reference is None \
+            or self.skipped_in_row >= self.max_skipped_frames
+
+        self.skipped_in_row = 0 if needs_detection else self.skipped_in_row + 1
+        self.stats['frames'] += 1
+        self.stats['skipped'] += not needs_detection
+        self.stats['gate_seconds'] += time.perf_counter() - started_at
+        return needs_detection, gate_frame
+
+    # centers - (n, 2) centers of the tracked vehicles in preprocessed coordinates
+    def observe(self, gate_frame, centers):
+        cells = np.asarray(centers, dtype=np.int64).reshape(-1, 2) // GATE_SCALE
+        width, height = self.size
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < width) & (cells[:, 1] >= 0) & (cells[:, 1] < height)
+        cells = cells[inside]
+        self.vehicles_present = bool(self.mask[cells[:, 1], cells[:, 0]].any())
+
+        # frames without vehicles become the picture of the empty road the next frames are compared to
+        if not self.vehicles_present:
+            self.reference = gate_frame
+
+    def report(self):
+        frames = self.stats['frames']
+        return {
+            'gated_frames': frames,
+            'skipped_frames': self.stats['skipped'],
+            'skip_rate': round(self.stats['skipped'] / frames, 3) if frames else 0.0,
+            'gate_ms_per_frame': round(1000 * self.stats['gate_seconds'] / frames, 3) if frames else 0.0,
+        }
@@ -1,5 +1,12 @@
 import math
 
+import numpy as np
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
 HYPOT_THRESHOLD = 35
 
 
@@ -11,11 +18,10 @@ class ObjectTracker:
     def update(self, objects_rect):
         objects_bbs_ids = []
 
-        for rect in objects_rect:
-            x, y, w, h = rect
-            cx = (x + x + w) // 2
-            cy = (y + y + h) // 2
+        rects = np.asarray(objects_rect, dtype=np.int64).reshape(-1, 4)
+        centers = (2 * rects[:, :2] + rects[:, 2:]) // 2
 
+        for (x, y, w, h), (cx, cy) in zip(rects.tolist(), centers.tolist()):
             same_object_detected = False
             for object_id, pt in self.center_points.items():
                 dist = math.hypot(cx - pt[0], cy - pt[1])
@@ -39,3 +45,75 @@ class ObjectTracker:
 
         self.center_points = new_center_points.copy()
         return objects_bbs_ids
+
+
+class VectorizedObjectTracker:
+    # max_missed_frames - number of consecutive frames a track survives without a matching detection
+    def __init__(self, max_distance=HYPOT_THRESHOLD, max_missed_frames=0):
+        self.max_distance = max_distance
+        self.max_missed_frames = max_missed_frames
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.track_centers = np.empty((0, 2), dtype=np.int64)
+        self.track_missed = np.empty(0, dtype=np.int64)
+        self.id_count = 0
+
+    @property
+    def center_points(self):
+        return {object_id: tuple(center) for object_id, center in zip(self.track_ids.tolist(), self.track_centers.tolist())}
+
+    def update(self, objects_rect):
+        rects = np.asarray(objects_rect, dtype=np.int64).reshape(-1, 4)
+        centers = (2 * rects[:, :2] + rects[:, 2:]) // 2
+
+        detection_rows, track_cols = self.assign(centers)
+
+        detection_ids = np.full(len(rects), -1, dtype=np.int64)
+        detection_ids[detection_rows] = self.track_ids[track_cols]
+
+        new_detections = detection_ids < 0
+        new_count = int(new_detections.sum())
+        detection_ids[new_detections] = np.arange(self.id_count, self.id_count + new_count)
+        self.id_count += new_count
+
+        track_matched = np.zeros(len(self.track_ids), dtype=bool)
+        track_matched[track_cols] = True
+        self.track_missed[track_matched] = 0
+        self.track_missed[~track_matched] += 1
+        track_alive = ~track_matched & (self.track_missed <= self.max_missed_frames)
+
+        self.track_ids = np.concatenate([detection_ids, self.track_ids[track_alive]])
+        self.track_centers = np.concatenate([centers, self.track_centers[track_alive]])
+        self.track_missed = np.concatenate([np.zeros(len(rects), dtype=np.int64), self.track_missed[track_alive]])
+
+        return np.column_stack([rects, detection_ids]).tolist()
+
+    def assign(self, centers):
+        if len(centers) == 0 or len(self.track_ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # squared distances keep the comparison exact and avoid a square root per pair
+        dx = centers[:, 0, np.newaxis] - self.track_centers[np.newaxis, :, 0]
+        dy = centers[:, 1, np.newaxis] - self.track_centers[np.newaxis, :, 1]
+        distances = dx * dx + dy * dy
+        allowed = distances < self.max_distance ** 2
+
+        if linear_sum_assignment is not None:
+            cost = np.where(allowed, distances, self.max_distance ** 2 * len(centers) + 1)
+            rows, cols = linear_sum_assignment(cost)
+            matched = allowed[rows, cols]
+            return rows[matched], cols[matched]
+
+        # without scipy: globally greedy, the closest pairs below the threshold are matched first
+        rows, cols = np.nonzero(allowed)
+        order = np.argsort(distances[rows, cols], kind='stable')
+        row_used = [False] * len(centers)
+        col_used = [False] * len(self.track_ids)
+        matched_rows, matched_cols = [], []
+        for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+            if row_used[row] or col_used[col]:
+                continue
+            row_used[row] = col_used[col] = True
+            matched_rows.append(row)
+            matched_cols.append(col)
+
+        return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64)
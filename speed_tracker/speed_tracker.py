@@ -1,18 +1,25 @@
 import json
 import logging
+import time
 
 import cv2
 import numpy as np
-import pandas as pd
-from torch import Tensor
-from ultralytics import YOLO
 
-from utils import get_rect_center
+from inference.backends import create_detector
+from lane_locator import NO_LANE, NEAR_UPPER_BOUNDARY, NEAR_LOWER_BOUNDARY
+from motion_gate import MotionGate
+from pipeline.adaptive_sampler import AdaptiveSampler, DEFAULT_MAX_LAG
+from pipeline.frame_sampler import FrameSampler
+from pipeline.metrics import PipelineMetrics
+from utils import get_rect_centers
 
 FRAMES_INTERVAL = 2
 PREPROCESSED_VIDEO_WIDTH = 1080
 PREPROCESSED_VIDEO_HEIGHT = 720
 CROSSING_DETECTION_OFFSET = 20
+VEHICLE_TYPES = ['car', 'bus', 'truck', 'motorcycle']
+STAGES = ['decode', 'motion_gate', 'preprocess', 'inference', 'postprocess']
+DROP_COUNTERS = ['dropped_by_motion_gate']
 
 
 class CrossingData:
@@ -32,10 +39,51 @@ class SpeedData:
         self.is_up = is_up
 
 
+# Part of the frame covering the lanes, the only place where speeds are measured. The crop keeps its native resolution
+# while it fits into the preprocessed size and is scaled down to fit otherwise, detections are mapped back to the
+# preprocessed frame the lanes and the tracker work in.
+class DetectionRegion:
+    def __init__(self, rect, frame_width, frame_height):
+        self.x1, self.y1, self.x2, self.y2 = rect
+        width, height = self.x2 - self.x1, self.y2 - self.y1
+        self.scale = min(1.0, PREPROCESSED_VIDEO_WIDTH / width, PREPROCESSED_VIDEO_HEIGHT / height)
+        self.size = (max(1, round(width * self.scale)), max(1, round(height * self.scale)))
+        self.offset = np.array([self.x1, self.y1, self.x1, self.y1], dtype=np.float32)
+        self.to_preprocessed = np.array([PREPROCESSED_VIDEO_WIDTH / frame_width, PREPROCESSED_VIDEO_HEIGHT / frame_height] * 2,
+                                        dtype=np.float32)
+        self.area_ratio = width * height / (frame_width * frame_height)
+
+    def crop(self, frame):
+        crop = frame[self.y1:self.y2, self.x1:self.x2]
+        if self.scale < 1:
+            return cv2.resize(crop, self.size, interpolation=cv2.INTER_AREA)
+        # frames of a shared bus are reused once the batch moves on
+        return crop.copy()
+
+    def map_detections(self, detections):
+        mapped = np.array(detections, dtype=np.float32).reshape(-1, 6)
+        mapped[:, :4] = (mapped[:, :4] / self.scale + self.offset) * self.to_preprocessed
+        return mapped
+
+
 class SpeedTracker:
-    def __init__(self, model_path, class_list, object_tracker, lane_locator, debug=False):
-        self.model = YOLO(model_path)
+    # model - path to the weights or a detector with predict(frames) -> one (N, 6) detections array per frame:
+    # an inference.backends detector or a stream of a shared inference server
+    # batch_size - frames per model call, max_batch_delay - seconds a frame may wait for the batch to fill, also
+    # while no frames arrive
+    # result_handler - called with every speed result, stop_event - ends processing once it is set
+    # roi_padding - detect only on the rectangle around the lanes grown by this many preprocessed pixels,
+    # None detects on the whole frame
+    # min_frames_interval, max_frames_interval - bounds of the distance between detected frames, the interval grows
+    # while processing lags more than max_lag seconds behind real time or the lanes are empty, None keeps it fixed
+    # motion_gate - skip detection on frames without motion in the lanes
+    def __init__(self, model, class_list, object_tracker, lane_locator, debug=False, batch_size=1,
+                 max_batch_delay=None, result_handler=None, stop_event=None, roi_padding=None,
+                 min_frames_interval=FRAMES_INTERVAL, max_frames_interval=None, max_lag=DEFAULT_MAX_LAG,
+                 motion_gate=False):
+        self.model = create_detector(model) if isinstance(model, str) else model
         self.class_list = class_list
+        self.vehicle_class_ids = np.array([i for i, c in enumerate(class_list) if c in VEHICLE_TYPES], dtype=np.int64)
         self.object_tracker = object_tracker
         self.lane_locator = lane_locator
         self.object_id_2_crossing_data = {}
@@ -43,73 +91,205 @@ class SpeedTracker:
         for lane in self.lane_locator.lanes:
             self.lane_id_2_speed_data[lane.id] = []
         self.debug = debug
+        self.batch_size = max(1, batch_size)
+        self.max_batch_delay = max_batch_delay
+        self.result_handler = result_handler if result_handler is not None else print_result
+        self.stop_event = stop_event
+        self.roi_padding = roi_padding
+        self.detection_region = None
+        self.min_frames_interval = min_frames_interval
+        self.max_frames_interval = max_frames_interval
+        self.max_lag = max_lag
+        self.sampler = None
+        self.motion_gate = motion_gate
+        self.gate = None
+        self.progress = {'frames': 0, 'frame_time': None}
+        self.metrics = PipelineMetrics(STAGES, DROP_COUNTERS)
+
+    # progress with the stage timings, reported to the orchestrator with every heartbeat
+    def status(self):
+        return {**self.progress, 'metrics': self.metrics.snapshot()}
+
+    def create_sampler(self, fps):
+        self.sampler = AdaptiveSampler(fps, self.min_frames_interval, self.max_frames_interval, self.max_lag)
+        return self.sampler
 
     def process_video(self, video_path):
         cap = cv2.VideoCapture(video_path)
         frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
 
+        # frame timestamps come from the capture, skipped frames are grabbed or seeked without being converted
+        sampler = self.create_sampler(cap.get(cv2.CAP_PROP_FPS))
+        frame_sampler = FrameSampler(cap, sampler.min_step - 1, sampler.step)
+        sampler.drive(frame_sampler)
+        self.process_frames(frame_sampler, frame_width, frame_height)
+
+        cap.release()
+
+    def process_frame_bus(self, frame_bus):
+        # the decoder reads ahead of the registered sampling, so the bus keeps delivering every min_step-th frame
+        # and frames beyond the current step are dropped here
+        # a stalled live source yields None after max_batch_delay, so a started batch does not wait for it
+        sampler = self.create_sampler(frame_bus.fps)
+        frames = frame_bus.frames(sampler.min_step - 1, sampler.min_step, self.max_batch_delay)
+        self.process_frames(frames, frame_bus.width, frame_bus.height)
+
+    # frames - iterable of (index, frame_time, frame), frame_time in seconds from the start of the video, or None
+    # when the source has not delivered the next frame in time
+    def process_frames(self, frames, frame_width, frame_height):
+        if self.sampler is None:
+            self.create_sampler(None)
+        self.detection_region = self.create_detection_region(frame_width, frame_height)
         self.lane_locator.conv_lanes_coordinates(frame_width, frame_height, PREPROCESSED_VIDEO_WIDTH,
                                                  PREPROCESSED_VIDEO_HEIGHT)
-
-        frames_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
+        self.lane_locator.compile(PREPROCESSED_VIDEO_WIDTH, PREPROCESSED_VIDEO_HEIGHT, CROSSING_DETECTION_OFFSET)
+        self.gate = MotionGate(self.lane_locator.lane_labels != NO_LANE) if self.motion_gate else None
+
+        batch = []
+        batch_started_at = None
+        metrics = self.metrics
+        for item in metrics.timed('decode', frames):
+            if self.stop_event is not None and self.stop_event.is_set():
                 break
+            # a started batch is checked on every frame, also on ones that are sampled out or gated
+            if batch and (item is None or self.batch_is_late(batch_started_at)):
+                should_continue = self.process_batch(batch)
+                batch = []
+                if not should_continue:
+                    break
+            if item is None:
+                continue
 
-            frames_count += 1
-            if frames_count % FRAMES_INTERVAL != 0:
+            index, frame_time, frame = item
+            metrics.count_skipped(index)
+            if not self.sampler.should_process(index):
+                metrics.count('dropped_by_sampling')
                 continue
 
-            frame = cv2.resize(frame, (PREPROCESSED_VIDEO_WIDTH, PREPROCESSED_VIDEO_HEIGHT))
+            self.update_progress(frame_time)
+
+            gate_frame = None
+            if self.gate is not None:
+                started_at = time.perf_counter()
+                needs_detection, gate_frame = self.gate.check(frame)
+                metrics.observe('motion_gate', time.perf_counter() - started_at)
+                if not needs_detection:
+                    metrics.count('dropped_by_motion_gate')
+                    self.sampler.update(frame_time, False)
+                    continue
+
+            started_at = time.perf_counter()
+            frame, detection_input = self.preprocess_frame(frame)
+            metrics.observe('preprocess', time.perf_counter() - started_at)
+
+            if not batch:
+                batch_started_at = time.monotonic()
+            batch.append((frame_time, frame, detection_input, gate_frame))
+
+            if len(batch) >= self.batch_size or self.batch_is_late(batch_started_at):
+                should_continue = self.process_batch(batch)
+                batch = []
+                if not should_continue:
+                    break
+        else:
+            if batch:
+                self.process_batch(batch)
 
-            results = self.model.predict(frame, device="mps", verbose=False)
-            bounding_boxes = self.get_bounding_boxes(results)
-            bbox_id = self.update_tracker(bounding_boxes)
+        # headless OpenCV builds have no window support, only the debug view opens a window
+        if self.debug:
+            cv2.destroyAllWindows()
 
-            for bbox in bbox_id:
-                x3, y3, x4, y4, id = bbox
-                cx, cy = get_rect_center(x3, y3, x4, y4)
+    def batch_is_late(self, batch_started_at):
+        return self.max_batch_delay is not None and time.monotonic() - batch_started_at >= self.max_batch_delay
 
-                speed = self.process_speed(id, cx, cy, frames_count, fps)
-                if speed is not None:
-                    print(json.dumps(vars(speed)))
+    # returns the preprocessed frame (None when only the detection region is needed) and the detection model input
+    def preprocess_frame(self, frame):
+        if self.detection_region is None:
+            frame = cv2.resize(frame, (PREPROCESSED_VIDEO_WIDTH, PREPROCESSED_VIDEO_HEIGHT))
+            return frame, frame
+
+        detection_input = self.detection_region.crop(frame)
+        # the whole preprocessed frame is only needed to show the debug view
+        frame = cv2.resize(frame, (PREPROCESSED_VIDEO_WIDTH, PREPROCESSED_VIDEO_HEIGHT)) if self.debug else None
+        return frame, detection_input
+
+    def update_progress(self, frame_time):
+        progress = {'frames': self.progress['frames'] + 1, 'frame_time': frame_time, **self.sampler.stats()}
+        self.metrics.record_frame(self.sampler.lag)
+        if self.gate is not None:
+            progress.update(self.gate.report())
+        self.progress = progress
+
+    def create_detection_region(self, frame_width, frame_height):
+        if self.roi_padding is None:
+            return None
 
-                draw_elements(frame, bbox, cx, cy, id, x3, y3, x4, y4, speed)
+        padding_x = self.roi_padding * frame_width / PREPROCESSED_VIDEO_WIDTH
+        padding_y = self.roi_padding * frame_height / PREPROCESSED_VIDEO_HEIGHT
+        rect = self.lane_locator.bounding_rect(padding_x, padding_y, frame_width, frame_height)
+        if rect is None or rect[0] >= rect[2] or rect[1] >= rect[3]:
+            return None
+        return DetectionRegion(rect, frame_width, frame_height)
+
+    def process_batch(self, batch):
+        started_at = time.perf_counter()
+        results = self.model.predict([detection_input for _, _, detection_input, _ in batch])
+        self.metrics.observe('inference', time.perf_counter() - started_at)
+
+        # detections are replayed in frame order, so tracking does not depend on the batch size
+        for (frame_time, frame, _, gate_frame), detections in zip(batch, results):
+            started_at = time.perf_counter()
+            if self.detection_region is not None:
+                detections = self.detection_region.map_detections(detections)
+            should_continue = self.process_detections(frame, frame_time, detections, gate_frame)
+            self.metrics.observe('postprocess', time.perf_counter() - started_at)
+            if not should_continue:
+                return False
+
+        return True
+
+    def process_detections(self, frame, frame_time, detections, gate_frame=None):
+        bounding_boxes = self.get_bounding_boxes(detections)
+        bbox_id = np.asarray(self.update_tracker(bounding_boxes), dtype=np.int64).reshape(-1, 5)
+        centers = get_rect_centers(bbox_id)
+        lane_indexes, boundary_flags = self.lane_locator.locate(centers)
+        if self.gate is not None:
+            self.gate.observe(gate_frame, centers)
+        self.sampler.update(frame_time, bool((lane_indexes != NO_LANE).any()))
+
+        for bbox, (cx, cy), lane_index, flags in zip(bbox_id.tolist(), centers.tolist(), lane_indexes.tolist(),
+                                                     boundary_flags.tolist()):
+            x3, y3, x4, y4, id = bbox
+
+            lane = None if lane_index == NO_LANE else self.lane_locator.lanes[lane_index]
+            speed = self.update_crossing(id, lane, bool(flags & NEAR_UPPER_BOUNDARY), bool(flags & NEAR_LOWER_BOUNDARY),
+                                         frame_time)
+            if speed is not None:
+                self.result_handler({**vars(speed), 'sampling_rate': self.sampler.rate})
 
             if self.debug:
-                self.draw_lanes_on_video(frame)
-
-                cv2.imshow("RGB", frame)
-                if cv2.waitKey(1) & 0xFF == 27:
-                    break
+                draw_elements(frame, bbox, cx, cy, id, x3, y3, x4, y4, speed)
 
-        cap.release()
-        cv2.destroyAllWindows()
+        if self.debug:
+            self.draw_lanes_on_video(frame)
 
-    def get_bounding_boxes(self, yolo_results):
-        bounding_boxes = []
-        a = yolo_results[0].boxes.data
-        px = pd.DataFrame(Tensor.cpu(a)).astype("float")
+            cv2.imshow("RGB", frame)
+            if cv2.waitKey(1) & 0xFF == 27:
+                return False
 
-        for index, row in px.iterrows():
-            x1, y1, x2, y2, _, d = map(int, row[:6])
-            c = self.class_list[d]
+        return True
 
-            vehicle_types = ['car', 'bus', 'truck', 'motorcycle']
-            if c in vehicle_types:
-                bounding_boxes.append([x1, y1, x2, y2])
+    def get_bounding_boxes(self, detections):
+        # rows are [x1, y1, x2, y2, confidence, class_id]
+        is_vehicle = np.isin(detections[:, 5].astype(np.int64), self.vehicle_class_ids)
 
-        return bounding_boxes
+        return np.ascontiguousarray(detections[is_vehicle, :4].astype(np.int32))
 
     def update_tracker(self, bounding_boxes):
         return self.object_tracker.update(bounding_boxes)
 
-    def process_speed(self, id, cx, cy, frame_number, fps):
-        lane = self.lane_locator.get_lane(cx, cy)
-        frame_time = frame_number / fps  # time in seconds from start of the video.py
+    def update_crossing(self, id, lane, is_near_upper_boundary, is_near_lower_boundary, frame_time):
         crossing_data = self.object_id_2_crossing_data.get(id)
 
         speed_data = None
@@ -117,8 +297,6 @@ class SpeedTracker:
             return None
 
         if lane is not None:
-            is_near_upper_boundary = lane.point_near_upper_boundary(cx, cy, CROSSING_DETECTION_OFFSET)
-            is_near_lower_boundary = lane.point_near_lower_boundary(cx, cy, CROSSING_DETECTION_OFFSET)
             if crossing_data is None:
                 if is_near_upper_boundary:
                     self.object_id_2_crossing_data[id] = CrossingData(lane.id, frame_time, False)
@@ -142,6 +320,10 @@ class SpeedTracker:
                 break
 
 
+def print_result(result):
+    print(json.dumps(result))
+
+
 def draw_elements(frame, bbox, cx, cy, id, x3, y3, x4, y4, speed_data):
     cv2.rectangle(frame, (x3, y3), (x4, y4), (0, 0, 255), 2)
     cv2.circle(frame, (cx, cy), 4, (0, 0, 255), -1)
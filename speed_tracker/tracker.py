@@ -1,9 +1,18 @@
 import argparse
 import json
+import os
+import signal
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inference.backends import create_detector, DETECTION_BACKENDS
 from lane_locator import Lane, LaneLocator
-from object_tracker import ObjectTracker
-from speed_tracker import SpeedTracker
+from object_tracker import ObjectTracker, VectorizedObjectTracker
+from pipeline.adaptive_sampler import DEFAULT_MAX_LAG
+from pipeline.frame_bus import FrameBusReader
+from pipeline.result_channel import ResultChannel, JOB_FINISHED
+from speed_tracker import SpeedTracker, FRAMES_INTERVAL
 
 
 def read_class_list(file_path):
@@ -18,6 +27,23 @@ if __name__ == '__main__':
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
     parser.add_argument('--video_path', type=str, default='../videos/2_poland.mp4', help='Path to the video ')
     parser.add_argument('--lanes', type=str, default=None, help='lanes config')
+    parser.add_argument('--frame_bus', type=str, default=None, help='Name of the shared frame bus to read frames from')
+    parser.add_argument('--tracker', choices=['vectorized', 'simple'], default='vectorized', help='Object tracker engine')
+    parser.add_argument('--max_missed_frames', type=int, default=0, help='Frames a track is kept alive without detections')
+    parser.add_argument('--batch_size', type=int, default=1, help='Number of frames per detection model call')
+    parser.add_argument('--max_batch_delay', type=float, default=None, help='Max seconds a frame waits for its batch to fill')
+    parser.add_argument('--roi_padding', type=int, default=None, help='Detect only around the lanes with this padding in preprocessed pixels, whole frame when omitted')
+    parser.add_argument('--frames_interval', type=int, default=FRAMES_INTERVAL, help='Distance between detected frames')
+    parser.add_argument('--max_frames_interval', type=int, default=None, help='Distance the adaptive sampling may grow to, fixed sampling when omitted')
+    parser.add_argument('--offline', action='store_true', help='Recorded file without a real-time deadline, the sampling only follows the traffic')
+    parser.add_argument('--max_lag', type=float, default=DEFAULT_MAX_LAG, help='Seconds behind real time before the sampling is reduced')
+    parser.add_argument('--motion_gate', action='store_true', help='Skip detection on frames without motion in the lanes')
+    parser.add_argument('--frame_bus_consumer', type=int, default=0, help='Consumer slot on the shared frame bus')
+    parser.add_argument('--result_fd', type=int, default=None, help='File descriptor of the result channel, results are printed without it')
+    parser.add_argument('--job_id', type=str, default=None, help='Id the results are reported under on the result channel')
+    parser.add_argument('--model_path', type=str, default='speed_tracker/models/yolov8x.pt', help='Path to the YOLO weights or their ONNX export')
+    parser.add_argument('--backend', choices=DETECTION_BACKENDS, default='auto', help='Detection inference backend')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
 
     args = parser.parse_args()
 
@@ -33,7 +59,7 @@ if __name__ == '__main__':
     else:
         lanes = [Lane(**lane) for lane in json.loads(lanes)]
 
-    model_path = "speed_tracker/models/yolov8x.pt"
+    model_path = args.model_path
     classes_path = "speed_tracker/coco.txt"
 
     #local debug
@@ -42,8 +68,40 @@ if __name__ == '__main__':
 
 
     class_list = read_class_list(classes_path)
-    objectTracker = ObjectTracker()
+    if args.tracker == 'simple':
+        objectTracker = ObjectTracker()
+    else:
+        objectTracker = VectorizedObjectTracker(max_missed_frames=args.max_missed_frames)
+
+    channel = None
+    result_handler = None
+    if args.result_fd is not None:
+        channel = ResultChannel(args.result_fd)
+        result_handler = lambda result: channel.send_result(args.job_id, result)
 
     lane_locator = LaneLocator(lanes)
-    speedTracker = SpeedTracker(model_path, class_list, objectTracker, lane_locator, debug=is_debug)
-    speedTracker.process_video(video_path)
+    speedTracker = SpeedTracker(create_detector(model_path, args.backend, args.device), class_list, objectTracker, lane_locator, debug=is_debug,
+                                batch_size=args.batch_size, max_batch_delay=args.max_batch_delay,
+                                result_handler=result_handler, roi_padding=args.roi_padding,
+                                min_frames_interval=args.frames_interval, max_frames_interval=args.max_frames_interval,
+                                max_lag=None if args.offline else args.max_lag, motion_gate=args.motion_gate)
+    if channel is not None:
+        channel.track_progress(args.job_id, speedTracker.status)
+
+    # release the bus cursor and send the buffered results on stop
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        if args.frame_bus is None:
+            speedTracker.process_video(video_path)
+        else:
+            frame_bus = FrameBusReader(args.frame_bus, args.frame_bus_consumer)
+            try:
+                speedTracker.process_frame_bus(frame_bus)
+            finally:
+                frame_bus.close()
+    finally:
+        if channel is not None:
+            # the last progress carries the final stage timings
+            channel.heartbeat()
+            channel.send(JOB_FINISHED, {'job_id': args.job_id, 'error': None})
+            channel.close()
@@ -1,5 +1,5 @@
-def get_rect_center(x1, y1, x2, y2):
-    return (x1 + x2) // 2, (y1 + y2) // 2
+def get_rect_centers(rects):
+    return (rects[:, :2] + rects[:, 2:4]) // 2
 
 
 def conv_point(point, init_width, init_height, new_width, new_height):
@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inference.backends import create_detector, DETECTION_BACKENDS
+from lane_locator import Lane, LaneLocator
+from object_tracker import VectorizedObjectTracker
+from pipeline.adaptive_sampler import DEFAULT_MAX_LAG
+from pipeline.frame_bus import FrameBusReader
+from pipeline.inference_server import InferenceServer
+from pipeline.result_channel import ResultChannel
+from pipeline.worker import Worker
+from speed_tracker import SpeedTracker, FRAMES_INTERVAL
+from tracker import read_class_list
+
+
+# Long-lived speed worker: the detection model is loaded once and shared by every job the orchestrator sends.
+# Jobs run on their own threads and their frames are batched together by the inference server.
+# job - {'id', 'video_path', 'lanes', 'frame_bus', 'frame_bus_consumer', 'batch_size', 'max_batch_delay',
+#        'max_missed_frames', 'roi_padding', 'min_frames_interval', 'max_frames_interval', 'max_lag', 'motion_gate',
+#        'debug'}
+def run_job(job, channel, stop_event, inference_server, class_list):
+    lanes = [Lane(**lane) for lane in job['lanes']]
+    stream = inference_server.open_stream(job['id'])
+    speed_tracker = SpeedTracker(stream, class_list,
+                                 VectorizedObjectTracker(max_missed_frames=job.get('max_missed_frames', 0)),
+                                 LaneLocator(lanes), debug=job.get('debug', False),
+                                 batch_size=job.get('batch_size', 1), max_batch_delay=job.get('max_batch_delay'),
+                                 result_handler=lambda result: channel.send_result(job['id'], result),
+                                 stop_event=stop_event, roi_padding=job.get('roi_padding'),
+                                 min_frames_interval=job.get('min_frames_interval', FRAMES_INTERVAL),
+                                 max_frames_interval=job.get('max_frames_interval'),
+                                 max_lag=job.get('max_lag', DEFAULT_MAX_LAG), motion_gate=job.get('motion_gate', False))
+    channel.track_progress(job['id'], speed_tracker.status)
+
+    try:
+        if job.get('frame_bus') is None:
+            speed_tracker.process_video(job['video_path'])
+        else:
+            frame_bus = FrameBusReader(job['frame_bus'], job['frame_bus_consumer'])
+            try:
+                speed_tracker.process_frame_bus(frame_bus)
+            finally:
+                frame_bus.close()
+    finally:
+        stream.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--model_path', type=str, default='speed_tracker/models/yolov8x.pt', help='Path to the YOLO weights or their ONNX export')
+    parser.add_argument('--backend', choices=DETECTION_BACKENDS, default='auto', help='Detection inference backend')
+    parser.add_argument('--device', type=str, default=None, help='Inference device, detected when omitted')
+    parser.add_argument('--classes_path', type=str, default='speed_tracker/coco.txt', help='Path to the class list')
+    parser.add_argument('--result_fd', type=int, required=True, help='File descriptor of the result channel')
+    parser.add_argument('--max_jobs', type=int, default=1, help='Number of videos processed at the same time')
+    parser.add_argument('--max_batch_size', type=int, default=16, help='Frames per detection model call, across videos')
+    parser.add_argument('--max_batch_delay', type=float, default=0.05, help='Max seconds a frame waits for its batch to fill')
+
+    args = parser.parse_args()
+
+    detector = create_detector(args.model_path, args.backend, args.device)
+    class_list = read_class_list(args.classes_path)
+    inference_server = InferenceServer(detector.predict, args.max_batch_size, args.max_batch_delay)
+
+    channel = ResultChannel(args.result_fd, stats=inference_server.stats)
+
+    Worker(lambda job, channel, stop_event: run_job(job, channel, stop_event, inference_server, class_list), channel,
+           max_jobs=args.max_jobs).serve()
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import cv2
+import numpy as np
+import pytest
+
+from app.service.processing_service import ProcessingService
+from pipeline.frame_bus import FrameBus, FrameBusReader, RELEASED_CURSOR
+
+DECODER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pipeline', 'run_decoder.py')
+
+
+def bus_name():
+    return f"ta_test_{uuid.uuid4().hex[:12]}"
+
+
+def write_video(path, frames_count, width=64, height=48, fps=25):
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for index in range(frames_count):
+        writer.write(np.full((height, width, 3), index % 256, dtype=np.uint8))
+    writer.release()
+    return str(path)
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus.create(bus_name(), width=4, height=2, channels=3, fps=25, consumers=2, slots=4)
+    yield bus
+    bus.close()
+
+
+def test_release_consumer_before_the_bus_exists_fails():
+    assert not FrameBus.release_consumer(bus_name(), 0)
+
+
+def test_release_consumer_releases_the_cursor(bus):
+    assert FrameBus.release_consumer(bus.name, 1)
+
+    assert bus.cursors[1] == RELEASED_CURSOR
+    assert bus.cursors[0] == 0
+
+
+def test_acquire_waits_for_every_consumer(bus):
+    for index in range(bus.slots):
+        assert bus.acquire(index, timeout=0) is not None
+
+    # consumer 0 still holds frame 0, its slot is the next to be reused
+    bus.cursors[1] = bus.slots
+    assert bus.acquire(bus.slots, timeout=0.05) is None
+
+    bus.release(0)
+    assert bus.acquire(bus.slots, timeout=0) is not None
+
+
+def test_frames_for_stops_at_the_end_of_the_video(bus):
+    for index in range(3):
+        bus.acquire(index)[:] = index
+        bus.publish(index, index / 25)
+    bus.finish(3)
+
+    frames = [(index, int(frame[0, 0, 0])) for index, _, frame in bus.frames_for(0, 0, 1)]
+
+    assert frames == [(0, 0), (1, 1), (2, 2)]
+
+
+def test_frames_for_yields_none_while_the_source_stalls(bus):
+    bus.acquire(0)[:] = 0
+    bus.publish(0, 0.0)
+
+    frames = bus.frames_for(0, 0, 1, idle_timeout=0.05)
+
+    assert next(frames)[0] == 0
+    assert next(frames) is None
+
+
+def run_decoder(video_path, name, consumer_timeout):
+    return asyncio.create_subprocess_exec(sys.executable, DECODER, '--video_path', video_path, '--name', name,
+                                          '--consumers', '2', '--slots', '4',
+                                          '--consumer_timeout', str(consumer_timeout))
+
+
+def read_all(name, consumer):
+    reader = FrameBusReader(name, consumer)
+    try:
+        return [index for index, _, _ in reader.frames(0, 1)]
+    finally:
+        reader.close()
+
+
+def test_consumer_released_before_the_bus_exists_does_not_stall_the_decoder(tmp_path):
+    video_path = write_video(tmp_path / 'video.avi', 200)
+    name = bus_name()
+
+    async def run():
+        # the other pipeline is stopped before the decoder has even started
+        assert not FrameBus.release_consumer(name, 1)
+        decoder = await run_decoder(video_path, name, consumer_timeout=30)
+        release = asyncio.create_task(ProcessingService.release_consumer_when_created(name, 1, decoder, 0.01))
+
+        started_at = time.monotonic()
+        indexes = await asyncio.get_running_loop().run_in_executor(None, read_all, name, 0)
+        elapsed = time.monotonic() - started_at
+
+        await release
+        await decoder.wait()
+        return indexes, elapsed
+
+    indexes, elapsed = asyncio.run(run())
+
+    assert indexes == list(range(200))
+    assert elapsed < 10
+
+
+def test_decoder_ends_the_video_when_a_consumer_holds_a_slot_too_long(tmp_path):
+    video_path = write_video(tmp_path / 'video.avi', 200)
+    name = bus_name()
+
+    async def run():
+        decoder = await run_decoder(video_path, name, consumer_timeout=0.5)
+        # consumer 1 never reads, the reader of consumer 0 gets the frames decoded before the deadline
+        indexes = await asyncio.get_running_loop().run_in_executor(None, read_all, name, 0)
+        decoder.terminate()
+        await decoder.wait()
+        return indexes
+
+    indexes = asyncio.run(run())
+
+    assert indexes == list(range(4))
@@ -0,0 +1,66 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from mtlcr.mtlcr import CompiledLanes, calc_mtlcr, SEGMENTATION_WIDTH, SEGMENTATION_HEIGHT
+
+WIDTH = 1280
+HEIGHT = 720
+
+
+def random_lane(rng):
+    # trapezoid narrowing towards the horizon, as lanes are drawn on a road camera view
+    bottom = int(rng.integers(HEIGHT // 4, HEIGHT))
+    top = int(rng.integers(0, bottom - 10))
+    left = int(rng.integers(0, WIDTH - 60))
+    width = int(rng.integers(30, min(400, WIDTH - left)))
+    # narrow lanes are the ones where interpolation differences show, the top stays wide enough to be a quadrilateral
+    # once scaled down to the segmentation mask
+    inset = int(rng.integers(0, (width - 20) // 2))
+    return {'dl': (left, bottom), 'dr': (left + width, bottom), 'hl': (left + inset, top),
+            'hr': (left + width - inset, top)}
+
+
+def random_masks(rng, count):
+    noise = rng.random((count, SEGMENTATION_HEIGHT // 8, SEGMENTATION_WIDTH // 8)) > 0.6
+    blobs = noise.repeat(8, axis=1).repeat(8, axis=2)
+    return (blobs | (rng.random(blobs.shape) > 0.9)).astype(np.int64)[..., np.newaxis]
+
+
+def test_batch_matches_warp_perspective_baseline():
+    rng = np.random.default_rng(0)
+    for _ in range(100):
+        lanes = [random_lane(rng) for _ in range(int(rng.integers(1, 5)))]
+        masks = random_masks(rng, 3)
+        compiled = CompiledLanes(lanes, WIDTH, HEIGHT)
+
+        batch = compiled.calc_mtlcr_batch(masks)
+
+        for mask, lanes_mtlcr in zip(masks, batch):
+            assert lanes_mtlcr == [calc_mtlcr(mask, WIDTH, HEIGHT, lane)[0] for lane in lanes]
+            assert compiled.calc_mtlcr(mask) == lanes_mtlcr
+
+
+@pytest.mark.parametrize('lane', [
+    {'dl': (100, 400), 'dr': (300, 400), 'hl': (120, 400), 'hr': (280, 400)},   # no height
+    {'dl': (100, 400), 'dr': (100, 400), 'hl': (100, 100), 'hr': (100, 100)},   # no width
+    {'dl': (100, 400), 'dr': (300, 400), 'hl': (280, 100), 'hr': (120, 100)},   # crossed corners
+    {'dl': (100, 400), 'dr': (300, 400), 'hl': (200, 100), 'hr': (200, 100)},   # triangle
+])
+def test_degenerate_lane_has_zero_mtlcr(lane):
+    regular = {'dl': (400, 600), 'dr': (600, 600), 'hl': (450, 200), 'hr': (550, 200)}
+    masks = np.ones((2, SEGMENTATION_HEIGHT, SEGMENTATION_WIDTH, 1), dtype=np.int64)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        compiled = CompiledLanes([lane, regular], WIDTH, HEIGHT)
+        batch = compiled.calc_mtlcr_batch(masks)
+
+    assert batch == [[0.0, 1.0], [0.0, 1.0]]
+
+
+def test_video_without_lanes():
+    compiled = CompiledLanes([], WIDTH, HEIGHT)
+
+    assert compiled.calc_mtlcr_batch(np.zeros((2, SEGMENTATION_HEIGHT, SEGMENTATION_WIDTH, 1))) == [[], []]
@@ -0,0 +1,82 @@
+import base64
+from datetime import datetime
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+from bson import ObjectId
+
+from app.service.db_service import DBService
+from app.service.pagination import (encode_cursor, decode_cursor, encode_result, parse_page_params,
+                                    DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT)
+
+
+def page_params(query):
+    return parse_page_params(make_mocked_request('GET', f"/processes/p/speed_results{query}"))
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2024, 5, 17, 13, 45, 2, 123456)
+    object_id = ObjectId()
+
+    assert decode_cursor(encode_cursor(created_at, object_id)) == (created_at, object_id)
+
+
+def test_result_cursor_points_at_the_result():
+    object_id = ObjectId()
+    created_at = datetime(2024, 1, 1, 8)
+    document = {'_id': object_id, 'created_at': created_at, 'result': {'speed': 52}}
+
+    encoded = encode_result(document)
+
+    assert '_id' not in encoded
+    assert decode_cursor(document['cursor']) == (created_at, object_id)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    encode_cursor(datetime(2024, 1, 1), 'not-an-object-id'),
+    base64.urlsafe_b64encode(b'2024-01-01').decode('ascii'),   # no object id
+])
+def test_invalid_cursor_is_a_bad_request(cursor):
+    with pytest.raises(web.HTTPBadRequest):
+        decode_cursor(cursor)
+
+
+def test_page_params_defaults():
+    assert page_params('') == {'since': None, 'until': None, 'cursor': None, 'limit': DEFAULT_PAGE_LIMIT}
+
+
+def test_page_params():
+    object_id = ObjectId()
+    cursor = encode_cursor(datetime(2024, 1, 1, 12, 30), object_id)
+
+    params = page_params(f"?since=2024-01-01T10:00:00&until=2024-01-01T14:00:00&cursor={cursor}&limit=50")
+
+    assert params == {
+        'since': datetime(2024, 1, 1, 10),
+        'until': datetime(2024, 1, 1, 14),
+        'cursor': (datetime(2024, 1, 1, 12, 30), object_id),
+        'limit': 50,
+    }
+
+
+@pytest.mark.parametrize('query', ['?limit=ten', '?limit=0', '?limit=-5', f"?limit={MAX_PAGE_LIMIT + 1}",
+                                   '?since=yesterday', '?until=2024-13-01'])
+def test_invalid_page_params_are_a_bad_request(query):
+    with pytest.raises(web.HTTPBadRequest):
+        page_params(query)
+
+
+def test_page_filter_continues_after_the_cursor():
+    cursor = (datetime(2024, 1, 1, 12), ObjectId())
+
+    page_filter = DBService.page_filter({'parent_process_id': 'p'}, since=datetime(2024, 1, 1), cursor=cursor)
+
+    assert page_filter == {'$and': [
+        {'parent_process_id': 'p', 'created_at': {'$gte': datetime(2024, 1, 1)}},
+        {'$or': [
+            {'created_at': {'$lt': cursor[0]}},
+            {'created_at': cursor[0], '_id': {'$lt': cursor[1]}},
+        ]},
+    ]}
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from app.service import result_writer
+from app.service.result_writer import ResultWriter
+
+
+class FlakyDatabase:
+    # fails the first `failures` inserts, or every insert containing a result of a process in `broken_processes`
+    def __init__(self, failures=0, broken_processes=()):
+        self.failures = failures
+        self.broken_processes = set(broken_processes)
+        self.attempts = 0
+        self.documents = []
+
+    async def insert_many(self, documents):
+        self.attempts += 1
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("database unavailable")
+        if any(document['process_id'] in self.broken_processes for document in documents):
+            raise ValueError("document rejected")
+        self.documents.extend(documents)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(result_writer, 'WRITE_RETRY_DELAYS', (0, 0, 0))
+
+
+def run(database, scenario, **kwargs):
+    async def main():
+        writer = ResultWriter('test', database.insert_many, **kwargs)
+        writer.start()
+        try:
+            return await scenario(writer)
+        finally:
+            await writer.close()
+
+    return asyncio.run(main())
+
+
+def test_failed_batch_is_retried():
+    database = FlakyDatabase(failures=2)
+
+    async def scenario(writer):
+        for index in range(3):
+            await writer.save('video', 'process', index, {'index': index})
+        return await writer.flush('process'), writer.stats()
+
+    flushed, stats = run(database, scenario)
+
+    assert flushed
+    assert database.attempts == 3
+    assert [document['result']['index'] for document in database.documents] == [0, 1, 2]
+    assert stats['written'] == 3 and stats['failed'] == 0 and stats['batches'] == 1
+
+
+def test_flush_reports_results_given_up_on():
+    database = FlakyDatabase(failures=10)
+
+    async def scenario(writer):
+        await writer.save('video', 'process', 0, {})
+        return await writer.flush('process'), writer.stats()
+
+    flushed, stats = run(database, scenario)
+
+    assert not flushed
+    assert database.attempts == len(result_writer.WRITE_RETRY_DELAYS) + 1
+    assert stats['failed'] == 1 and stats['written'] == 0
+
+
+def test_failure_is_reported_to_its_process_only():
+    database = FlakyDatabase(broken_processes={'broken'})
+
+    async def scenario(writer):
+        await writer.save('video', 'broken', 0, {})
+        await writer.save('video', 'healthy', 0, {})
+        # the batch of the other process failed since the previous flush, the results of this one were written
+        healthy = await writer.flush('healthy')
+        broken = await writer.flush('broken')
+        # the failure is reported once
+        return healthy, broken, await writer.flush('broken')
+
+    assert run(database, scenario, max_batch_size=1) == (True, False, True)
+
+
+def test_results_are_written_after_the_flush_interval():
+    database = FlakyDatabase()
+
+    async def scenario(writer):
+        await writer.save('video', 'process', 0, {})
+        await asyncio.sleep(0.2)
+        return len(database.documents)
+
+    assert run(database, scenario, flush_interval=0.05) == 1
+
+
+def test_full_batch_is_written_without_waiting():
+    database = FlakyDatabase()
+
+    async def scenario(writer):
+        for index in range(5):
+            await writer.save('video', 'process', index, {})
+        await asyncio.sleep(0.05)
+        return len(database.documents), writer.stats()['batches']
+
+    assert run(database, scenario, max_batch_size=5, flush_interval=60) == (5, 1)
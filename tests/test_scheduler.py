@@ -0,0 +1,110 @@
+import asyncio
+
+from app.service.scheduler import AnalysisScheduler, RUNNING, QUEUED, REJECTED
+
+
+class Launches:
+    def __init__(self):
+        self.started = []
+
+    def start(self, analysis_id, fail=False):
+        async def start():
+            self.started.append(analysis_id)
+            if fail:
+                raise RuntimeError("pipeline did not start")
+        return start
+
+
+def run(scenario):
+    async def main():
+        launches = Launches()
+        result = scenario(launches)
+        # lets the launch tasks and their done callbacks run
+        for _ in range(3):
+            await asyncio.sleep(0)
+        return launches, result
+
+    return asyncio.run(main())
+
+
+def test_analyses_beyond_the_limit_are_queued_then_rejected():
+    scheduler = AnalysisScheduler({'speed': 1, 'mtlcr': 1}, max_queued=2)
+
+    def scenario(launches):
+        return [scheduler.submit(analysis_id, ['speed'], launches.start(analysis_id)) for analysis_id in 'abcd']
+
+    launches, statuses = run(scenario)
+
+    assert statuses == [RUNNING, QUEUED, QUEUED, REJECTED]
+    assert launches.started == ['a']
+    stats = scheduler.stats()
+    assert stats['running'] == {'speed': 1, 'mtlcr': 0}
+    assert stats['queue_length'] == 2 and stats['rejected'] == 1
+
+
+def test_free_slot_goes_to_the_highest_priority():
+    scheduler = AnalysisScheduler({'speed': 1, 'mtlcr': 1}, max_queued=10)
+
+    def scenario(launches):
+        scheduler.submit('running', ['speed'], launches.start('running'))
+        scheduler.submit('low', ['speed'], launches.start('low'), priority='low')
+        scheduler.submit('normal', ['speed'], launches.start('normal'))
+        scheduler.submit('high', ['speed'], launches.start('high'), priority='high')
+        scheduler.submit('second high', ['speed'], launches.start('second high'), priority='high')
+        positions = scheduler.queue_positions()
+        scheduler.release('running', 'speed')
+        return positions
+
+    launches, positions = run(scenario)
+
+    assert positions == {'high': 1, 'second high': 2, 'normal': 3, 'low': 4}
+    assert launches.started == ['running', 'high']
+
+
+def test_queued_analysis_does_not_get_overtaken():
+    scheduler = AnalysisScheduler({'speed': 1, 'mtlcr': 1}, max_queued=10)
+
+    def scenario(launches):
+        scheduler.submit('both', ['speed', 'mtlcr'], launches.start('both'))
+        scheduler.submit('waiting', ['speed', 'mtlcr'], launches.start('waiting'))
+        scheduler.release('both', 'mtlcr')
+        # an mtlcr slot is free, but the queued analysis came first
+        return scheduler.submit('mtlcr only', ['mtlcr'], launches.start('mtlcr only'))
+
+    launches, status = run(scenario)
+
+    assert status == QUEUED
+    assert launches.started == ['both']
+
+
+def test_cancelled_analysis_leaves_the_queue():
+    scheduler = AnalysisScheduler({'speed': 1}, max_queued=1)
+
+    def scenario(launches):
+        scheduler.submit('running', ['speed'], launches.start('running'))
+        scheduler.submit('queued', ['speed'], launches.start('queued'), process_ids=['process'])
+        cancelled = scheduler.cancel('process')
+        status = scheduler.submit('next', ['speed'], launches.start('next'))
+        scheduler.release('running', 'speed')
+        return cancelled, status
+
+    launches, (cancelled, status) = run(scenario)
+
+    assert cancelled.id == 'queued'
+    assert status == QUEUED
+    assert launches.started == ['running', 'next']
+    assert scheduler.stats()['cancelled'] == 1
+
+
+def test_failed_launch_releases_its_slots():
+    scheduler = AnalysisScheduler({'speed': 1}, max_queued=1)
+
+    def scenario(launches):
+        scheduler.submit('broken', ['speed'], launches.start('broken', fail=True))
+        return scheduler.submit('queued', ['speed'], launches.start('queued'))
+
+    launches, status = run(scenario)
+
+    assert status == QUEUED
+    assert launches.started == ['broken', 'queued']
+    assert scheduler.running == {'speed': 1}
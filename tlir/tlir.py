@@ -1,6 +1,30 @@
+from collections import deque
+
+
 def calc_tlir(mtlcr, speed_list, max_speed):
     if len(speed_list) == 0:
         return 0
 
     avg_speed = sum(speed_list) / len(speed_list)
     return round(mtlcr * (avg_speed / max_speed), 4)
+
+
+class LaneTrafficState:
+    # speed_window - seconds a speed measurement counts for TLIR, max_speeds - most recent measurements used
+    def __init__(self, max_speed, speed_window=60, max_speeds=10):
+        self.max_speed = max_speed
+        self.speed_window = speed_window
+        self.mtlcr = 0
+        self.speeds = deque(maxlen=max_speeds)   # (timestamp, speed), oldest first
+
+    def add_mtlcr(self, mtlcr):
+        self.mtlcr = mtlcr
+
+    def add_speed(self, timestamp, speed):
+        self.speeds.append((timestamp, speed))
+
+    def recent_speeds(self, now):
+        return [speed for timestamp, speed in self.speeds if (now - timestamp).total_seconds() < self.speed_window]
+
+    def calc_tlir(self, now):
+        return calc_tlir(self.mtlcr, self.recent_speeds(now), self.max_speed)